@@ -30,6 +30,17 @@ DATABASES = {
     )
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Take the write lock when a transaction starts so concurrent read-then-write
+    # transactions (stock reservations, cart updates) queue instead of failing
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,
+    })
+    # The shared-cache in-memory test database fails concurrent writers outright
+    # instead of queueing them, which breaks the stock contention tests
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', str(BASE_DIR / 'test_db.sqlite3'))
+
 # Application definition
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -76,6 +87,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'store.middleware.CartCookieMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -92,6 +104,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'store.context_processors.cart',
             ],
         },
     },
@@ -123,10 +136,87 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Catalog snapshot shared by all workers (build with `manage.py build_catalog_snapshot`)
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH')
+CATALOG_SNAPSHOT_CHECK_INTERVAL = float(os.environ.get('CATALOG_SNAPSHOT_CHECK_INTERVAL', '1.0'))
+
+# Seconds stock stays reserved for a cart once checkout starts
+STOCK_RESERVATION_TTL = int(os.environ.get('STOCK_RESERVATION_TTL', '900'))
+
+# Seconds a payment response is replayed for retries with the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', str(60 * 60 * 24)))
+# Seconds a duplicate waits for the first request with its key to finish
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', '10'))
+
+# Cache for facet counts and whole catalog pages; set REDIS_URL so every worker shares one
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', '5000'))},
+        }
+    }
+# Seconds an anonymous catalog page is served before one request re-renders it
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', '300'))
+# Per key family: SOFT_TTL seconds fresh, then stale (one request refreshes, the
+# rest are served the old copy) until HARD_TTL; LOCK_TIMEOUT bounds a refresh and
+# WAIT is how long requests with no copy at all wait for it (store/single_flight.py)
+CACHE_FAMILIES = {
+    'catalog': {
+        'SOFT_TTL': int(os.environ.get('CATALOG_SOFT_TTL', '300')),
+        'HARD_TTL': int(os.environ.get('CATALOG_HARD_TTL', '1800')),
+        # Seconds between checks of the shared catalog version other workers bump
+        'VERSION_CHECK': float(os.environ.get('CATALOG_VERSION_CHECK', '1')),
+    },
+    'pages': {
+        'SOFT_TTL': PAGE_CACHE_TIMEOUT,
+        'HARD_TTL': int(os.environ.get('PAGE_CACHE_HARD_TTL', str(PAGE_CACHE_TIMEOUT * 4))),
+        'LOCK_TIMEOUT': 10,
+        'WAIT': float(os.environ.get('PAGE_CACHE_WAIT', '2')),
+    },
+}
+
+# Seconds between flushes of the buffered view/add-to-cart counters (0 writes each event through)
+POPULARITY_FLUSH_INTERVAL = float(os.environ.get('POPULARITY_FLUSH_INTERVAL', '10'))
+# Seconds for a product's trending score to halve
+POPULARITY_HALF_LIFE = int(os.environ.get('POPULARITY_HALF_LIFE', str(60 * 60 * 24 * 3)))
+
+# Background tasks (django.tasks); run them with `manage.py run_task_worker`
+TASKS = {
+    'default': {
+        'BACKEND': os.environ.get('TASK_BACKEND', 'store.task_queue.DatabaseBackend'),
+        'QUEUES': ['default', 'email'],
+        'OPTIONS': {
+            'MAX_ATTEMPTS': int(os.environ.get('TASK_MAX_ATTEMPTS', '5')),
+            # Tasks of a queue running at once, across all workers
+            'QUEUE_CONCURRENCY': {'email': int(os.environ.get('TASK_EMAIL_CONCURRENCY', '2'))},
+        },
+    }
+}
+
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'CLAWS <orders@claws.store>')
+
 # PayPal (ENV ONLY — DO NOT HARD-CODE)
 PAYPAL_CLIENT_ID = os.environ.get('PAYPAL_CLIENT_ID')
 PAYPAL_CLIENT_SECRET = os.environ.get('PAYPAL_CLIENT_SECRET')
 PAYPAL_MODE = os.environ.get('PAYPAL_MODE', 'sandbox')
+# Overrides the sandbox/live API host, e.g. to point at store.paypal_stub locally
+PAYPAL_API_BASE = os.environ.get('PAYPAL_API_BASE')
+# Id of the webhook registered in the PayPal dashboard; needed to verify deliveries
+PAYPAL_WEBHOOK_ID = os.environ.get('PAYPAL_WEBHOOK_ID')
+# Seconds; a slow PayPal must not hold a worker for longer than this
+PAYPAL_CONNECT_TIMEOUT = float(os.environ.get('PAYPAL_CONNECT_TIMEOUT', '3.05'))
+PAYPAL_READ_TIMEOUT = float(os.environ.get('PAYPAL_READ_TIMEOUT', '10'))
+# Seconds a PayPal order may stay pending (holding stock) before expire_pending_orders cancels it
+PAYPAL_PENDING_ORDER_TTL = int(os.environ.get('PAYPAL_PENDING_ORDER_TTL', '3600'))
 
 # Google OAuth (django-allauth)
 SOCIALACCOUNT_PROVIDERS = {
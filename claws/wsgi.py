@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'claws.settings')
 
 application = get_wsgi_application()
+
+# Build the in-process autocomplete index before the first keystroke arrives
+from store.autocomplete import warm_up  # noqa: E402
+
+warm_up()
@@ -73,68 +73,6 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
-    // Product filtering and sorting
-    const filterButtons = document.querySelectorAll('.filter-btn');
-    const sortSelect = document.getElementById('sortSelect');
-    const productGrid = document.getElementById('productGrid');
-    
-    if (filterButtons.length > 0) {
-        filterButtons.forEach(button => {
-            button.addEventListener('click', function() {
-                // Update active state
-                filterButtons.forEach(btn => btn.classList.remove('active'));
-                this.classList.add('active');
-                
-                // Filter products
-                const filter = this.dataset.filter;
-                filterProducts(filter);
-            });
-        });
-    }
-    
-    if (sortSelect) {
-        sortSelect.addEventListener('change', function() {
-            sortProducts(this.value);
-        });
-    }
-    
-    function filterProducts(filter) {
-        const products = document.querySelectorAll('.catalog-item');
-        
-        products.forEach(product => {
-            const category = product.dataset.category;
-            
-            if (filter === 'all' || category === filter) {
-                product.style.display = 'block';
-                product.style.animation = 'fadeIn 0.5s ease forwards';
-            } else {
-                product.style.display = 'none';
-            }
-        });
-    }
-    
-    function sortProducts(sortBy) {
-        const products = Array.from(document.querySelectorAll('.catalog-item'));
-        const container = document.getElementById('productGrid');
-        
-        products.sort((a, b) => {
-            switch (sortBy) {
-                case 'price-low':
-                    return parseFloat(a.dataset.price) - parseFloat(b.dataset.price);
-                case 'price-high':
-                    return parseFloat(b.dataset.price) - parseFloat(a.dataset.price);
-                case 'name':
-                    return a.dataset.name.localeCompare(b.dataset.name);
-                case 'newest':
-                default:
-                    return 0; // Keep original order
-            }
-        });
-        
-        // Re-append sorted products
-        products.forEach(product => container.appendChild(product));
-    }
-
     // View toggle (grid/list)
     const viewButtons = document.querySelectorAll('.view-btn');
     
@@ -275,61 +213,84 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     // Cart page functionality
+    const cartItemsList = document.getElementById('cartItemsList');
     
     // Quantity controls in cart
-    document.querySelectorAll('.quantity-btn').forEach(btn => {
+    document.querySelectorAll('.qty-btn').forEach(btn => {
         btn.addEventListener('click', function() {
             const itemId = this.dataset.itemId;
-            const isIncrease = this.classList.contains('increase-btn');
-            const input = document.querySelector(`input[data-item-id="${itemId}"]`);
+            const row = this.closest('.cart-item-unique');
+            const display = row ? row.querySelector('.qty-display') : null;
+            if (!display) return;
             
-            if (input) {
-                const current = parseInt(input.value);
-                const max = parseInt(input.max);
-                let newValue = current;
-                
-                if (isIncrease && current < max) {
-                    newValue = current + 1;
-                } else if (!isIncrease && current > 1) {
-                    newValue = current - 1;
-                }
-                
-                if (newValue !== current) {
-                    input.value = newValue;
-                    updateCartItem(itemId, newValue);
-                }
+            const current = parseInt(display.textContent);
+            const newValue = this.classList.contains('increase') ? current + 1 : current - 1;
+            
+            if (newValue < 1) {
+                showRemoveConfirmation(itemId);
+            } else if (newValue <= 99) {
+                updateCart([{op: 'set', item_id: itemId, quantity: newValue}]);
             }
         });
     });
     
-    // Direct quantity input changes
-    document.querySelectorAll('.quantity-input').forEach(input => {
-        input.addEventListener('change', function() {
-            const itemId = this.dataset.itemId;
-            const newValue = parseInt(this.value);
-            updateCartItem(itemId, newValue);
-        });
-    });
-    
     // Remove item buttons
-    document.querySelectorAll('.remove-btn').forEach(btn => {
+    document.querySelectorAll('.remove-item').forEach(btn => {
         btn.addEventListener('click', function() {
-            const itemId = this.dataset.itemId;
-            showRemoveConfirmation(itemId);
+            showRemoveConfirmation(this.dataset.itemId);
         });
     });
     
-    function updateCartItem(itemId, quantity) {
+    // Send a batch of add/set/remove operations; the server applies all or none
+    function updateCart(operations) {
+        if (!cartItemsList) return Promise.resolve(null);
         showLoadingOverlay(true);
         
-        // Simulate API call - replace with actual endpoint
-        setTimeout(() => {
-            // Update the total for this item
-            const totalElement = document.querySelector(`[data-item-id="${itemId}"].total-amount`);
-            if (totalElement) {
-                const price = parseFloat(totalElement.dataset.price);
-                const newTotal = (price * quantity).toFixed(2);
-                totalElement.textContent = `$${newTotal}`;
+        return fetch(cartItemsList.dataset.updateUrl, {
+            method: 'POST',
+            body: JSON.stringify({operations: operations}),
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value
+            }
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                showNotification(data.error || 'Error updating cart', 'error');
+                return null;
+            }
+            renderCart(data.cart);
+            updateCartCount(data.cart.item_count);
+            return data.cart;
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            showNotification('Error updating cart', 'error');
+            return null;
+        })
+        .finally(() => showLoadingOverlay(false));
+    }
+    
+    function renderCart(cart) {
+        if (!cart.items.length) {
+            window.location.reload();
+            return;
+        }
+        
+        const lines = new Map(cart.items.map(item => [String(item.id), item]));
+        cartItemsList.querySelectorAll('.cart-item-unique').forEach(row => {
+            const item = lines.get(row.dataset.itemId);
+            if (!item) {
+                row.style.animation = 'slideOut 0.5s ease forwards';
+                setTimeout(() => row.remove(), 500);
+                return;
+            }
+            row.querySelector('.qty-display').textContent = item.quantity;
+            
+            const totalElement = row.querySelector('.total-amount');
+            if (totalElement.textContent !== `$${item.line_total}`) {
+                totalElement.textContent = `$${item.line_total}`;
                 
                 // Animate the change
                 totalElement.style.transform = 'scale(1.1)';
@@ -339,10 +300,12 @@ document.addEventListener('DOMContentLoaded', function() {
                     totalElement.style.color = '#ffffff';
                 }, 300);
             }
-            
-            updateCartTotals();
-            showLoadingOverlay(false);
-        }, 500);
+        });
+        
+        ['subtotalAmount', 'totalAmount'].forEach(id => {
+            const element = document.getElementById(id);
+            if (element) element.textContent = `$${cart.subtotal}`;
+        });
     }
     
     function showRemoveConfirmation(itemId) {
@@ -354,8 +317,10 @@ document.addEventListener('DOMContentLoaded', function() {
             const cancelBtn = document.getElementById('cancelRemove');
             
             confirmBtn.onclick = () => {
-                removeCartItem(itemId);
                 modal.style.display = 'none';
+                updateCart([{op: 'remove', item_id: itemId}]).then(cart => {
+                    if (cart) showNotification('Item removed from cart', 'success');
+                });
             };
             
             cancelBtn.onclick = () => {
@@ -363,36 +328,6 @@ document.addEventListener('DOMContentLoaded', function() {
             };
         }
     }
-    
-    function removeCartItem(itemId) {
-        const item = document.querySelector(`[data-item-id="${itemId}"].cart-item`);
-        if (item) {
-            item.style.animation = 'slideOut 0.5s ease forwards';
-            setTimeout(() => {
-                item.remove();
-                updateCartTotals();
-                showNotification('Item removed from cart', 'success');
-            }, 500);
-        }
-    }
-    
-    function updateCartTotals() {
-        // Calculate new totals - this would typically be done server-side
-        let subtotal = 0;
-        document.querySelectorAll('.total-amount').forEach(total => {
-            subtotal += parseFloat(total.textContent.replace('$', ''));
-        });
-        
-        const subtotalElement = document.getElementById('subtotalAmount');
-        const totalElement = document.getElementById('totalAmount');
-        
-        if (subtotalElement) {
-            subtotalElement.textContent = `$${subtotal.toFixed(2)}`;
-        }
-        if (totalElement) {
-            totalElement.textContent = `$${subtotal.toFixed(2)}`;
-        }
-    }
 
     // Promo code functionality
     const promoBtn = document.getElementById('applyPromoBtn');
@@ -479,28 +414,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
-    // Checkout form submission
-    const checkoutForm = document.getElementById('checkoutForm');
-    if (checkoutForm) {
-        checkoutForm.addEventListener('submit', function(e) {
-            e.preventDefault();
-            
-            // Show processing modal
-            const processingModal = document.getElementById('processingModal');
-            if (processingModal) {
-                processingModal.style.display = 'block';
-            }
-            
-            // Simulate payment processing
-            setTimeout(() => {
-                if (processingModal) {
-                    processingModal.style.display = 'none';
-                }
-                showNotification('Order placed successfully!', 'success');
-                // Redirect to success page
-            }, 3000);
-        });
-    }
+    // Checkout form submission is handled in store/checkout.html
 
     // Modal functionality
     
@@ -653,9 +567,100 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 4000);
     }
     
-    function updateCartCount() {
-        // This would typically fetch the cart count from the server
-        console.log('Cart updated');
+    // Pass the count when a response already carries it; otherwise ask the server
+    function updateCartCount(count) {
+        const badge = document.getElementById('cartCount');
+        if (!badge) return;
+        
+        const render = value => {
+            badge.textContent = value;
+            badge.classList.toggle('empty', !value);
+        };
+        
+        if (count !== undefined) {
+            render(count);
+            return;
+        }
+        fetch(badge.dataset.countUrl)
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) render(data.count);
+            })
+            .catch(error => console.error('Cart count error:', error));
+    }
+    
+    // Search-as-you-type suggestions
+    const searchForm = document.querySelector('.nav-search');
+    const searchInput = document.getElementById('navSearchInput');
+    const suggestionBox = document.getElementById('searchSuggestions');
+    
+    if (searchForm && searchInput && suggestionBox) {
+        let debounceTimer = null;
+        let latestQuery = '';
+        
+        searchInput.addEventListener('input', function() {
+            clearTimeout(debounceTimer);
+            const query = this.value.trim();
+            if (!query) {
+                suggestionBox.classList.remove('show');
+                return;
+            }
+            debounceTimer = setTimeout(() => fetchSuggestions(query), 80);
+        });
+        
+        searchInput.addEventListener('keydown', function(e) {
+            const items = Array.from(suggestionBox.querySelectorAll('.suggestion-item'));
+            const current = items.findIndex(item => item.classList.contains('active'));
+            if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                e.preventDefault();
+                if (!items.length) return;
+                const next = e.key === 'ArrowDown' ? (current + 1) % items.length : (current - 1 + items.length) % items.length;
+                items.forEach(item => item.classList.remove('active'));
+                items[next].classList.add('active');
+            } else if (e.key === 'Enter' && current >= 0) {
+                e.preventDefault();
+                window.location.href = items[current].href;
+            } else if (e.key === 'Escape') {
+                suggestionBox.classList.remove('show');
+            }
+        });
+        
+        document.addEventListener('click', function(e) {
+            if (!searchForm.contains(e.target)) {
+                suggestionBox.classList.remove('show');
+            }
+        });
+        
+        function fetchSuggestions(query) {
+            latestQuery = query;
+            fetch(`${searchForm.dataset.autocompleteUrl}?q=${encodeURIComponent(query)}`)
+            .then(response => response.json())
+            .then(data => {
+                // Drop responses that arrive after the user has kept typing
+                if (query !== latestQuery || !data.success) return;
+                renderSuggestions(data.results);
+            })
+            .catch(error => console.error('Autocomplete error:', error));
+        }
+        
+        function renderSuggestions(results) {
+            suggestionBox.innerHTML = '';
+            results.forEach(result => {
+                const link = document.createElement('a');
+                link.className = 'suggestion-item';
+                link.href = result.url;
+                
+                const name = document.createElement('span');
+                name.textContent = result.name;
+                const category = document.createElement('span');
+                category.className = 'suggestion-category';
+                category.textContent = result.category || '';
+                
+                link.append(name, category);
+                suggestionBox.appendChild(link);
+            });
+            suggestionBox.classList.toggle('show', results.length > 0);
+        }
     }
     
     // Smooth scrolling for anchor links
@@ -683,25 +688,6 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
-    // Load more functionality
-    const loadMoreBtn = document.getElementById('loadMoreBtn');
-    if (loadMoreBtn) {
-        loadMoreBtn.addEventListener('click', function() {
-            const btnText = this.querySelector('.btn-text');
-            const btnLoader = this.querySelector('.btn-loader');
-            
-            btnText.style.display = 'none';
-            btnLoader.style.display = 'block';
-            
-            // Simulate loading more products
-            setTimeout(() => {
-                btnText.style.display = 'block';
-                btnLoader.style.display = 'none';
-                showNotification('More products loaded!', 'success');
-            }, 2000);
-        });
-    }
-    
     // Staggered animation for grid items
     const gridItems = document.querySelectorAll('.catalog-item, .magazine-item');
     gridItems.forEach((item, index) => {
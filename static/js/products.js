@@ -1,68 +1,148 @@
-// Product Filtering and Sorting
+// Product Filtering, Sorting and Pagination (server-side)
 document.addEventListener('DOMContentLoaded', function() {
-    const filterButtons = document.querySelectorAll('.filter-btn');
-    const sortSelect = document.getElementById('sortSelect');
     const productGrid = document.getElementById('productGrid');
-    
+
     if (!productGrid) return;
-    
-    const products = Array.from(productGrid.querySelectorAll('.card'));
+
+    const filterButtons = document.querySelectorAll('.filter-btn[data-filter]');
+    const sortSelect = document.getElementById('sortSelect');
+    const sizeSelect = document.getElementById('sizeSelect');
+    const minPrice = document.getElementById('minPrice');
+    const maxPrice = document.getElementById('maxPrice');
+    const featuredOnly = document.getElementById('featuredOnly');
+    const priceBucket = document.getElementById('priceBucket');
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+    const emptyCatalog = document.getElementById('emptyCatalog');
+    const activeFilter = document.querySelector('.filter-btn[data-filter].active');
+
+    let category = activeFilter ? activeFilter.dataset.filter : '';
+    let nextCursor = loadMoreBtn ? loadMoreBtn.dataset.nextCursor : '';
+    let loading = false;
+
+    function currentParams() {
+        const params = new URLSearchParams();
+        if (category) params.set('category', category);
+        if (sizeSelect && sizeSelect.value) params.set('size', sizeSelect.value);
+        if (minPrice && minPrice.value) params.set('min_price', minPrice.value);
+        if (maxPrice && maxPrice.value) params.set('max_price', maxPrice.value);
+        if (featuredOnly && featuredOnly.checked) params.set('featured', '1');
+        if (sortSelect && sortSelect.value) params.set('sort', sortSelect.value);
+        return params;
+    }
+
+    function updateFacets(facets) {
+        if (!facets) return;
+
+        facets.categories.forEach(facet => {
+            const count = document.querySelector(`.filter-btn[data-filter="${facet.slug}"] .filter-count`);
+            if (count) count.textContent = facet.count;
+        });
+
+        if (sizeSelect) {
+            facets.sizes.forEach(facet => {
+                const option = sizeSelect.querySelector(`option[value="${facet.code}"]`);
+                if (!option) return;
+                option.textContent = `${option.dataset.label} (${facet.count})`;
+                option.disabled = facet.count === 0 && !option.selected;
+            });
+        }
+
+        if (priceBucket) {
+            const options = priceBucket.querySelectorAll('option[data-label]');
+            facets.prices.forEach((facet, i) => {
+                if (options[i]) options[i].textContent = `${options[i].dataset.label} (${facet.count})`;
+            });
+        }
+
+        const featuredCount = document.getElementById('featuredCount');
+        if (featuredCount) featuredCount.textContent = facets.featured;
+
+        [['statTotal', facets.total], ['statInStock', facets.in_stock]].forEach(([id, value]) => {
+            const stat = document.getElementById(id);
+            if (stat) stat.querySelector('.stat-number').textContent = value.toLocaleString();
+        });
+    }
+
+    function fetchPage(append) {
+        if (loading) return;
+        loading = true;
+
+        const params = currentParams();
+        if (append && nextCursor) params.set('cursor', nextCursor);
+
+        if (loadMoreBtn) {
+            loadMoreBtn.querySelector('.btn-text').style.display = 'none';
+            loadMoreBtn.querySelector('.btn-loader').style.display = 'block';
+        }
+
+        fetch(`${productGrid.dataset.pageUrl}?${params.toString()}`, {
+            headers: {'X-Requested-With': 'XMLHttpRequest'}
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) throw new Error(data.error);
+
+            if (append) {
+                productGrid.insertAdjacentHTML('beforeend', data.html);
+            } else {
+                productGrid.innerHTML = data.html;
+                updateFacets(data.facets);
+                params.delete('cursor');
+                const query = params.toString();
+                history.replaceState(null, '', productGrid.dataset.listUrl + (query ? `?${query}` : ''));
+            }
+
+            // Newly inserted cards skip the scroll observer, so reveal them directly
+            productGrid.querySelectorAll('.card:not(.animate-in)').forEach(card => card.classList.add('animate-in'));
+
+            nextCursor = data.next_cursor || '';
+            if (loadMoreBtn) loadMoreBtn.style.display = nextCursor ? '' : 'none';
+            if (emptyCatalog) emptyCatalog.style.display = productGrid.children.length ? 'none' : '';
+        })
+        .catch(error => {
+            console.error('Catalog error:', error);
+        })
+        .finally(() => {
+            loading = false;
+            if (loadMoreBtn) {
+                loadMoreBtn.querySelector('.btn-text').style.display = 'block';
+                loadMoreBtn.querySelector('.btn-loader').style.display = 'none';
+            }
+        });
+    }
 
     // Filter functionality
     filterButtons.forEach(button => {
         button.addEventListener('click', function() {
-            try {
-                filterButtons.forEach(btn => btn.classList.remove('active'));
-                this.classList.add('active');
-                
-                const filter = this.dataset.filter;
-                if (!filter) return;
-                
-                products.forEach(product => {
-                    const category = product.dataset.category;
-                    
-                    if (filter === 'all' || (category && category.includes(filter))) {
-                        product.style.display = 'block';
-                    } else {
-                        product.style.display = 'none';
-                    }
-                });
-            } catch (error) {
-                console.error('Filter error:', error);
-            }
+            filterButtons.forEach(btn => btn.classList.remove('active'));
+            this.classList.add('active');
+            category = this.dataset.filter;
+            fetchPage(false);
         });
     });
 
-    // Sort functionality
-    if (sortSelect) {
-        sortSelect.addEventListener('change', function() {
-            try {
-                const sortValue = this.value;
-                if (!sortValue) return;
-                
-                const sortedProducts = [...products].sort((a, b) => {
-                    switch (sortValue) {
-                        case 'price-low':
-                            const priceA = parseFloat(a.dataset.price) || 0;
-                            const priceB = parseFloat(b.dataset.price) || 0;
-                            return priceA - priceB;
-                        case 'price-high':
-                            const priceA2 = parseFloat(a.dataset.price) || 0;
-                            const priceB2 = parseFloat(b.dataset.price) || 0;
-                            return priceB2 - priceA2;
-                        case 'name':
-                            const nameA = (a.dataset.name || '').toLowerCase();
-                            const nameB = (b.dataset.name || '').toLowerCase();
-                            return nameA.localeCompare(nameB);
-                        default:
-                            return 0;
-                    }
-                });
-                
-                sortedProducts.forEach(product => productGrid.appendChild(product));
-            } catch (error) {
-                console.error('Sort error:', error);
-            }
+    [sortSelect, sizeSelect, minPrice, maxPrice].forEach(control => {
+        if (control) control.addEventListener('change', () => fetchPage(false));
+    });
+
+    if (priceBucket) {
+        priceBucket.addEventListener('change', function() {
+            const option = this.options[this.selectedIndex];
+            if (minPrice) minPrice.value = option.dataset.min || '';
+            if (maxPrice) maxPrice.value = option.dataset.max || '';
+            fetchPage(false);
         });
     }
-});
\ No newline at end of file
+
+    if (featuredOnly) {
+        featuredOnly.addEventListener('change', function() {
+            this.closest('.filter-btn').classList.toggle('active', this.checked);
+            fetchPage(false);
+        });
+    }
+
+    // Load more functionality
+    if (loadMoreBtn) {
+        loadMoreBtn.addEventListener('click', () => fetchPage(true));
+    }
+});
@@ -1,6 +1,14 @@
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.utils.dateparse import parse_date
 from django.utils.html import format_html
-from .models import Category, Product, Cart, CartItem, Order, OrderItem
+from .checkout import set_order_status
+from .models import Category, Product, Cart, CartItem, Order, OrderItem, QueuedTask, DeadTask, DailySales
+from .sales import default_range, report
+from .search import search_product_ids
+from .task_queue import requeue
+
+ADMIN_SEARCH_LIMIT = 1000
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -16,6 +24,13 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description']
     fields = ['name', 'slug', 'category', 'price', 'description', 'image', 'image_url', 'available_sizes', 'stock', 'featured']
     
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of icontains scans over name and description
+        if not search_term.strip():
+            return queryset, False
+        ids = search_product_ids(search_term, limit=ADMIN_SEARCH_LIMIT)
+        return queryset.filter(id__in=ids), False
+    
     def image_preview(self, obj):
         if obj.get_image_url():
             return format_html('<img src="{}" width="50" height="50" style="object-fit: cover; border-radius: 4px;" />', obj.get_image_url())
@@ -26,8 +41,21 @@ class ProductAdmin(admin.ModelAdmin):
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'total_amount', 'payment_method', 'status', 'created']
     list_filter = ['status', 'payment_method', 'created']
-    readonly_fields = ['created', 'payment_id']
+    # sales_recorded belongs to store.sales; editing it by hand would double count or drop an order
+    readonly_fields = ['created', 'payment_id', 'sales_recorded']
     search_fields = ['user__username', 'user__email']
+    
+    # Staff settle orders here (e.g. out of review). A new status goes through
+    # the same path as the webhooks: stock back on cancel, email, sales rollups.
+    def save_model(self, request, obj, form, change):
+        if not (change and 'status' in form.changed_data):
+            return super().save_model(request, obj, form, change)
+        status = obj.status
+        # Lock the row and start from what it holds now, in case a webhook just moved it
+        obj.status = Order.objects.select_for_update().values_list('status', flat=True).get(pk=obj.pk)
+        super().save_model(request, obj, form, change)
+        if status != obj.status:
+            set_order_status(obj, status)
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
@@ -36,10 +64,74 @@ class OrderItemAdmin(admin.ModelAdmin):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['user', 'session_key', 'created']
-    readonly_fields = ['created']
+    list_display = ['user', 'session_key', 'item_count', 'created']
+    readonly_fields = ['item_count', 'created']
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ['cart', 'product', 'size', 'quantity']
-    list_filter = ['size']
\ No newline at end of file
+    list_filter = ['size']
+    
+    # Admin edits bypass the cart service, so resync the badge counter afterwards
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        obj.cart.refresh_item_count()
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        obj.cart.refresh_item_count()
+    
+    def delete_queryset(self, request, queryset):
+        carts = list(Cart.objects.filter(items__in=queryset).distinct())
+        super().delete_queryset(request, queryset)
+        for cart in carts:
+            cart.refresh_item_count()
+
+@admin.register(QueuedTask)
+class QueuedTaskAdmin(admin.ModelAdmin):
+    list_display = ['task_path', 'queue_name', 'status', 'attempts', 'run_after', 'enqueued_at', 'finished_at']
+    list_filter = ['status', 'queue_name']
+    search_fields = ['id', 'task_path']
+    readonly_fields = [field.name for field in QueuedTask._meta.fields]
+
+@admin.register(DeadTask)
+class DeadTaskAdmin(admin.ModelAdmin):
+    list_display = ['task_path', 'queue_name', 'attempts', 'failed_at']
+    list_filter = ['queue_name', 'task_path']
+    readonly_fields = ['task', 'task_path', 'queue_name', 'args', 'kwargs', 'attempts', 'last_error', 'failed_at']
+    actions = ['requeue_tasks']
+    
+    @admin.action(description='Requeue selected tasks')
+    def requeue_tasks(self, request, queryset):
+        count = requeue(queryset)
+        self.message_user(request, f'Requeued {count} tasks')
+
+@admin.register(DailySales)
+class SalesDashboardAdmin(admin.ModelAdmin):
+    """Sales report read from the daily rollups only, so its cost doesn't grow with the order tables"""
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def changelist_view(self, request, extra_context=None):
+        start, end = default_range()
+        try:
+            start = parse_date(request.GET.get('start') or '') or start
+            end = parse_date(request.GET.get('end') or '') or end
+        except ValueError:
+            pass
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Sales',
+            'opts': self.model._meta,
+            'start': start,
+            'end': end,
+            **report(start, end),
+        }
+        return TemplateResponse(request, 'admin/store/sales_dashboard.html', context)
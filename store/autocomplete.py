@@ -0,0 +1,169 @@
+# In-process prefix index for search-as-you-type over names, slugs and categories
+#
+# Keys live in one sorted array, so every prefix maps to a contiguous
+# range found with two bisects. Ranges wider than HEAVY_RANGE entries
+# ("heavy" prefixes such as "s" or "hoo") get their top results
+# precomputed at build time; every other lookup scans at most
+# HEAVY_RANGE entries. Either way a keystroke costs a bounded amount of
+# work regardless of catalog size.
+import heapq
+import threading
+from bisect import bisect_left
+
+from django.urls import reverse
+
+from .catalog import get_catalog
+
+MAX_RESULTS = 20
+DEFAULT_RESULTS = 8
+HEAVY_RANGE = 256
+MAX_PREFIX = 64
+
+_END = chr(0x10FFFF)
+
+
+def normalize(text):
+    """Lowercase and collapse whitespace so keys and queries compare equal"""
+    return ' '.join((text or '').lower().split())
+
+
+def product_rank(product):
+    """Featured first, then popularity, then in-stock items"""
+    return (
+        1 if product.get('featured') else 0,
+        product.get('popularity', 0),
+        1 if product.get('stock', 0) > 0 else 0,
+    )
+
+
+def product_keys(product):
+    name = normalize(product['name'])
+    keys = {name, normalize(product['slug']), normalize(product.get('category'))}
+    # Later words of the name so "rider" finds "Night Rider Tee"
+    words = name.split(' ')
+    keys.update(' '.join(words[i:]) for i in range(1, len(words)))
+    keys.discard('')
+    return keys
+
+
+class PrefixIndex:
+    """Immutable sorted-array prefix index over a list of product dicts"""
+
+    def __init__(self, products, version=None):
+        self.version = version
+        self.results = []
+        self.ranks = []
+        entries = []
+        # Reverse once and substitute slugs; reversing per product dominates build time
+        url_template = reverse('store:product_detail', args=['__slug__'])
+        for position, product in enumerate(products):
+            self.results.append({
+                'name': product['name'],
+                'slug': product['slug'],
+                'category': product.get('category'),
+                'price': str(product['price']),
+                'image': product.get('image'),
+                'url': url_template.replace('__slug__', product['slug']),
+            })
+            self.ranks.append(product_rank(product))
+            for key in product_keys(product):
+                entries.append((key, position))
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.positions = [position for _, position in entries]
+        self.heavy = {}
+        self._precompute('', 0, len(self.keys))
+
+    def _top(self, lo, hi, limit=MAX_RESULTS):
+        candidates = set(self.positions[lo:hi])
+        ranks = self.ranks
+        return heapq.nlargest(limit, candidates, key=lambda p: (ranks[p], -p))
+
+    def _precompute(self, prefix, lo, hi):
+        """Store top results for every prefix whose range is too wide to scan per request"""
+        if hi - lo <= HEAVY_RANGE or len(prefix) >= MAX_PREFIX:
+            return
+        if prefix:
+            self.heavy[prefix] = self._top(lo, hi)
+        depth = len(prefix)
+        keys = self.keys
+        start = lo
+        # Keys equal to the prefix itself sort first and have no next character
+        while start < hi and len(keys[start]) == depth:
+            start += 1
+        while start < hi:
+            child = keys[start][:depth + 1]
+            end = bisect_left(keys, child + _END, start, hi)
+            self._precompute(child, start, end)
+            start = end
+
+    def lookup(self, query, limit=DEFAULT_RESULTS):
+        """Return up to `limit` ranked result dicts for a typed prefix"""
+        prefix = normalize(query)[:MAX_PREFIX]
+        if not prefix:
+            return []
+        limit = max(1, min(limit, MAX_RESULTS))
+        top = self.heavy.get(prefix)
+        if top is None:
+            lo = bisect_left(self.keys, prefix)
+            hi = bisect_left(self.keys, prefix + _END, lo)
+            top = self._top(lo, hi, limit)
+        return [self.results[p] for p in top[:limit]]
+
+
+_index = None
+_building = False
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def _rebuild_in_background(catalog):
+    global _building
+    with _lock:
+        if _building:
+            return
+        _building = True
+
+    def run():
+        global _index, _building
+        try:
+            _index = PrefixIndex(catalog.products, catalog.version)
+        finally:
+            with _lock:
+                _building = False
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_index():
+    """Return the prefix index for the current catalog
+
+    The first call builds synchronously; after the catalog changes the
+    previous index keeps serving while a background thread rebuilds it.
+    """
+    global _index
+    catalog = get_catalog()
+    index = _index
+    if index is None:
+        with _build_lock:
+            if _index is None:
+                _index = PrefixIndex(catalog.products, catalog.version)
+            return _index
+    if index.version != catalog.version:
+        _rebuild_in_background(catalog)
+    return index
+
+
+def warm_up():
+    """Build the index in the background so the first keystroke is already fast"""
+    def run():
+        try:
+            get_index()
+        except Exception as e:
+            print(f"Autocomplete warm-up error: {e}")
+    threading.Thread(target=run, daemon=True).start()
+
+
+def suggest(query, limit=DEFAULT_RESULTS):
+    """Return ranked autocomplete suggestions"""
+    return get_index().lookup(query, limit)
@@ -0,0 +1,337 @@
+# Cart lookup and batched, atomic cart mutations
+#
+# Signed-in shoppers have a Cart row. Anonymous shoppers get a CookieCart
+# kept in a signed cookie, so browsing and filling a cart never writes to
+# the database; it is folded into the user's Cart when they log in.
+#
+# A batch of add/set/remove operations is applied against one snapshot of
+# the cart: the existing lines and the touched products are read in one
+# query each, stock is checked for the whole batch at once, and a database
+# cart is written back with a single upsert plus a single delete. Either
+# every operation applies or none does.
+import json
+from decimal import Decimal
+
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import CENTS, Cart, CartItem, Product, StockReservation
+
+MAX_QUANTITY = 99
+MAX_OPERATIONS = 50
+OPERATIONS = ('add', 'set', 'remove')
+SIZE_CODES = {code for code, label in Product.SIZES}
+
+COOKIE_NAME = 'cart'
+COOKIE_SALT = 'store.cart'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# Keeps the signed cookie comfortably under the 4KB browser limit
+MAX_COOKIE_LINES = 50
+
+
+def get_cart(request, create=False):
+    """Return the cart for the current user, a CookieCart for anonymous shoppers, or None"""
+    if not request.user.is_authenticated:
+        return CookieCart.from_request(request)
+    if create:
+        return Cart.objects.get_or_create(user=request.user)[0]
+    return Cart.objects.filter(user=request.user).first()
+
+
+def _int(value, field):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f'Invalid {field}')
+
+
+def parse_operations(operations):
+    """Validate raw operation dicts before anything touches the database"""
+    if not isinstance(operations, list) or not operations:
+        raise ValidationError('No cart operations given')
+    if len(operations) > MAX_OPERATIONS:
+        raise ValidationError(f'At most {MAX_OPERATIONS} operations per request')
+
+    parsed = []
+    for raw in operations:
+        if not isinstance(raw, dict) or raw.get('op') not in OPERATIONS:
+            raise ValidationError('Invalid cart operation')
+        op = {'op': raw['op'], 'item_id': None, 'product_id': None, 'size': None}
+        if raw.get('item_id') is not None:
+            op['item_id'] = str(raw['item_id'])
+        else:
+            op['product_id'] = _int(raw.get('product_id'), 'product')
+            op['size'] = raw.get('size')
+            if op['size'] not in SIZE_CODES:
+                raise ValidationError('Invalid size')
+        if op['op'] != 'remove':
+            op['quantity'] = _int(raw.get('quantity', 1), 'quantity')
+            low = 1 if op['op'] == 'add' else 0
+            if not low <= op['quantity'] <= MAX_QUANTITY:
+                raise ValidationError('Invalid quantity')
+        parsed.append(op)
+    return parsed
+
+
+def plan_operations(operations, lines, item_keys):
+    """Apply parsed operations to a {(product_id, size): quantity} map
+
+    `item_keys` maps item ids to line keys. Returns the set of keys that
+    changed; `lines` is updated in place and removed lines are left at 0.
+    """
+    touched = set()
+    for op in operations:
+        if op['item_id'] is not None:
+            key = item_keys.get(op['item_id'])
+            if key is None:
+                raise ValidationError('Cart item not found')
+        else:
+            key = (op['product_id'], op['size'])
+
+        if op['op'] == 'add':
+            lines[key] = lines.get(key, 0) + op['quantity']
+        elif op['op'] == 'set':
+            lines[key] = op['quantity']
+        else:
+            lines[key] = 0
+        touched.add(key)
+
+    for key in touched:
+        if lines[key] > MAX_QUANTITY:
+            raise ValidationError('Invalid quantity')
+    return touched
+
+
+def available_stock(product_ids, cart=None):
+    """{product_id: units the cart may have} in one query
+
+    Once checkout starts, a cart's StockReservation is already taken out
+    of Product.stock, so what it holds is added back for that cart.
+    """
+    products = Product.objects.filter(id__in=product_ids)
+    if cart is None:
+        return dict(products.values_list('id', 'stock'))
+    held = StockReservation.objects.filter(cart=cart, product=OuterRef('pk')).values('quantity')
+    return dict(
+        products.annotate(available=F('stock') + Coalesce(Subquery(held), 0)).values_list('id', 'available')
+    )
+
+
+def check_stock(lines, touched, cart=None):
+    """One query covering every product the batch touched"""
+    product_ids = {product_id for product_id, size in touched}
+    stock = available_stock(product_ids, cart)
+    wanted = {}
+    for (product_id, size), quantity in lines.items():
+        if product_id in product_ids:
+            wanted[product_id] = wanted.get(product_id, 0) + quantity
+    for product_id, quantity in wanted.items():
+        if product_id not in stock:
+            raise ValidationError('Product not found')
+        if quantity > stock[product_id]:
+            raise ValidationError('Not enough stock available')
+
+
+def apply_operations(cart, operations):
+    """Apply add/set/remove operations to `cart` in one transaction
+
+    Lines are keyed by (product, size). `add` increments (creating the line
+    if needed), `set` replaces the quantity (0 removes the line) and
+    `remove` deletes the line. Raises ValidationError, leaving the cart
+    untouched, if any operation is invalid or the result exceeds stock.
+    """
+    operations = parse_operations(operations)
+    if isinstance(cart, CookieCart):
+        return cart.apply(operations)
+
+    with transaction.atomic():
+        # Serialize concurrent batches for the same cart
+        Cart.objects.select_for_update().filter(pk=cart.pk).first()
+
+        existing = list(CartItem.objects.filter(cart=cart).only('id', 'product_id', 'size', 'quantity'))
+        lines = {(item.product_id, item.size): item.quantity for item in existing}
+        item_keys = {str(item.id): (item.product_id, item.size) for item in existing}
+        touched = plan_operations(operations, lines, item_keys)
+        check_stock(lines, touched, cart)
+
+        upserts = [
+            CartItem(cart=cart, product_id=key[0], size=key[1], quantity=lines[key])
+            for key in touched if lines[key]
+        ]
+        if upserts:
+            CartItem.objects.bulk_create(
+                upserts,
+                update_conflicts=True,
+                unique_fields=['cart', 'product', 'size'],
+                update_fields=['quantity'],
+            )
+        removed_ids = [item.id for item in existing if not lines[(item.product_id, item.size)]]
+        if removed_ids:
+            CartItem.objects.filter(id__in=removed_ids).delete()
+
+        cart.item_count = sum(lines.values())
+        Cart.objects.filter(pk=cart.pk).update(item_count=cart.item_count)
+
+    return cart
+
+
+def merge_lines(cart, lines):
+    """Add {(product_id, size): quantity} lines to a database cart with one upsert
+
+    Used when an anonymous cart meets a user's saved cart; quantities are
+    clamped to stock rather than rejected so logging in never fails.
+    """
+    lines = {key: quantity for key, quantity in lines.items() if quantity > 0}
+    if not lines:
+        return
+    with transaction.atomic():
+        Cart.objects.select_for_update().filter(pk=cart.pk).first()
+        merged = {
+            (item.product_id, item.size): item.quantity
+            for item in CartItem.objects.filter(cart=cart).only('product_id', 'size', 'quantity')
+        }
+        stock = available_stock({product_id for product_id, size in lines}, cart)
+        upserts = []
+        for (product_id, size), quantity in lines.items():
+            if product_id not in stock:
+                continue
+            quantity = min(merged.get((product_id, size), 0) + quantity, MAX_QUANTITY, stock[product_id])
+            if quantity > 0:
+                merged[(product_id, size)] = quantity
+                upserts.append(CartItem(cart=cart, product_id=product_id, size=size, quantity=quantity))
+        if upserts:
+            CartItem.objects.bulk_create(
+                upserts,
+                update_conflicts=True,
+                unique_fields=['cart', 'product', 'size'],
+                update_fields=['quantity'],
+            )
+            cart.item_count = sum(merged.values())
+            Cart.objects.filter(pk=cart.pk).update(item_count=cart.item_count)
+
+
+class CookieCart:
+    """An anonymous shopper's cart, stored as [[product_id, size, quantity], ...] in a signed cookie
+
+    Changes are written back by store.middleware.CartCookieMiddleware
+    when the response goes out, so views treat it like any other cart.
+    """
+
+    def __init__(self, lines=None):
+        self.lines = lines or {}
+        self.modified = False
+        self.cleared = False
+
+    @classmethod
+    def from_request(cls, request):
+        cart = getattr(request, '_cookie_cart', None)
+        if cart is None:
+            cart = cls(cls.load(request))
+            request._cookie_cart = cart
+        return cart
+
+    @staticmethod
+    def load(request):
+        try:
+            raw = request.get_signed_cookie(COOKIE_NAME, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE)
+            rows = json.loads(raw)
+            return {
+                (int(product_id), size): int(quantity)
+                for product_id, size, quantity in rows[:MAX_COOKIE_LINES]
+                if size in SIZE_CODES and 0 < int(quantity) <= MAX_QUANTITY
+            }
+        except (KeyError, signing.BadSignature, ValueError, TypeError):
+            return {}
+
+    @property
+    def item_count(self):
+        return sum(self.lines.values())
+
+    @staticmethod
+    def item_id(key):
+        return f'{key[0]}-{key[1]}'
+
+    def apply(self, operations):
+        lines = dict(self.lines)
+        item_keys = {self.item_id(key): key for key in lines}
+        touched = plan_operations(operations, lines, item_keys)
+        check_stock(lines, touched)
+        lines = {key: quantity for key, quantity in lines.items() if quantity}
+        if len(lines) > MAX_COOKIE_LINES:
+            raise ValidationError('Your cart is full')
+        self.lines = lines
+        self.modified = True
+        return self
+
+    def clear(self):
+        self.lines = {}
+        self.cleared = True
+
+    def get_summary(self):
+        """Same shape as Cart.get_summary(), with unsaved CartItem lines; one query"""
+        products = Product.objects.select_related('category').in_bulk({product_id for product_id, size in self.lines})
+        items = []
+        for (product_id, size), quantity in self.lines.items():
+            product = products.get(product_id)
+            if product is None:
+                continue
+            item = CartItem(product=product, size=size, quantity=quantity)
+            item.id = self.item_id((product_id, size))
+            item.line_total = (product.price * quantity).quantize(CENTS)
+            items.append(item)
+        return {
+            'items': items,
+            'subtotal': sum((item.line_total for item in items), Decimal('0.00')),
+            'item_count': sum(item.quantity for item in items),
+            'line_count': len(items),
+        }
+
+    def dumps(self):
+        return json.dumps([[p, s, q] for (p, s), q in self.lines.items()], separators=(',', ':'))
+
+    def save(self, response):
+        if self.cleared and not self.lines:
+            response.delete_cookie(COOKIE_NAME)
+        elif self.modified or self.cleared:
+            response.set_signed_cookie(
+                COOKIE_NAME, self.dumps(), salt=COOKIE_SALT,
+                max_age=COOKIE_MAX_AGE, httponly=True, samesite='Lax',
+            )
+
+
+def merge_cookie_cart(request, user):
+    """Fold the anonymous cookie cart into the user's saved cart and drop the cookie"""
+    cart = CookieCart.from_request(request)
+    if cart.lines:
+        merge_lines(Cart.objects.get_or_create(user=user)[0], cart.lines)
+    cart.clear()
+
+
+def get_cart_count(request):
+    """Number of items in the shopper's cart: one indexed read for users, none for anonymous shoppers"""
+    if not request.user.is_authenticated:
+        return CookieCart.from_request(request).item_count
+    count = Cart.objects.filter(user=request.user).values_list('item_count', flat=True).first()
+    return count or 0
+
+
+def summary_to_dict(summary):
+    """JSON-friendly view of Cart.get_summary() for the cart page"""
+    return {
+        'items': [
+            {
+                'id': item.id,
+                'product_id': item.product_id,
+                'size': item.size,
+                'quantity': item.quantity,
+                'line_total': str(item.line_total),
+            }
+            for item in summary['items']
+        ],
+        'subtotal': str(summary['subtotal']),
+        'item_count': summary['item_count'],
+        'line_count': summary['line_count'],
+    }
@@ -0,0 +1,157 @@
+# Indexed catalog repository shared by the storefront views
+from .single_flight import LocalValue
+from .snapshot import get_snapshot_catalog
+from .static_data import STATIC_PRODUCTS, STATIC_CATEGORIES
+
+
+def slugify_category(name):
+    """Normalize a category name the same way the category URLs do"""
+    return name.lower().replace(' ', '-').replace('_', '-')
+
+
+class Catalog:
+    """Immutable snapshot of the catalog with lookup indexes built once"""
+
+    def __init__(self, products, categories, version=0):
+        self.version = version
+        self.products = list(products)
+        self.categories = list(categories)
+        self.by_slug = {}
+        self.by_id = {}
+        self.by_category = {}
+        self.featured = []
+        self.category_by_slug = {}
+
+        for category in self.categories:
+            self.category_by_slug[category['slug']] = category
+            self.by_category[category['slug']] = []
+
+        for product in self.products:
+            self.by_slug[product['slug']] = product
+            self.by_id[product['id']] = product
+            self.by_category.setdefault(product['category_slug'], []).append(product)
+            if product.get('featured', False):
+                self.featured.append(product)
+
+
+def product_to_card(product):
+    """Flatten a Product row into the fields a product card needs (no description)"""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'slug': product.slug,
+        'category': product.category.name,
+        'category_slug': product.category.slug,
+        'price': product.price,
+        'image': product.get_image_url(),
+        'available_sizes': product.available_sizes,
+        'stock': product.stock,
+        'featured': product.featured,
+        'created': product.created,
+    }
+
+
+def product_to_dict(product):
+    """Flatten a Product row into the dict shape the templates expect"""
+    return dict(product_to_card(product), description=product.description)
+
+
+def category_to_dict(category, image=None):
+    """Flatten a Category row, borrowing artwork from the static collections"""
+    static = next((c for c in STATIC_CATEGORIES if c['slug'] == category.slug), {})
+    return {
+        'id': category.id,
+        'name': category.name,
+        'slug': category.slug,
+        'image': static.get('image') or image,
+        'description': static.get('description', ''),
+    }
+
+
+def load_static_catalog(version=0):
+    """Build a catalog from the bundled static data"""
+    products = [
+        dict(product, category_slug=slugify_category(product['category']))
+        for product in STATIC_PRODUCTS
+    ]
+    return Catalog(products, STATIC_CATEGORIES, version)
+
+
+def load_database_catalog(version=0):
+    """Build a catalog from the Product and Category tables, or None if empty"""
+    from .models import Category, Product, ProductPopularity
+    from .popularity import score
+
+    products = [product_to_dict(p) for p in Product.objects.select_related('category')]
+    if not products:
+        return None
+    # Decayed as of this build; the catalog is rebuilt whenever products change
+    trends = dict(ProductPopularity.objects.values_list('product_id', 'trend'))
+    for product in products:
+        product['popularity'] = score(trends.get(product['id']))
+
+    first_image = {}
+    for product in products:
+        first_image.setdefault(product['category_slug'], product['image'])
+    categories = [
+        category_to_dict(c, first_image.get(c.slug))
+        for c in Category.objects.order_by('id')
+    ]
+    return Catalog(products, categories, version)
+
+
+def load_catalog(version=0):
+    """Prefer the database catalog and fall back to the static data"""
+    return load_database_catalog(version) or load_static_catalog(version)
+
+
+# Shared version key: a write in one worker retires every worker's copy
+_catalog = LocalValue('catalog', load_catalog, version_key='catalog:version')
+
+
+def get_catalog():
+    """Return the cached catalog; one thread rebuilds it when stale while the rest keep using it"""
+    snapshot = get_snapshot_catalog()
+    if snapshot is not None:
+        return snapshot
+    return _catalog.get()
+
+
+def invalidate_catalog(**kwargs):
+    """Mark the cached catalog stale; the next lookup rebuilds the indexes"""
+    _catalog.invalidate()
+
+
+def get_featured_products():
+    """Return featured products"""
+    return get_catalog().featured
+
+
+def get_all_products():
+    """Return all products"""
+    return get_catalog().products
+
+
+def get_products_by_category(category_slug):
+    """Return products filtered by category"""
+    return get_catalog().by_category.get(category_slug, [])
+
+
+def get_product_by_slug(slug):
+    """Return single product by slug"""
+    return get_catalog().by_slug.get(slug)
+
+
+def get_product_by_id(product_id):
+    """Return single product by id"""
+    return get_catalog().by_id.get(product_id)
+
+
+def get_all_categories():
+    """Return all categories"""
+    return get_catalog().categories
+
+
+def get_category_by_slug(slug):
+    """Return single category by slug"""
+    return get_catalog().category_by_slug.get(slug)
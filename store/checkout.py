@@ -0,0 +1,94 @@
+# Turning a cart into an order
+#
+# Totals always come from the database, never from the browser, and the
+# order, its items and the emptied cart are written in one transaction
+# with a fixed number of queries however large the cart is (plus the one
+# conditional stock UPDATE per product that reserving takes). Anything that
+# can happen later (emails, sales rollups) is queued as a task in that same
+# transaction.
+#
+# Every later status change (PayPal webhooks, the pending order sweep, staff
+# in the admin) goes through set_order_status(), so a cancelled order always
+# gets its stock back and the customer and the rollups always hear about it.
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.crypto import get_random_string
+
+from .inventory import consume_reservations, reserve_cart, restock_order
+from .models import CENTS, Cart, Order, OrderItem, line_total
+from .tasks import send_order_email, sync_order_sales
+
+
+def shipping_fields(shipping_data):
+    """Order fields from the checkout form's shipping data"""
+    shipping_data = shipping_data if isinstance(shipping_data, dict) else {}
+    return {
+        'shipping_address': f"{shipping_data.get('address', '')}, {shipping_data.get('city', '')}, {shipping_data.get('state', '')} {shipping_data.get('zip_code', '')}",
+        'email': shipping_data.get('email', ''),
+        'phone': shipping_data.get('phone', ''),
+    }
+
+
+def place_order(user, payment_method, payment_id, shipping_data, expected_total=None, status='completed'):
+    """Create an order from the user's cart and empty the cart, all or nothing
+
+    `expected_total` is the amount the payment provider confirmed; if the
+    cart changed since then the order is refused rather than charged wrongly.
+    Without a `payment_id` a random one is made up for the method.
+    """
+    with transaction.atomic():
+        # Lock the cart so a concurrent checkout or cart edit waits for us
+        cart = Cart.objects.select_for_update().filter(user=user).first()
+        if not cart:
+            raise ValidationError('Cart not found')
+
+        items = list(cart.items.select_related('product'))
+        if not items:
+            raise ValidationError('Your cart is empty')
+
+        total = cart.items.aggregate(total=Sum(line_total()))['total'].quantize(CENTS)
+        if expected_total is not None and total != expected_total:
+            raise ValidationError('Cart changed during payment')
+
+        # Take any stock not already held (or whose hold lapsed), then keep it for good
+        reserve_cart(cart)
+        consume_reservations(cart)
+
+        order = Order.objects.create(
+            user=user,
+            total_amount=total,
+            payment_method=payment_method,
+            payment_id=payment_id or f'{payment_method}_{get_random_string(16)}',
+            status=status,
+            **Order.summarize(items),
+            **shipping_fields(shipping_data)
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item.product,
+                quantity=item.quantity,
+                size=item.size,
+                price=item.product.price
+            )
+            for item in items
+        ])
+        cart.clear()
+        # Queued with the order, so it exists exactly when the order does
+        send_order_email.enqueue(order.id)
+        if status == 'completed':
+            sync_order_sales.enqueue(order.id)
+    return order
+
+
+def set_order_status(order, status):
+    """Move a locked order to `status` and queue what follows from it"""
+    if status == 'cancelled':
+        # However an order ends up cancelled (denied, refunded, reversed,
+        # expired or by staff), its items go back on sale
+        restock_order(order)
+    order.status = status
+    order.save(update_fields=['status'])
+    send_order_email.enqueue(order.id)
+    sync_order_sales.enqueue(order.id)
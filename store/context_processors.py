@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart_count
+
+
+def cart(request):
+    """Expose the header cart badge count, read only if a template uses it"""
+    return {'cart_count': SimpleLazyObject(lambda: get_cart_count(request))}
@@ -0,0 +1,133 @@
+# Order export for accounting, as CSV (one row per order line) or JSONL
+# (one object per order with its lines)
+#
+# Orders are read with .iterator(chunk_size=...), which prefetches items
+# and products per chunk, and every format is a generator of text lines,
+# so memory stays flat however many orders match. The staff view streams
+# those lines over HTTP; `manage.py export_orders` gzips them to a file.
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Order, OrderItem
+
+CHUNK_SIZE = 2000
+STATUSES = {code for code, label in Order.STATUS_CHOICES}
+
+CSV_HEADER = [
+    'order_id', 'created', 'status', 'payment_method', 'payment_id', 'customer', 'email', 'order_total',
+    'product_id', 'product', 'size', 'quantity', 'unit_price', 'line_total',
+]
+
+
+def parse_filters(start=None, end=None, statuses=()):
+    """Validate export filters; dates are YYYY-MM-DD and both ends are inclusive"""
+    filters = {'start': None, 'end': None, 'statuses': []}
+    for name, value in (('start', start), ('end', end)):
+        if value:
+            try:
+                day = parse_date(value) if isinstance(value, str) else value
+            except ValueError:
+                day = None
+            if day is None:
+                raise ValidationError(f'{name} must be a date like 2026-01-31')
+            filters[name] = day
+    if filters['start'] and filters['end'] and filters['start'] > filters['end']:
+        raise ValidationError('start must not be after end')
+    for status in statuses:
+        if status not in STATUSES:
+            raise ValidationError(f'Unknown status {status}')
+        filters['statuses'].append(status)
+    return filters
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def export_orders(filters, chunk_size=CHUNK_SIZE):
+    """Yield matching orders oldest first, each with items and products loaded"""
+    queryset = Order.objects.select_related('user').order_by('id')
+    if filters['start']:
+        queryset = queryset.filter(created__gte=_midnight(filters['start']))
+    if filters['end']:
+        queryset = queryset.filter(created__lt=_midnight(filters['end'] + timedelta(days=1)))
+    if filters['statuses']:
+        queryset = queryset.filter(status__in=filters['statuses'])
+    queryset = queryset.prefetch_related(
+        Prefetch('items', queryset=(
+            OrderItem.objects.select_related('product')
+            .only('order_id', 'product_id', 'quantity', 'size', 'price', 'product__name')
+            .order_by('id')
+        ))
+    )
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """csv.writer target that hands each formatted row straight back"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(orders):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order in orders:
+        head = [
+            order.id, order.created.isoformat(), order.status, order.payment_method, order.payment_id,
+            order.user.username, order.email, order.total_amount,
+        ]
+        for item in order.items.all():
+            yield writer.writerow(head + [
+                item.product_id, item.product.name, item.size, item.quantity, item.price,
+                item.quantity * item.price,
+            ])
+
+
+def jsonl_lines(orders):
+    for order in orders:
+        yield json.dumps({
+            'order_id': order.id,
+            'created': order.created.isoformat(),
+            'status': order.status,
+            'payment_method': order.payment_method,
+            'payment_id': order.payment_id,
+            'customer': order.user.username,
+            'email': order.email,
+            'shipping_address': order.shipping_address,
+            'total': str(order.total_amount),
+            'items': [
+                {
+                    'product_id': item.product_id,
+                    'product': item.product.name,
+                    'size': item.size,
+                    'quantity': item.quantity,
+                    'unit_price': str(item.price),
+                    'line_total': str(item.quantity * item.price),
+                }
+                for item in order.items.all()
+            ],
+        }) + '\n'
+
+
+# Format -> (line generator, content type)
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
+
+
+def export_filename(fmt, filters):
+    parts = ['orders']
+    if filters['start']:
+        parts.append(filters['start'].isoformat())
+    if filters['end']:
+        parts.append(filters['end'].isoformat())
+    return f"{'-'.join(parts)}.{fmt}"
@@ -0,0 +1,153 @@
+# Facet counts for the catalog sidebar, computed in one aggregate query and cached
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .catalog import get_all_categories, get_all_products
+from .listing import SIZE_OPTIONS, size_filter
+from .models import Product
+from .single_flight import bump_version, shared_version
+
+PRICE_BUCKETS = [
+    (None, 50, 'Under $50'),
+    (50, 100, '$50 - $100'),
+    (100, 200, '$100 - $200'),
+    (200, None, '$200+'),
+]
+
+VERSION_KEY = 'facets:version'
+CACHE_TIMEOUT = 60 * 15
+
+
+def invalidate_facets(**kwargs):
+    """Retire every cached facet combination"""
+    bump_version(VERSION_KEY)
+
+
+def _cache_key(params):
+    combination = '|'.join(str(params.get(name)) for name in ('category', 'size', 'min_price', 'max_price', 'featured'))
+    digest = hashlib.md5(combination.encode('utf-8')).hexdigest()
+    return f'facets:{shared_version(VERSION_KEY)}:{digest}'
+
+
+def _price_q(low, high):
+    q = Q()
+    if low is not None:
+        q &= Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
+
+def _database_facets(params, categories):
+    # Each facet is counted with every filter except its own, so the sidebar
+    # shows how many results picking that value would give
+    dimensions = {
+        'category': Q(category__slug=params['category']) if params['category'] else Q(),
+        'size': size_filter(params['size']) if params['size'] else Q(),
+        'price': (
+            (Q(price__gte=params['min_price']) if params['min_price'] is not None else Q())
+            & (Q(price__lte=params['max_price']) if params['max_price'] is not None else Q())
+        ),
+        'featured': Q(featured=True) if params['featured'] else Q(),
+    }
+
+    def others(name):
+        q = Q()
+        for dimension, condition in dimensions.items():
+            if dimension != name:
+                q &= condition
+        return q
+
+    matching = others(None)
+    aggregates = {
+        'catalog': Count('id'),
+        'total': Count('id', filter=matching),
+        'in_stock': Count('id', filter=matching & Q(stock__gt=0)),
+        # Not 'featured': an aggregate named after a field hides it from the filters
+        'featured_count': Count('id', filter=others('featured') & Q(featured=True)),
+    }
+    for i, category in enumerate(categories):
+        aggregates[f'category_{i}'] = Count('id', filter=others('category') & Q(category_id=category['id']))
+    for i, size in enumerate(SIZE_OPTIONS):
+        aggregates[f'size_{i}'] = Count('id', filter=others('size') & size_filter(size))
+    for i, (low, high, label) in enumerate(PRICE_BUCKETS):
+        aggregates[f'price_{i}'] = Count('id', filter=others('price') & _price_q(low, high))
+
+    counts = Product.objects.aggregate(**aggregates)
+    if not counts['catalog']:
+        return None
+    return {
+        'total': counts['total'],
+        'in_stock': counts['in_stock'],
+        'featured': counts['featured_count'],
+        'categories': [counts[f'category_{i}'] for i in range(len(categories))],
+        'sizes': [counts[f'size_{i}'] for i in range(len(SIZE_OPTIONS))],
+        'prices': [counts[f'price_{i}'] for i in range(len(PRICE_BUCKETS))],
+    }
+
+
+def _static_facets(params, categories):
+    def matches(product, skip=None):
+        return (
+            (skip == 'category' or not params['category'] or product['category_slug'] == params['category'])
+            and (skip == 'size' or not params['size'] or params['size'] in product['available_sizes'])
+            and (skip == 'price' or params['min_price'] is None or product['price'] >= params['min_price'])
+            and (skip == 'price' or params['max_price'] is None or product['price'] <= params['max_price'])
+            and (skip == 'featured' or not params['featured'] or product.get('featured', False))
+        )
+
+    def in_bucket(product, low, high):
+        return (low is None or product['price'] >= low) and (high is None or product['price'] < high)
+
+    products = list(get_all_products())
+    matching = [p for p in products if matches(p)]
+    return {
+        'total': len(matching),
+        'in_stock': sum(1 for p in matching if p['stock'] > 0),
+        'featured': sum(1 for p in products if matches(p, 'featured') and p.get('featured', False)),
+        'categories': [
+            sum(1 for p in products if matches(p, 'category') and p['category_slug'] == c['slug'])
+            for c in categories
+        ],
+        'sizes': [
+            sum(1 for p in products if matches(p, 'size') and size in p['available_sizes'])
+            for size in SIZE_OPTIONS
+        ],
+        'prices': [
+            sum(1 for p in products if matches(p, 'price') and in_bucket(p, low, high))
+            for low, high, label in PRICE_BUCKETS
+        ],
+    }
+
+
+def get_facets(params):
+    """Return category, size, price-bucket and stock counts for a filter combination"""
+    key = _cache_key(params)
+    facets = cache.get(key)
+    if facets is not None:
+        return facets
+
+    categories = list(get_all_categories())
+    counts = _database_facets(params, categories) or _static_facets(params, categories)
+
+    facets = {
+        'total': counts['total'],
+        'in_stock': counts['in_stock'],
+        'featured': counts['featured'],
+        'categories': [
+            {'slug': c['slug'], 'name': c['name'], 'count': count}
+            for c, count in zip(categories, counts['categories'])
+        ],
+        'sizes': [
+            {'code': size, 'count': count}
+            for size, count in zip(SIZE_OPTIONS, counts['sizes'])
+        ],
+        'prices': [
+            {'min': low, 'max': high, 'label': label, 'count': count}
+            for (low, high, label), count in zip(PRICE_BUCKETS, counts['prices'])
+        ],
+    }
+    cache.set(key, facets, CACHE_TIMEOUT)
+    return facets
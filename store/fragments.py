@@ -0,0 +1,49 @@
+# Cached product card fragments
+#
+# Every product grid (home, catalog, "load more", search, recommendations)
+# renders its cards through store/product_cards.html, which asks for the
+# cards' HTML here. Each card is cached under its product id and a version
+# that is a digest of the fields the card shows, so saving a product (or
+# renaming its category) changes the key of exactly the cards that look
+# different and nothing has to be deleted. Because the version travels in
+# the catalog card itself, a whole grid is one get_many, plus one set_many
+# for whatever was missing.
+import hashlib
+
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+CARD_TEMPLATE = 'store/product_card.html'
+# Everything store/product_card.html reads from a product
+CARD_FIELDS = ('id', 'slug', 'name', 'category', 'price', 'image', 'featured')
+CARD_TIMEOUT = 60 * 60 * 24
+
+
+def card_version(product):
+    raw = '\x1f'.join(str(product.get(field)) for field in CARD_FIELDS)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _card_key(product, hide_badges):
+    return f"card:{product['id']}:{card_version(product)}:{int(bool(hide_badges))}"
+
+
+def render_card(product, hide_badges=False):
+    return get_template(CARD_TEMPLATE).render({'product': product, 'hide_badges': hide_badges})
+
+
+def render_cards(products, hide_badges=False):
+    """[(product, card_html), ...] for a grid, in one cache round trip when every card is cached"""
+    keys = [_card_key(product, hide_badges) for product in products]
+    cached = cache.get_many(keys) if keys else {}
+    missing = {}
+    cards = []
+    for product, key in zip(products, keys):
+        html = cached.get(key) or missing.get(key)
+        if html is None:
+            html = missing[key] = render_card(product, hide_badges)
+        cards.append((product, mark_safe(html)))
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+    return cards
@@ -0,0 +1,122 @@
+# Idempotency-Key support for the payment endpoints
+#
+# A client sends the same Idempotency-Key header with every retry of one
+# logical request (a double-click, a timeout retry). The first request with
+# a key claims it and runs the view; its response is stored and replayed to
+# later requests with that key until the key expires. A duplicate that
+# arrives while the first is still running waits for it to finish rather
+# than placing a second order. Requests without the header behave as before.
+import hashlib
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Seconds the first request may run before a duplicate can take the key over;
+# comfortably longer than a PayPal call with its timeouts and retries
+LOCK_TIMEOUT = 60
+POLL_INTERVAL = 0.05
+
+
+def _fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(f'{request.method} {request.path}\n'.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _claim(request, key, fingerprint):
+    """Return (record, True) if this request should run the view, else (record, False)"""
+    now = timezone.now()
+    fresh = {
+        'fingerprint': fingerprint,
+        'locked_until': now + timedelta(seconds=LOCK_TIMEOUT),
+        'expires_at': now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+    }
+    record, created = IdempotencyKey.objects.get_or_create(user=request.user, key=key, defaults=fresh)
+    if created:
+        return record, True
+
+    # An expired key, or one whose first request died, is up for grabs; the
+    # conditional update lets exactly one duplicate have it
+    stale = Q(expires_at__lte=now) | Q(response_status__isnull=True, locked_until__lte=now)
+    if IdempotencyKey.objects.filter(stale, pk=record.pk).update(
+        response_status=None, response_body='', content_type='', **fresh
+    ):
+        record.refresh_from_db()
+        return record, True
+    return record, False
+
+
+def _wait(record):
+    """Poll until the request holding `record` stores its response; None if it doesn't in time"""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        if record.response_status is not None:
+            return record
+        if record.locked_until <= timezone.now():
+            return None
+        time.sleep(POLL_INTERVAL)
+        record.refresh_from_db(fields=['response_status', 'response_body', 'content_type', 'locked_until'])
+    return None
+
+
+def _replay(record):
+    response = HttpResponse(record.response_body, status=record.response_status, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Run `view` at most once per (user, Idempotency-Key); put it under login_required"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'success': False, 'error': f'{HEADER} is too long'}, status=400)
+
+        fingerprint = _fingerprint(request)
+        record, owner = _claim(request, key, fingerprint)
+        if not owner:
+            if record.fingerprint != fingerprint:
+                return JsonResponse(
+                    {'success': False, 'error': f'{HEADER} was already used for a different request'}, status=422
+                )
+            done = _wait(record)
+            if done is None:
+                return JsonResponse(
+                    {'success': False, 'error': 'This request is still being processed'}, status=409
+                )
+            return _replay(done)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            # Nothing to replay; let the client retry with the same key
+            record.delete()
+            raise
+        if response.status_code >= 500 or getattr(response, 'streaming', False):
+            record.delete()
+            return response
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            response_status=response.status_code,
+            response_body=response.content.decode(response.charset),
+            content_type=response.get('Content-Type', ''),
+        )
+        return response
+    return wrapper
+
+
+def purge_expired(now=None):
+    """Delete keys past their TTL; return how many"""
+    return IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()[0]
@@ -0,0 +1,147 @@
+# Stock reservations
+#
+# Stock is taken from Product.stock the moment a cart enters checkout and
+# held in a StockReservation until the order is placed (the reservation is
+# consumed) or its TTL passes (a sweep gives the stock back). Every change
+# to Product.stock is a single conditional UPDATE, so concurrent buyers of
+# the same product can never drive it below zero.
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .catalog import invalidate_catalog
+from .facets import invalidate_facets
+from .models import Product, StockReservation
+from .page_cache import invalidate_pages
+
+SWEEP_BATCH_SIZE = 500
+# Catalog pages show "only N left" below this, so changes there must be visible
+LOW_STOCK = 10
+
+
+def take_stock(product_id, quantity):
+    """Atomically remove `quantity` units if that many remain; return whether it did"""
+    return Product.objects.filter(pk=product_id, stock__gte=quantity).update(stock=F('stock') - quantity) == 1
+
+
+def return_stock(product_id, quantity):
+    Product.objects.filter(pk=product_id).update(stock=F('stock') + quantity)
+
+
+def _refresh_catalog(changes):
+    # queryset.update() skips post_save, so the cached catalog, facets and
+    # pages don't notice. `changes` maps product ids to how much their stock
+    # just moved. Only refresh when a product is, or just was, low or sold
+    # out, where the storefront actually shows the number; hot drops would
+    # otherwise thrash it.
+    stock = Product.objects.filter(pk__in=list(changes)).values_list('pk', 'stock')
+    if any(after <= LOW_STOCK or after - changes[pk] <= LOW_STOCK for pk, after in stock):
+        transaction.on_commit(invalidate_catalog)
+        transaction.on_commit(invalidate_facets)
+        transaction.on_commit(invalidate_pages)
+
+
+def reserve_cart(cart, ttl=None):
+    """Hold stock for every line in `cart` and return when the hold expires
+
+    Only the difference from what the cart already holds is taken or given
+    back, so calling this again simply renews the hold. Raises
+    ValidationError, leaving stock untouched, if any product has run out.
+    """
+    ttl = settings.STOCK_RESERVATION_TTL if ttl is None else ttl
+    with transaction.atomic():
+        wanted = dict(
+            cart.items.values('product').annotate(quantity=Sum('quantity')).values_list('product', 'quantity')
+        )
+        held = dict(
+            StockReservation.objects.select_for_update().filter(cart=cart).values_list('product_id', 'quantity')
+        )
+
+        # Fixed product order keeps two carts from locking rows in opposite orders
+        changed = {}
+        for product_id in sorted(set(wanted) | set(held)):
+            diff = wanted.get(product_id, 0) - held.get(product_id, 0)
+            if diff > 0 and not take_stock(product_id, diff):
+                name = Product.objects.filter(pk=product_id).values_list('name', flat=True).first()
+                raise ValidationError(f'{name or "An item in your cart"} is out of stock')
+            if diff < 0:
+                return_stock(product_id, -diff)
+            if diff:
+                changed[product_id] = -diff
+
+        expires_at = timezone.now() + timedelta(seconds=ttl)
+        if wanted:
+            StockReservation.objects.bulk_create(
+                [
+                    StockReservation(cart=cart, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                    for product_id, quantity in wanted.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity', 'expires_at'],
+            )
+        dropped = set(held) - set(wanted)
+        if dropped:
+            StockReservation.objects.filter(cart=cart, product_id__in=dropped).delete()
+        if changed:
+            _refresh_catalog(changed)
+    return expires_at
+
+
+def consume_reservations(cart):
+    """The order was placed: keep the stock taken and forget the holds"""
+    StockReservation.objects.filter(cart=cart).delete()
+
+
+def release_reservations(cart):
+    """Give back everything `cart` holds, e.g. when checkout is abandoned"""
+    with transaction.atomic():
+        held = list(
+            StockReservation.objects.select_for_update().filter(cart=cart).values_list('id', 'product_id', 'quantity')
+        )
+        _release(held)
+
+
+def restock_order(order):
+    """Put an unfulfilled order's items back on the shelf"""
+    totals = {}
+    for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    for product_id in sorted(totals):
+        return_stock(product_id, totals[product_id])
+    if totals:
+        _refresh_catalog(totals)
+
+
+def _release(rows):
+    totals = {}
+    for _, product_id, quantity in rows:
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    for product_id in sorted(totals):
+        return_stock(product_id, totals[product_id])
+    if rows:
+        StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+        _refresh_catalog(totals)
+
+
+def release_expired(batch_size=SWEEP_BATCH_SIZE, now=None):
+    """Return stock from expired reservations, one batch per transaction; return how many were released"""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            # skip_locked leaves rows a checkout is renewing right now for the next sweep
+            rows = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('id', 'product_id', 'quantity')[:batch_size]
+            )
+            _release(rows)
+        released += len(rows)
+        if len(rows) < batch_size:
+            return released
@@ -0,0 +1,196 @@
+# Server-side filtering, sorting and cursor pagination for the product list
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+
+from .catalog import get_all_products, product_to_card
+from .models import Product
+from .popularity import NO_TREND
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 96
+
+# Sort option -> ordered (field, descending) pairs; `id` breaks ties so keys are unique
+SORTS = {
+    'newest': [('created', True), ('id', True)],
+    'price-low': [('price', False), ('id', False)],
+    'price-high': [('price', True), ('id', True)],
+    'name': [('name', False), ('id', False)],
+    # Decayed views and add-to-carts (store/popularity.py)
+    'trending': [('trend', True), ('id', True)],
+}
+DEFAULT_SORT = 'newest'
+
+CURSOR_TYPES = {
+    'created': parse_datetime,
+    'price': Decimal,
+    'name': str,
+    'trend': float,
+    'id': int,
+}
+
+SIZE_OPTIONS = [code for code, label in Product.SIZES] + ['One Size']
+SIZES = set(SIZE_OPTIONS)
+
+
+def _decimal(value):
+    try:
+        value = Decimal(value)
+    except (InvalidOperation, TypeError):
+        return None
+    return value if value.is_finite() and value >= 0 else None
+
+
+def parse_params(query, category_slug=None):
+    """Read listing filters from a QueryDict, dropping anything invalid"""
+    sort = query.get('sort', DEFAULT_SORT)
+    size = query.get('size') or None
+    try:
+        limit = min(max(int(query.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = PAGE_SIZE
+    return {
+        'category': category_slug or query.get('category') or None,
+        'size': size if size in SIZES else None,
+        'min_price': _decimal(query.get('min_price')),
+        'max_price': _decimal(query.get('max_price')),
+        'featured': query.get('featured') in ('1', 'true', 'on'),
+        'sort': sort if sort in SORTS else DEFAULT_SORT,
+        'cursor': query.get('cursor') or None,
+        'limit': limit,
+    }
+
+
+def encode_cursor(payload):
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Return the cursor payload, or None when the token is not one of ours"""
+    if not token:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(data)
+    except (ValueError, TypeError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def _keyset_filter(sort, values):
+    """Build the WHERE clause selecting rows strictly after `values` in `sort` order"""
+    condition = Q()
+    for i, (field, descending) in enumerate(sort):
+        step = Q(**{f'{field}__lt' if descending else f'{field}__gt': values[i]})
+        for j in range(i):
+            step &= Q(**{sort[j][0]: values[j]})
+        condition |= step
+    return condition
+
+
+def _cursor_values(sort, payload):
+    keys = payload.get('k')
+    if not isinstance(keys, list) or len(keys) != len(sort):
+        return None
+    values = []
+    for (field, _), raw in zip(sort, keys):
+        try:
+            value = CURSOR_TYPES[field](raw)
+        except (InvalidOperation, TypeError, ValueError):
+            return None
+        if value is None:
+            return None
+        values.append(value)
+    return values
+
+
+def _cursor_key(product, sort):
+    keys = []
+    for field, _ in sort:
+        value = getattr(product, field)
+        keys.append(value.isoformat() if field == 'created' else str(value) if field == 'price' else value)
+    return keys
+
+
+def size_filter(size):
+    """Q matching products that list `size` in available_sizes"""
+    if connection.features.supports_json_field_contains:
+        return Q(available_sizes__contains=[size])
+    # The quoted token cannot match a longer size such as "XXL"
+    return Q(available_sizes__icontains=json.dumps(size))
+
+
+def filter_queryset(params, queryset=None):
+    """Apply the category, size, price and featured filters to a Product queryset"""
+    if queryset is None:
+        queryset = Product.objects.all()
+    if params['category']:
+        queryset = queryset.filter(category__slug=params['category'])
+    if params['size']:
+        queryset = queryset.filter(size_filter(params['size']))
+    if params['min_price'] is not None:
+        queryset = queryset.filter(price__gte=params['min_price'])
+    if params['max_price'] is not None:
+        queryset = queryset.filter(price__lte=params['max_price'])
+    if params['featured']:
+        queryset = queryset.filter(featured=True)
+    return queryset
+
+
+def _database_page(params):
+    sort = SORTS[params['sort']]
+    queryset = filter_queryset(params).select_related('category').defer('description')
+    total = queryset.count()
+    if any(field == 'trend' for field, _ in sort):
+        queryset = queryset.annotate(
+            trend=Coalesce('popularity__trend', Value(NO_TREND), output_field=FloatField())
+        )
+
+    payload = decode_cursor(params['cursor'])
+    values = _cursor_values(sort, payload) if payload else None
+    if values:
+        queryset = queryset.filter(_keyset_filter(sort, values))
+
+    order = [f'-{field}' if descending else field for field, descending in sort]
+    rows = list(queryset.order_by(*order)[:params['limit'] + 1])
+    next_cursor = None
+    if len(rows) > params['limit']:
+        rows = rows[:params['limit']]
+        next_cursor = encode_cursor({'k': _cursor_key(rows[-1], sort)})
+    return [product_to_card(p) for p in rows], next_cursor, total
+
+
+def _static_page(params):
+    # The bundled catalog is small and never changes, so offsets are stable here
+    products = [
+        p for p in get_all_products()
+        if (not params['category'] or p['category_slug'] == params['category'])
+        and (not params['size'] or params['size'] in p['available_sizes'])
+        and (params['min_price'] is None or p['price'] >= params['min_price'])
+        and (params['max_price'] is None or p['price'] <= params['max_price'])
+        and (not params['featured'] or p.get('featured', False))
+    ]
+    for field, descending in reversed(SORTS[params['sort']]):
+        if field == 'trend':
+            products.sort(key=lambda p: p.get('popularity', 0), reverse=descending)
+        elif field != 'created':
+            products.sort(key=lambda p: p[field], reverse=descending)
+
+    payload = decode_cursor(params['cursor']) or {}
+    offset = max(payload.get('o', 0), 0) if isinstance(payload.get('o'), int) else 0
+    end = offset + params['limit']
+    next_cursor = encode_cursor({'o': end}) if end < len(products) else None
+    return products[offset:end], next_cursor, len(products)
+
+
+def get_product_page(params):
+    """Return (products, next_cursor, total) for one page of the product list"""
+    if Product.objects.exists():
+        return _database_page(params)
+    return _static_page(params)
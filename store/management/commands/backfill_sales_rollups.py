@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.sales import BACKFILL_CHUNK_SIZE, backfill
+
+
+class Command(BaseCommand):
+    help = 'Add completed orders the daily sales rollups do not count yet, a chunk of orders per transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE)
+        parser.add_argument('--rebuild', action='store_true', help='Empty the rollups and recompute them from all orders')
+
+    def handle(self, *args, **options):
+        added = backfill(chunk_size=options['chunk_size'], rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Added {added} orders to the sales rollups'))
@@ -0,0 +1,80 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.autocomplete import PrefixIndex
+
+ADJECTIVES = ['shadow', 'urban', 'stealth', 'night', 'rebel', 'street', 'underground', 'phantom', 'venom',
+              'midnight', 'concrete', 'neon', 'ghost', 'chrome', 'static', 'riot', 'vandal', 'nomad']
+NOUNS = ['rider', 'runner', 'bomber', 'cargo', 'denim', 'tank', 'snapback', 'beanie', 'graffiti',
+         'signal', 'drift', 'pulse', 'block', 'crew', 'zone', 'wave']
+CATEGORIES = ['Hoodies', 'T-Shirts', 'Jackets', 'Pants', 'Accessories']
+GARMENTS = ['hoodie', 'tee', 'jacket', 'joggers', 'pants', 'cap', 'beanie', 'tank', 'crewneck']
+
+
+def synthetic_catalog(count, seed):
+    rng = random.Random(seed)
+    products = []
+    for i in range(count):
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.choice(GARMENTS)} {i}'.title()
+        products.append({
+            'id': i + 1,
+            'name': name,
+            'slug': name.lower().replace(' ', '-'),
+            'category': rng.choice(CATEGORIES),
+            'price': f'{rng.uniform(10, 300):.2f}',
+            'image': None,
+            'stock': rng.randint(0, 50),
+            'featured': rng.random() < 0.05,
+            'popularity': rng.randint(0, 1000),
+        })
+    return products
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark autocomplete lookups against a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=20_000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        products = synthetic_catalog(options['products'], options['seed'])
+
+        started = time.perf_counter()
+        index = PrefixIndex(products)
+        build = time.perf_counter() - started
+        self.stdout.write(
+            f'Built index over {len(products)} products: {len(index.keys)} keys, '
+            f'{len(index.heavy)} precomputed prefixes in {build:.2f}s'
+        )
+
+        # Prefixes of 1-12 characters taken from real names, slugs and categories
+        rng = random.Random(options['seed'] + 1)
+        queries = []
+        for _ in range(options['queries']):
+            product = rng.choice(products)
+            source = rng.choice([product['name'], product['slug'], product['category'], product['name'].split(' ', 1)[1]])
+            queries.append(source[:rng.randint(1, 12)])
+
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            index.lookup(query)
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+
+        p50, p99, worst = (percentile(samples, 0.5), percentile(samples, 0.99), samples[-1])
+        self.stdout.write(
+            f'{len(samples)} lookups: p50 {p50 * 1e6:.0f}us, p99 {p99 * 1e6:.0f}us, max {worst * 1e6:.0f}us'
+        )
+        if p99 < 0.001:
+            self.stdout.write(self.style.SUCCESS('p99 is under 1 ms'))
+        else:
+            self.stdout.write(self.style.WARNING('p99 is over 1 ms'))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test.utils import override_settings
+
+from store.management.commands.bench_autocomplete import synthetic_catalog
+
+UNCACHED = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+# The cold runs clear the cache before every render, so never point them at the real one
+PRIVATE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-card-render'}}
+
+
+class Command(BaseCommand):
+    help = 'Time rendering a product grid with and without cached card fragments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=48)
+        parser.add_argument('--renders', type=int, default=300)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        grid = synthetic_catalog(options['cards'], options['seed'])
+        for product in grid:
+            product['category_slug'] = product['category'].lower()
+
+        def render():
+            return render_to_string('store/product_cards.html', {'products': grid})
+
+        with override_settings(CACHES=UNCACHED):
+            before = self.time(render, options['renders'])
+        with override_settings(CACHES=PRIVATE):
+            cold = self.time(render, options['renders'], setup=cache.clear)
+            render()
+            warm = self.time(render, options['renders'])
+
+        self.stdout.write(f"{options['cards']}-card grid, {options['renders']} renders each (median per grid):")
+        self.stdout.write(f'  uncached (before)   {before * 1e3:.2f} ms')
+        self.stdout.write(f'  cold fragment cache {cold * 1e3:.2f} ms')
+        self.stdout.write(f'  warm fragment cache {warm * 1e3:.2f} ms ({before / warm:.1f}x faster)')
+        self.stdout.write('  (private in-process cache; add one get_many round trip per grid for Redis)')
+
+    def time(self, render, renders, setup=None):
+        samples = []
+        for _ in range(renders):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            render()
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        return samples[len(samples) // 2]
@@ -0,0 +1,53 @@
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+from store.paypal import PayPalClient
+from store.paypal_stub import StubPayPalServer
+
+
+def naive_verify(base_url, client_id, client_secret, order_id, expected_amount):
+    """What verification used to do: a new token and new connections every time"""
+    auth = requests.post(
+        f'{base_url}/v1/oauth2/token',
+        headers={'Accept': 'application/json', 'Accept-Language': 'en_US'},
+        data={'grant_type': 'client_credentials'},
+        auth=(client_id, client_secret),
+    )
+    token = auth.json()['access_token']
+    order = requests.get(
+        f'{base_url}/v2/checkout/orders/{order_id}',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+    ).json()
+    return abs(float(order['purchase_units'][0]['amount']['value']) - float(expected_amount)) < 0.01
+
+
+class Command(BaseCommand):
+    help = 'Compare per-call PayPal verification against the pooled, token-caching client on a local stub'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verifications', type=int, default=500)
+
+    def run(self, label, stub, verify):
+        before = dict(stub.counts)
+        started = time.perf_counter()
+        for _ in range(self.verifications):
+            assert verify()
+        elapsed = time.perf_counter() - started
+        delta = {name: stub.counts[name] - before.get(name, 0) for name in stub.counts}
+        self.stdout.write(
+            f'{label:>8}: {elapsed / self.verifications * 1000:.2f} ms/verification, '
+            f"{delta['token_requests']} token requests, {delta['connections']} connections"
+        )
+
+    def handle(self, *args, **options):
+        self.verifications = options['verifications']
+        with StubPayPalServer() as stub:
+            stub.add_order('BENCH-ORDER', '129.99')
+            self.run('naive', stub, lambda: naive_verify(
+                stub.url, stub.client_id, stub.client_secret, 'BENCH-ORDER', '129.99'
+            ))
+            client = PayPalClient(stub.client_id, stub.client_secret, stub.url)
+            self.run('pooled', stub, lambda: client.verify_order_amount('BENCH-ORDER', '129.99'))
+            client.session.close()
@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+
+from store.models import Category, Product, ProductPopularity
+from store.popularity import CounterBuffer, write
+
+
+class Command(BaseCommand):
+    help = 'Compare buffered popularity counters with a synchronous write per product view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50)
+        parser.add_argument('--events', type=int, default=5000)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between buffered flushes')
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'Bench {tag}', slug=f'bench-{tag}')
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench {tag} {i}', slug=f'bench-{tag}-{i}', category=category, price='10.00',
+                    description='Benchmark product for popularity counters')
+            for i in range(options['products'])
+        ])
+        ids = [p.pk for p in Product.objects.filter(category=category)]
+        # Skewed like real traffic: a few hot products take most of the views
+        rng = random.Random(options['seed'])
+        weights = [1 / (rank + 1) for rank in range(len(ids))]
+        events = rng.choices(ids, weights=weights, k=options['events'])
+
+        try:
+            sync = self.run(events, options['threads'], lambda product_id: write({product_id: (1, 0)}))
+            synced = self.total_views(ids)
+            ProductPopularity.objects.filter(product_id__in=ids).delete()
+
+            buffer = CounterBuffer(interval=options['interval'])
+            buffered = self.run(events, options['threads'], lambda product_id: buffer.add(product_id, views=1))
+            started = time.perf_counter()
+            buffer.flush()
+            buffered += time.perf_counter() - started
+            flushed = self.total_views(ids)
+        finally:
+            category.delete()
+
+        count = len(events)
+        self.stdout.write(
+            f'{count} views of {len(products)} products on {options["threads"]} threads:\n'
+            f'  synchronous  {sync:.2f}s ({count / sync:,.0f} views/s), {synced} counted\n'
+            f'  buffered     {buffered:.2f}s ({count / buffered:,.0f} views/s), {flushed} counted, '
+            f'flushed every {options["interval"]}s\n'
+            f'  speedup      {sync / buffered:.1f}x'
+        )
+        if synced != count or flushed != count:
+            self.stderr.write(self.style.ERROR('Counts do not match the events sent'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every event counted'))
+
+    def run(self, events, threads, record):
+        """Time `record` over every event, spread across worker threads"""
+        queue = list(events)
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if not queue:
+                            return
+                        product_id = queue.pop()
+                    record(product_id)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return time.perf_counter() - started
+
+    def total_views(self, ids):
+        return ProductPopularity.objects.filter(product_id__in=ids).aggregate(total=Sum('views'))['total'] or 0
@@ -0,0 +1,79 @@
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from store.inventory import reserve_cart
+from store.models import Cart, CartItem, Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Hammer one hot product with concurrent checkouts and check nothing is oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=200)
+        parser.add_argument('--buyers', type=int, default=400)
+        parser.add_argument('--threads', type=int, default=16)
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'Bench {tag}', slug=f'bench-{tag}')
+        product = Product.objects.create(
+            name=f'Hot Drop {tag}', slug=f'hot-drop-{tag}', category=category, price='99.00',
+            description='Benchmark product for stock contention', stock=options['stock'],
+        )
+        User.objects.bulk_create([User(username=f'bench-{tag}-{i}') for i in range(options['buyers'])])
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in User.objects.filter(username__startswith=f'bench-{tag}-')])
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, size='M', quantity=1) for cart in carts])
+
+        results = {'reserved': 0, 'sold_out': 0, 'errors': 0}
+        lock = threading.Lock()
+        queue = list(carts)
+
+        def buyer():
+            try:
+                while True:
+                    with lock:
+                        if not queue:
+                            return
+                        cart = queue.pop()
+                    try:
+                        reserve_cart(cart)
+                        outcome = 'reserved'
+                    except ValidationError:
+                        outcome = 'sold_out'
+                    except Exception as e:
+                        self.stderr.write(f'{type(e).__name__}: {e}')
+                        outcome = 'errors'
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=buyer) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        product.refresh_from_db()
+        self.stdout.write(
+            f"{options['buyers']} buyers on {options['threads']} threads against stock {options['stock']}: "
+            f"{results['reserved']} reserved, {results['sold_out']} sold out, {results['errors']} errors "
+            f"in {elapsed:.2f}s ({options['buyers'] / elapsed:.0f} checkouts/s); stock left {product.stock}"
+        )
+        oversold = results['reserved'] - options['stock']
+        if oversold > 0 or product.stock < 0:
+            self.stderr.write(self.style.ERROR(f'Oversold by {oversold}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No oversell'))
+
+        User.objects.filter(username__startswith=f'bench-{tag}-').delete()
+        category.delete()
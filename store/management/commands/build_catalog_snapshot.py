@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog import load_catalog
+from store.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Compile the catalog into a memory-mapped snapshot shared by all workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default=settings.CATALOG_SNAPSHOT_PATH,
+            help='Snapshot file to replace (defaults to CATALOG_SNAPSHOT_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['output']
+        if not path:
+            raise CommandError('Set CATALOG_SNAPSHOT_PATH or pass --output')
+
+        catalog = load_catalog()
+        version = write_snapshot(catalog, path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(catalog.products)} products in {len(catalog.categories)} categories '
+            f'to {path} (version {version})'
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import recommendations
+from store.recommendations import MIN_SUPPORT, TOP_K, build
+
+
+class Command(BaseCommand):
+    help = 'Recompute "complete the fit" recommendations from order history (run nightly from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=TOP_K, help='Recommendations kept per product')
+        parser.add_argument('--min-support', type=int, default=MIN_SUPPORT,
+                            help='Orders a pair must share before it can be recommended')
+        parser.add_argument('--pure-python', action='store_true', help='Score without NumPy/SciPy even if installed')
+
+    def handle(self, *args, **options):
+        use_numpy = recommendations.np is not None and not options['pure_python']
+        started = time.perf_counter()
+        written = build(top_k=options['top'], min_support=options['min_support'], use_numpy=use_numpy)
+        elapsed = time.perf_counter() - started
+        engine = 'NumPy/SciPy' if use_numpy else 'pure Python'
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} recommendations in {elapsed:.2f}s ({engine})'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from store.inventory import SWEEP_BATCH_SIZE
+from store.paypal_webhooks import expire_pending_orders
+
+
+class Command(BaseCommand):
+    help = 'Cancel and restock PayPal orders whose capture never arrived (run from cron every few minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=None, help='Seconds (default PAYPAL_PENDING_ORDER_TTL)')
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        expired = expire_pending_orders(max_age=options['max_age'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} pending PayPal orders'))
@@ -0,0 +1,38 @@
+import gzip
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from store.exports import CHUNK_SIZE, FORMATS, export_filename, export_orders, parse_filters
+
+
+class Command(BaseCommand):
+    help = 'Write orders and their lines to a gzipped CSV or JSONL file for accounting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--start', help='First day to include, YYYY-MM-DD')
+        parser.add_argument('--end', help='Last day to include, YYYY-MM-DD')
+        parser.add_argument('--status', action='append', default=[], help='Only orders with this status (repeatable)')
+        parser.add_argument('--output', help='Gzip file to write (default: orders-<start>-<end>.<format>.gz; "-" for stdout)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_filters(options['start'], options['end'], options['status'])
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+
+        fmt = options['format']
+        output = options['output'] or f'{export_filename(fmt, filters)}.gz'
+        lines, _ = FORMATS[fmt]
+        target = sys.stdout.buffer if output == '-' else output
+        written = 0
+        with gzip.open(target, 'wt', encoding='utf-8', newline='') as stream:
+            for line in lines(export_orders(filters, chunk_size=options['chunk_size'])):
+                stream.write(line)
+                written += 1
+
+        if output != '-':
+            self.stdout.write(self.style.SUCCESS(f'Wrote {written} lines to {output}'))
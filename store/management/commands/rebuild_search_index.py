@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from the Product table'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        with transaction.atomic():
+            backend.create_index()
+            count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products with {type(backend).__name__}'))
@@ -0,0 +1,66 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from store.models import Order
+from store.paypal_stub import StubPayPalServer, capture_event
+
+
+class Command(BaseCommand):
+    help = (
+        'Deliver PayPal webhook events to the local webhook endpoint, signed by a stub PayPal, '
+        'to exercise order finalization without PayPal'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('events', nargs='?', help='JSONL file of webhook events ("-" for stdin)')
+        parser.add_argument('--pending', action='store_true',
+                            help='Also send a capture-completed event for every pending PayPal order')
+        parser.add_argument('--deliveries', type=int, default=1,
+                            help='Deliver each event this many times, as PayPal does when it retries')
+        parser.add_argument('--unsigned', action='store_true', help='Send events with a bad signature')
+
+    def load_events(self, path):
+        if not path:
+            return []
+        stream = sys.stdin if path == '-' else open(path)
+        try:
+            return [json.loads(line) for line in stream if line.strip()]
+        except ValueError as e:
+            raise CommandError(f'Bad event in {path}: {e}')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    def handle(self, *args, **options):
+        events = self.load_events(options['events'])
+        if options['pending']:
+            pending = Order.objects.filter(payment_method='paypal', status='pending')
+            events += [capture_event(order.payment_id, order.total_amount) for order in pending]
+        if not events:
+            raise CommandError('No events to replay')
+
+        outcomes = {}
+        with StubPayPalServer() as stub, override_settings(
+            PAYPAL_API_BASE=stub.url,
+            PAYPAL_CLIENT_ID=stub.client_id,
+            PAYPAL_CLIENT_SECRET=stub.client_secret,
+            PAYPAL_WEBHOOK_ID=stub.webhook_id,
+            ALLOWED_HOSTS=['testserver'],
+        ):
+            client = Client()
+            url = reverse('store:paypal_webhook')
+            for event in events:
+                for _ in range(options['deliveries']):
+                    headers = stub.webhook_headers(event, webhook_id='forged' if options['unsigned'] else None)
+                    response = client.post(url, json.dumps(event), content_type='application/json', headers=headers)
+                    outcome = response.json().get('outcome') or f'http {response.status_code}'
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                    self.stdout.write(f"{event.get('id')} {event.get('event_type')}: {outcome}")
+
+        summary = ', '.join(f'{count} {outcome}' for outcome, count in sorted(outcomes.items()))
+        self.stdout.write(self.style.SUCCESS(f'Replayed {len(events)} events: {summary}'))
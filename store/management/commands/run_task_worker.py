@@ -0,0 +1,84 @@
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.tasks import task_backends
+from django.utils.crypto import get_random_string
+
+from store.task_queue import DatabaseBackend
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (order emails and other post-order work) from the database task backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default='default', help='Alias in settings.TASKS')
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help='Only run tasks from this queue (repeatable; default: all of the backend\'s queues)')
+        parser.add_argument('--concurrency', type=int, default=4, help='Tasks this worker runs at once')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when no task is ready')
+        parser.add_argument('--burst', action='store_true', help='Exit once no task is ready instead of waiting')
+
+    def handle(self, *args, **options):
+        backend = task_backends[options['backend']]
+        if not isinstance(backend, DatabaseBackend):
+            raise CommandError(f"Backend '{options['backend']}' is not a store.task_queue.DatabaseBackend")
+        queues = options['queues'] or sorted(backend.queues)
+        unknown = set(queues) - backend.queues
+        if unknown:
+            raise CommandError(f"Unknown queues: {', '.join(sorted(unknown))}")
+
+        self.backend = backend
+        self.queues = queues
+        self.poll_interval = options['poll_interval']
+        self.burst = options['burst']
+        self.stopping = threading.Event()
+        self.counts = {}
+        self.lock = threading.Lock()
+        worker_id = f'{socket.gethostname()}:{os.getpid()}:{get_random_string(6)}'
+
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, self.stop)
+
+        self.stdout.write(f"Worker {worker_id} running {options['concurrency']} at a time from {', '.join(queues)}")
+        threads = [
+            threading.Thread(target=self.work, args=(f'{worker_id}/{i}',))
+            for i in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        summary = ', '.join(f'{count} {status.lower()}' for status, count in sorted(self.counts.items()))
+        self.stdout.write(self.style.SUCCESS(f'Worker stopped: {summary or "no tasks run"}'))
+
+    def stop(self, signum, frame):
+        # Let running tasks finish; a second signal kills the process as usual
+        self.stdout.write('Stopping after the running tasks finish...')
+        self.stopping.set()
+        signal.signal(signum, signal.SIG_DFL)
+
+    def work(self, worker_id):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                record = self.backend.claim(worker_id, self.queues)
+                if record is None:
+                    if self.burst:
+                        return
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                status = self.backend.run(record)
+                with self.lock:
+                    self.counts[status] = self.counts.get(status, 0) + 1
+                if status != 'SUCCESSFUL':
+                    outcome = 'will retry' if status == 'READY' else 'dead-lettered'
+                    self.stderr.write(f'{record.task_path} [{record.id}] attempt {record.attempts} failed, {outcome}')
+        finally:
+            connection.close()
@@ -0,0 +1,12 @@
+class CartCookieMiddleware:
+    """Write back an anonymous CookieCart that a view changed during the request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        cart = getattr(request, '_cookie_cart', None)
+        if cart is not None:
+            cart.save(response)
+        return response
@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 17:35
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Fold repeated (cart, product, size) lines into the oldest one"""
+    CartItem = apps.get_model('store', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('cart', 'product', 'size')
+        .annotate(lines=Count('id'), keep=Min('id'), total=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for line in duplicates:
+        CartItem.objects.filter(id=line['keep']).update(quantity=min(line['total'], 99))
+        CartItem.objects.filter(
+            cart=line['cart'], product=line['product'], size=line['size']
+        ).exclude(id=line['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product', 'size'), name='cartitem_cart_product_size_uniq'),
+        ),
+    ]
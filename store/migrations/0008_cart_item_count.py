@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-18 17:37
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+
+
+def backfill_item_count(apps, schema_editor):
+    Cart = apps.get_model('store', 'Cart')
+    CartItem = apps.get_model('store', 'CartItem')
+    totals = (
+        CartItem.objects.filter(cart=OuterRef('pk'))
+        .values('cart').annotate(count=Sum('quantity')).values('count')
+    )
+    Cart.objects.filter(pk__in=CartItem.objects.values('cart')).update(item_count=Subquery(totals))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_cartitem_unique_line'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_item_count, migrations.RunPython.noop),
+    ]
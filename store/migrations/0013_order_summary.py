@@ -0,0 +1,64 @@
+# Generated by Django 6.0 on 2026-10-18 17:51
+
+from django.conf import settings
+from decimal import Decimal
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+SUMMARY_LINES = 5
+
+
+def backfill_summaries(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    batch = []
+    for order in Order.objects.prefetch_related('items__product').order_by('pk').iterator(chunk_size=BATCH_SIZE):
+        items = sorted(order.items.all(), key=lambda item: item.pk)
+        order.item_count = sum(item.quantity for item in items)
+        order.line_count = len(items)
+        order.line_summary = [
+            {
+                'name': item.product.name,
+                'size': item.size,
+                'quantity': item.quantity,
+                'total': str((item.quantity * item.price).quantize(Decimal('0.01'))),
+            }
+            for item in items[:SUMMARY_LINES]
+        ]
+        batch.append(order)
+        if len(batch) == BATCH_SIZE:
+            Order.objects.bulk_update(batch, ['item_count', 'line_count', 'line_summary'])
+            batch = []
+    if batch:
+        Order.objects.bulk_update(batch, ['item_count', 'line_count', 'line_summary'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_idempotency_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='line_summary',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created', '-id'], name='order_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 17:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_product_recommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='store.product')),
+                ('views', models.PositiveBigIntegerField(default=0)),
+                ('cart_adds', models.PositiveBigIntegerField(default=0)),
+                ('trend', models.FloatField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'product popularity',
+                'indexes': [models.Index(fields=['-trend'], name='popularity_trend_idx')],
+            },
+        ),
+    ]
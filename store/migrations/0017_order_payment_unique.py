@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-18 18:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe_payment_ids(apps, schema_editor):
+    # Card orders used to share `card_<cart id>`; keep the oldest, suffix the rest
+    Order = apps.get_model('store', 'Order')
+    duplicates = (
+        Order.objects.exclude(payment_id='').values('payment_method', 'payment_id')
+        .annotate(n=Count('id')).filter(n__gt=1)
+    )
+    for row in duplicates:
+        orders = Order.objects.filter(payment_method=row['payment_method'], payment_id=row['payment_id']).order_by('id')
+        for order in orders[1:]:
+            Order.objects.filter(pk=order.pk).update(payment_id=f"{order.payment_id}-{order.pk}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_popularity'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_payment_ids, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('payment_id', ''), _negated=True), fields=('payment_method', 'payment_id'), name='order_payment_unique'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_order_review_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskQueue',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+            ],
+        ),
+    ]
@@ -1,4 +1,6 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -16,6 +18,15 @@ def validate_description_length(value):
     if len(value.strip()) < 10:
         raise ValidationError('Description must be at least 10 characters')
 
+CENTS = Decimal('0.01')
+
+def line_total(prefix=''):
+    """quantity * product price for a cart or order line, as a 2dp money value"""
+    return ExpressionWrapper(
+        F(f'{prefix}quantity') * F(f'{prefix}product__price'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
 class Category(models.Model):
     name = models.CharField(max_length=100, validators=[validate_not_empty])
     slug = models.SlugField(unique=True, max_length=100)
@@ -50,6 +61,13 @@ class Product(models.Model):
     
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['category', '-created'], name='product_category_created_idx'),
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            models.Index(fields=['featured', '-created'], name='product_featured_created_idx'),
+            models.Index(fields=['-created'], name='product_created_idx'),
+            models.Index(fields=['price'], name='product_price_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -75,14 +93,52 @@ class Product(models.Model):
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
     session_key = models.CharField(max_length=40, null=True, blank=True)
+    # Sum of line quantities, kept in step by every write path so the header badge never counts rows
+    item_count = models.PositiveIntegerField(default=0)
     created = models.DateTimeField(auto_now_add=True)
     
     def clean(self):
         if not self.user and not self.session_key:
             raise ValidationError('Cart must have either user or session_key')
     
+    def refresh_item_count(self):
+        """Recompute item_count from the cart's lines"""
+        self.item_count = self.items.aggregate(count=Sum('quantity'))['count'] or 0
+        Cart.objects.filter(pk=self.pk).update(item_count=self.item_count)
+    
+    def clear(self):
+        """Delete every line and zero the counter"""
+        self.items.all().delete()
+        self.item_count = 0
+        Cart.objects.filter(pk=self.pk).update(item_count=0)
+    
     def get_total_price(self):
-        return sum(item.get_total_price() for item in self.items.all())
+        total = self.items.aggregate(total=Sum(line_total()))['total'] or Decimal('0.00')
+        # SQLite hands back computed decimals unquantized
+        return total.quantize(CENTS)
+    
+    def get_summary(self):
+        """Cart lines with their products, plus totals computed in the database.
+        
+        Costs two queries however many lines the cart has.
+        """
+        items = list(
+            self.items.select_related('product__category')
+            .annotate(line_total=line_total())
+            .order_by('id')
+        )
+        totals = self.items.aggregate(
+            subtotal=Sum(line_total()),
+            item_count=Sum('quantity'),
+        )
+        for item in items:
+            item.line_total = item.line_total.quantize(CENTS)
+        return {
+            'items': items,
+            'subtotal': (totals['subtotal'] or Decimal('0.00')).quantize(CENTS),
+            'item_count': totals['item_count'] or 0,
+            'line_count': len(items),
+        }
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -90,20 +146,49 @@ class CartItem(models.Model):
     size = models.CharField(max_length=3, choices=Product.SIZES)
     quantity = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1), MaxValueValidator(99)])
     
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product', 'size'], name='cartitem_cart_product_size_uniq'),
+        ]
+    
     def clean(self):
         if self.quantity <= 0:
             raise ValidationError('Quantity must be at least 1')
-        if self.quantity > self.product.stock:
+        # Units this cart already holds at checkout are out of product.stock but still its own
+        held = 0
+        if self.cart_id:
+            held = StockReservation.objects.filter(
+                cart_id=self.cart_id, product_id=self.product_id,
+            ).values_list('quantity', flat=True).first() or 0
+        if self.quantity > self.product.stock + held:
             raise ValidationError('Quantity cannot exceed available stock')
     
     def get_total_price(self):
         return self.quantity * self.product.price
 
+class StockReservation(models.Model):
+    """Stock held for a cart between checkout and payment; it expires after a TTL"""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='reservation_cart_product_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for cart {self.cart_id}"
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
+        # Paid, but not as expected (see paypal_webhooks); staff decide what happens next
+        ('review', 'Needs review'),
     ]
     
     PAYMENT_METHODS = [
@@ -119,14 +204,103 @@ class Order(models.Model):
     shipping_address = models.TextField()
     email = models.EmailField()
     phone = models.CharField(max_length=20, blank=True)
+    # Written once at checkout so order lists never touch OrderItem
+    item_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+    # The first SUMMARY_LINES lines as {name, size, quantity, total}
+    line_summary = models.JSONField(default=list, blank=True)
+    # Whether the sales rollups currently include this order
+    sales_recorded = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
     
+    SUMMARY_LINES = 5
+    
     class Meta:
         ordering = ['-created']
+        indexes = [
+            # Webhooks find their order by the PayPal order id
+            models.Index(fields=['payment_id'], name='order_payment_id_idx'),
+            # Order history: a user's orders newest first, paged by (created, id)
+            models.Index(fields=['user', '-created', '-id'], name='order_user_created_idx'),
+        ]
+        constraints = [
+            # One order per payment, so a PayPal capture can only ever complete one order
+            models.UniqueConstraint(
+                fields=['payment_method', 'payment_id'], condition=~models.Q(payment_id=''),
+                name='order_payment_unique',
+            ),
+        ]
+    
+    @classmethod
+    def summarize(cls, items):
+        """item_count, line_count and line_summary for an order of `items` (with products loaded)"""
+        return {
+            'item_count': sum(item.quantity for item in items),
+            'line_count': len(items),
+            'line_summary': [
+                {
+                    'name': item.product.name,
+                    'size': item.size,
+                    'quantity': item.quantity,
+                    'total': str((item.quantity * item.product.price).quantize(CENTS)),
+                }
+                for item in items[:cls.SUMMARY_LINES]
+            ],
+        }
+    
+    @property
+    def more_lines(self):
+        return self.line_count - len(self.line_summary)
     
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
 
+class DailySales(models.Model):
+    """Completed orders per day, kept current by store.sales"""
+    day = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        ordering = ['-day']
+        verbose_name_plural = "daily sales"
+    
+    def __str__(self):
+        return f"{self.day}: {self.orders} orders"
+
+class DailyProductSales(models.Model):
+    """Completed sales of one product size per day, kept current by store.sales"""
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    size = models.CharField(max_length=3)
+    # Orders that included this product size
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        ordering = ['-day']
+        verbose_name_plural = "daily product sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product', 'size'], name='dailyproductsales_day_product_size_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.product_id} {self.size}: {self.units}"
+
+class PayPalWebhookEvent(models.Model):
+    """Every PayPal webhook event we have accepted, so redeliveries are ignored"""
+    event_id = models.CharField(max_length=64, unique=True)
+    event_type = models.CharField(max_length=64)
+    paypal_order_id = models.CharField(max_length=64, blank=True, db_index=True)
+    payload = models.JSONField()
+    received = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -135,4 +309,125 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     
     def get_total_price(self):
-        return self.quantity * self.price
\ No newline at end of file
+        return self.quantity * self.price
+class QueuedTask(models.Model):
+    """A django.tasks task waiting for, or run by, the database task backend"""
+    STATUS_CHOICES = [
+        ('READY', 'Ready'),
+        ('RUNNING', 'Running'),
+        ('SUCCESSFUL', 'Successful'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    id = models.CharField(primary_key=True, max_length=32)
+    task_path = models.CharField(max_length=255)
+    queue_name = models.CharField(max_length=100, default='default')
+    priority = models.SmallIntegerField(default=0)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='READY')
+    run_after = models.DateTimeField()
+    # A worker owns a RUNNING task until then; past it the task is presumed orphaned
+    locked_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker_ids = models.JSONField(default=list)
+    errors = models.JSONField(default=list)
+    return_value = models.JSONField(null=True, blank=True)
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    last_attempted_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # The worker's claim query: next runnable task in a queue
+            models.Index(fields=['status', 'queue_name', '-priority', 'run_after'], name='queuedtask_claim_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.task_path} ({self.status})"
+
+class TaskQueue(models.Model):
+    """A row per concurrency-limited queue, locked while a worker counts its running tasks"""
+    name = models.CharField(primary_key=True, max_length=100)
+    
+    def __str__(self):
+        return self.name
+
+class DeadTask(models.Model):
+    """A task that used up its attempts, kept for inspection and requeueing"""
+    task = models.OneToOneField(QueuedTask, on_delete=models.CASCADE, related_name='dead_letter')
+    task_path = models.CharField(max_length=255)
+    queue_name = models.CharField(max_length=100)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField()
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-failed_at']
+    
+    def __str__(self):
+        return f"{self.task_path} after {self.attempts} attempts"
+
+class IdempotencyKey(models.Model):
+    """The response to a client's Idempotency-Key, replayed for retries of the same request"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # Hash of the method, path and body, so a key can't be reused for a different request
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still being handled
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    # An unfinished request past this is presumed dead and may be taken over
+    locked_until = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotencykey_user_key_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} {self.key}"
+
+class ProductRecommendation(models.Model):
+    """Precomputed "complete the fit" pick for a product, rebuilt by `manage.py build_recommendations`"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    # Lift: how much more often the two are bought together than by chance
+    score = models.FloatField()
+    co_orders = models.PositiveIntegerField()
+    
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            # Also the index behind the product page's single lookup
+            models.UniqueConstraint(fields=['product', 'rank'], name='recommendation_product_rank_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank})"
+
+
+class ProductPopularity(models.Model):
+    """View and add-to-cart counters for a product, written in batches by store.popularity"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    views = models.PositiveBigIntegerField(default=0)
+    cart_adds = models.PositiveBigIntegerField(default=0)
+    # log2 of the forward-decayed event weight; see store/popularity.py
+    trend = models.FloatField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'product popularity'
+        indexes = [
+            models.Index(fields=['-trend'], name='popularity_trend_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id}: {self.views} views, {self.cart_adds} adds"
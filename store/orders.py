@@ -0,0 +1,46 @@
+# A customer's order history, newest first, in keyset-paginated pages
+#
+# Each page is one indexed range scan on (user, created, id) that reads
+# the order rows alone: counts and the first few lines are denormalized
+# onto Order at checkout. Only orders with more lines than the summary
+# holds have their items loaded, all in one extra query.
+from django.db.models import Prefetch, Q, prefetch_related_objects
+from django.utils.dateparse import parse_datetime
+
+from .listing import decode_cursor, encode_cursor
+from .models import Order, OrderItem
+
+PAGE_SIZE = 10
+
+
+def _after(payload):
+    """Filter for orders older than the cursor's (created, id), or None if it isn't valid"""
+    keys = payload.get('k') if payload else None
+    if not isinstance(keys, list) or len(keys) != 2:
+        return None
+    created = parse_datetime(keys[0]) if isinstance(keys[0], str) else None
+    if created is None or not isinstance(keys[1], int):
+        return None
+    return Q(created__lt=created) | Q(created=created, id__lt=keys[1])
+
+
+def get_order_page(user, cursor=None, limit=PAGE_SIZE):
+    """Return (orders, next_cursor) for one page of `user`'s orders"""
+    queryset = Order.objects.filter(user=user).order_by('-created', '-id')
+    after = _after(decode_cursor(cursor))
+    if after is not None:
+        queryset = queryset.filter(after)
+    orders = list(queryset[:limit + 1])
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        last = orders[-1]
+        next_cursor = encode_cursor({'k': [last.created.isoformat(), last.id]})
+
+    long_orders = [order for order in orders if order.more_lines > 0]
+    if long_orders:
+        prefetch_related_objects(
+            long_orders, Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('id'))
+        )
+    return orders, next_cursor
@@ -0,0 +1,113 @@
+# Full-page cache for the anonymous catalog pages (home, product list, product page)
+#
+# Rendered HTML is kept in the Django cache under the path and the sorted
+# query string, tagged with the page-cache version; signals and stock
+# updates bump the version on commit, which makes every page stale at once.
+# Stale and expired pages are re-rendered by one request at a time
+# (store/single_flight.py, family 'pages') while the others are served the
+# previous copy or wait for the new one.
+#
+# Responses carry an ETag and Last-Modified and are marked `private,
+# no-cache`, so browsers revalidate every time and get a bodyless 304
+# when nothing changed.
+#
+# A page is served from the cache only when nothing in it belongs to the
+# visitor. Logged-in users and requests with pending flash messages always
+# get a fresh render. The header cart badge is read from the signed cart
+# cookie, so its count is part of the key. The CSRF token in the add-to-
+# cart forms is swapped for a placeholder before storing and replaced with
+# the visitor's own token on the way out.
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .cart import get_cart_count
+from .single_flight import bump_version, get_or_set, shared_version
+
+VERSION_KEY = 'pages:version'
+CSRF_PLACEHOLDER = b'page-cache-csrf-token'
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def invalidate_pages(**kwargs):
+    """Make every cached page stale"""
+    bump_version(VERSION_KEY)
+
+
+def _cacheable(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # len() loads pending messages without marking them shown
+    return not len(get_messages(request))
+
+
+def _cache_key(request):
+    query = '&'.join(sorted(request.GET.urlencode().split('&')))
+    page = f'{request.path}?{query}|cart={get_cart_count(request)}'
+    return f'pages:{hashlib.md5(page.encode("utf-8")).hexdigest()}'
+
+
+def _store(request, response):
+    """Cache entry for a fresh render, or None if the response can't be shared"""
+    if (response.status_code != 200 or response.streaming or response.cookies
+            or len(get_messages(request))):
+        return None
+    content = CSRF_INPUT.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content)
+    return {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'etag': quote_etag(hashlib.md5(content).hexdigest()),
+        'last_modified': int(time.time()),
+    }
+
+
+def _serve(request, entry, status):
+    content = entry['content']
+    if CSRF_PLACEHOLDER in content:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode('ascii'))
+    response = HttpResponse(content, content_type=entry['content_type'])
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    response['X-Page-Cache'] = status
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(
+        request, etag=entry['etag'], last_modified=entry['last_modified'], response=response
+    )
+
+
+def cached_page(on_hit=None):
+    """Serve the view's anonymous renders from the page cache
+
+    `on_hit(request, *args, **kwargs)` runs for requests answered from the
+    cache, for work the view must not skip (such as counting a product view).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _cacheable(request):
+                return view(request, *args, **kwargs)
+            response = None
+
+            def render():
+                nonlocal response
+                response = view(request, *args, **kwargs)
+                return _store(request, response)
+
+            entry = get_or_set('pages', _cache_key(request), render, version=shared_version(VERSION_KEY))
+            if response is None:
+                # Rendered by an earlier (or concurrent) request
+                if on_hit:
+                    on_hit(request, *args, **kwargs)
+                return _serve(request, entry, 'hit')
+            if entry is None:
+                return response
+            return _serve(request, entry, 'miss')
+        return wrapper
+    return decorator
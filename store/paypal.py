@@ -0,0 +1,370 @@
+# PayPal REST client shared by every request in the process
+#
+# One requests.Session keeps TLS connections to PayPal alive between
+# checkouts, and the OAuth access token is cached until shortly before
+# PayPal says it expires. When it does need refreshing, one thread fetches
+# it while the others wait for that result instead of each asking PayPal.
+#
+# Every call has connect/read timeouts so a slow PayPal cannot pin
+# workers. Idempotent GETs are retried with jittered exponential backoff,
+# but only while the shared retry budget allows, so retries cannot
+# multiply load during an outage. A circuit breaker stops calling PayPal
+# at all after repeated failures and lets a single probe through once the
+# cool-down has passed.
+import random
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+LIVE_API = 'https://api.paypal.com'
+SANDBOX_API = 'https://api.sandbox.paypal.com'
+
+POOL_SIZE = 20
+# Refresh this long before expiry (capped at a tenth of the token's lifetime)
+TOKEN_REFRESH_MARGIN = 60
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 2.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Order states in which the buyer has approved (or already paid) the payment
+PAYABLE_ORDER_STATUSES = {'APPROVED', 'COMPLETED'}
+
+# Seconds, upper bounds of the latency histogram
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class PayPalError(Exception):
+    pass
+
+
+class CircuitOpenError(PayPalError):
+    pass
+
+
+class Metrics:
+    """Thread-safe counters and a latency histogram for calls to PayPal"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.transitions = {}
+            self.latency = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def transition(self, old, new):
+        key = f'{old}->{new}'
+        with self._lock:
+            self.transitions[key] = self.transitions.get(key, 0) + 1
+
+    def observe(self, seconds):
+        with self._lock:
+            latency = self.latency
+            latency['count'] += 1
+            latency['sum'] += seconds
+            latency['max'] = max(latency['max'], seconds)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    latency['buckets'][i] += 1
+                    break
+            else:
+                latency['buckets'][-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            latency = dict(self.latency)
+            return {
+                'counters': dict(self.counters),
+                'transitions': dict(self.transitions),
+                'latency': {
+                    'count': latency['count'],
+                    'sum': round(latency['sum'], 6),
+                    'max': round(latency['max'], 6),
+                    'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], latency['buckets'])),
+                },
+            }
+
+
+class RetryBudget:
+    """Every first attempt earns `ratio` of a retry; a retry spends one
+
+    Caps retries at roughly `ratio` extra traffic, with a small `reserve` so
+    a quiet process can still retry an occasional blip.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.balance = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.balance = min(self.reserve, self.balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.balance >= 1:
+                self.balance -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures;
+    open -> half_open after `reset_timeout` seconds, where one probe decides
+    whether to close again or stay open."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, metrics=None, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.metrics = metrics
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _move(self, state):
+        if state != self.state:
+            if self.metrics:
+                self.metrics.transition(self.state, state)
+            self.state = state
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self._move(self.HALF_OPEN)
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._move(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                self._move(self.OPEN)
+
+
+class PayPalClient:
+    def __init__(self, client_id, client_secret, base_url, session=None,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), max_attempts=MAX_ATTEMPTS,
+                 retry_budget=None, breaker=None, metrics=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.base_url = base_url.rstrip('/')
+        self.session = session or self._make_session()
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.metrics = metrics or Metrics()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker(metrics=self.metrics)
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = threading.Lock()
+
+    @property
+    def config(self):
+        return (self.client_id, self.client_secret, self.base_url)
+
+    @staticmethod
+    def _make_session():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept': 'application/json', 'Accept-Language': 'en_US'})
+        return session
+
+    @staticmethod
+    def backoff(attempt):
+        """Full-jitter exponential backoff before retry number `attempt` (1-based)"""
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def request(self, method, path, **kwargs):
+        """Send one logical request through the breaker, retrying GETs within the budget
+
+        Returns the final response, or raises PayPalError (CircuitOpenError
+        when failing fast) if PayPal could not be reached.
+        """
+        retryable = method == 'GET'
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            if not self.breaker.allow():
+                self.metrics.incr('short_circuited')
+                raise CircuitOpenError('PayPal is unavailable')
+
+            self.metrics.incr('attempts')
+            started = time.monotonic()
+            error = None
+            try:
+                response = self.session.request(method, f'{self.base_url}{path}', timeout=self.timeout, **kwargs)
+            except requests.Timeout as e:
+                response, error = None, e
+                self.metrics.incr('timeouts')
+            except requests.RequestException as e:
+                response, error = None, e
+                self.metrics.incr('connection_errors')
+            self.metrics.observe(time.monotonic() - started)
+
+            if response is not None and response.status_code not in RETRYABLE_STATUSES:
+                self.breaker.record_success()
+                return response
+
+            self.breaker.record_failure()
+            self.metrics.incr('failures')
+            if not retryable or attempt >= self.max_attempts:
+                break
+            if not self.retry_budget.withdraw():
+                self.metrics.incr('retry_budget_exhausted')
+                break
+            self.metrics.incr('retries')
+            time.sleep(self.backoff(attempt))
+
+        if response is not None:
+            return response
+        raise PayPalError(f'PayPal request failed: {error}')
+
+    def _fetch_token(self):
+        response = self.request(
+            'POST', '/v1/oauth2/token',
+            data={'grant_type': 'client_credentials'},
+            auth=(self.client_id, self.client_secret),
+        )
+        if response.status_code != 200:
+            raise PayPalError(f'Token request failed with status {response.status_code}')
+        data = response.json()
+        expires_in = float(data.get('expires_in', 0))
+        margin = min(TOKEN_REFRESH_MARGIN, expires_in / 10)
+        return data['access_token'], time.monotonic() + expires_in - margin
+
+    def access_token(self):
+        """Return a valid access token, fetching one only if the cached token is stale"""
+        if self._token and time.monotonic() < self._token_expires:
+            return self._token
+        with self._token_lock:
+            # Whoever held the lock before us may already have refreshed it
+            if self._token and time.monotonic() < self._token_expires:
+                return self._token
+            self._token, self._token_expires = self._fetch_token()
+            return self._token
+
+    def invalidate_token(self, token):
+        with self._token_lock:
+            if self._token == token:
+                self._token = None
+
+    def _get(self, path):
+        token = self.access_token()
+        response = self.request('GET', path, headers={'Authorization': f'Bearer {token}'})
+        if response.status_code == 401:
+            # Revoked or expired early; retry once with a fresh token
+            self.invalidate_token(token)
+            token = self.access_token()
+            response = self.request('GET', path, headers={'Authorization': f'Bearer {token}'})
+        return response
+
+    def get_order(self, order_id):
+        """Return the PayPal order as a dict, or None if PayPal does not know it"""
+        response = self._get(f'/v2/checkout/orders/{order_id}')
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise PayPalError(f'Order lookup failed with status {response.status_code}')
+        return response.json()
+
+    def verify_webhook_signature(self, headers, event, webhook_id):
+        """Ask PayPal whether a webhook delivery really came from it"""
+        token = self.access_token()
+        response = self.request(
+            'POST', '/v1/notifications/verify-webhook-signature',
+            headers={'Authorization': f'Bearer {token}'},
+            json={
+                'auth_algo': headers.get('Paypal-Auth-Algo'),
+                'cert_url': headers.get('Paypal-Cert-Url'),
+                'transmission_id': headers.get('Paypal-Transmission-Id'),
+                'transmission_sig': headers.get('Paypal-Transmission-Sig'),
+                'transmission_time': headers.get('Paypal-Transmission-Time'),
+                'webhook_id': webhook_id,
+                'webhook_event': event,
+            },
+        )
+        if response.status_code != 200:
+            raise PayPalError(f'Webhook verification failed with status {response.status_code}')
+        return response.json().get('verification_status') == 'SUCCESS'
+
+    def verify_order_amount(self, order_id, expected_amount):
+        """Whether PayPal's order `order_id` is for `expected_amount`"""
+        order = self.get_order(order_id)
+        if not order:
+            return False
+        return abs(order_amount(order) - Decimal(str(expected_amount))) < Decimal('0.01')
+
+
+def order_amount(order):
+    """Amount of a PayPal order payload, as a Decimal"""
+    try:
+        return Decimal(str(order['purchase_units'][0]['amount']['value']))
+    except (KeyError, IndexError, TypeError, InvalidOperation):
+        raise PayPalError('Unexpected order payload')
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def api_base():
+    if settings.PAYPAL_API_BASE:
+        return settings.PAYPAL_API_BASE
+    return SANDBOX_API if settings.PAYPAL_MODE == 'sandbox' else LIVE_API
+
+
+def get_client():
+    """Return the process-wide client, rebuilt if the PayPal settings change"""
+    global _client
+    config = (settings.PAYPAL_CLIENT_ID, settings.PAYPAL_CLIENT_SECRET, api_base().rstrip('/'))
+    client = _client
+    if client is None or client.config != config:
+        with _client_lock:
+            client = _client
+            if client is None or client.config != config:
+                client = _client = PayPalClient(
+                    *config, timeout=(settings.PAYPAL_CONNECT_TIMEOUT, settings.PAYPAL_READ_TIMEOUT)
+                )
+    return client
+
+
+def metrics_snapshot():
+    """Counters, breaker state and latency histogram for the process-wide client"""
+    client = get_client()
+    return dict(client.metrics.snapshot(), state=client.breaker.state)
@@ -0,0 +1,219 @@
+# A small local stand-in for the PayPal REST API, for tests and benchmarks
+#
+# It speaks just enough of the API for store.paypal (OAuth client
+# credentials, order lookup and webhook signature checks), keeps connections alive like the real
+# service, and counts what it sees so callers can assert on token fetches
+# and connection reuse without network access. Faults (error statuses,
+# slow responses, dropped connections) can be queued to exercise
+# timeouts, retries and the circuit breaker.
+#
+#     with StubPayPalServer() as stub:
+#         stub.add_order('5O190127TN364715T', '49.99')
+#         stub.inject(status=503, times=2)
+#         client = PayPalClient(stub.client_id, stub.client_secret, stub.url)
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write; split header/body writes on a kept-alive
+    # connection hit Nagle + delayed ACK and add ~40ms per request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.stub.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def apply_fault(self):
+        """Play the next queued fault; return True if it replaced the response"""
+        fault = self.server.stub.next_fault()
+        if fault is None:
+            return False
+        if fault['delay']:
+            time.sleep(fault['delay'])
+        if fault['drop']:
+            self.close_connection = True
+            return True
+        if fault['status']:
+            self.send_json(fault['status'], {'name': 'INJECTED_FAULT'})
+            return True
+        return False
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self.read_body()
+        if self.path == '/v1/notifications/verify-webhook-signature':
+            stub.count('webhook_verifications')
+            if self.apply_fault():
+                return
+            token = (self.headers.get('Authorization') or '').removeprefix('Bearer ')
+            if token not in stub.tokens:
+                return self.send_json(401, {'error': 'invalid_token'})
+            request = json.loads(body or b'{}')
+            valid = hmac.compare_digest(
+                request.get('transmission_sig') or '',
+                stub.signature(request.get('transmission_id'), request.get('transmission_time'),
+                               request.get('webhook_id'), request.get('webhook_event') or {}),
+            )
+            return self.send_json(200, {'verification_status': 'SUCCESS' if valid else 'FAILURE'})
+        if self.path == '/v1/oauth2/token':
+            stub.count('token_requests')
+            if self.apply_fault():
+                return
+            expected = base64.b64encode(f'{stub.client_id}:{stub.client_secret}'.encode()).decode()
+            if self.headers.get('Authorization') != f'Basic {expected}':
+                return self.send_json(401, {'error': 'invalid_client'})
+            return self.send_json(200, {
+                'access_token': stub.issue_token(),
+                'token_type': 'Bearer',
+                'expires_in': stub.expires_in,
+            })
+        self.send_json(404, {'name': 'RESOURCE_NOT_FOUND'})
+
+    def do_GET(self):
+        stub = self.server.stub
+        prefix = '/v2/checkout/orders/'
+        if not self.path.startswith(prefix):
+            return self.send_json(404, {'name': 'RESOURCE_NOT_FOUND'})
+        stub.count('order_requests')
+        if self.apply_fault():
+            return
+        token = (self.headers.get('Authorization') or '').removeprefix('Bearer ')
+        if token not in stub.tokens:
+            return self.send_json(401, {'error': 'invalid_token'})
+        order = stub.orders.get(self.path[len(prefix):])
+        if order is None:
+            return self.send_json(404, {'name': 'RESOURCE_NOT_FOUND'})
+        self.send_json(200, order)
+
+
+class StubPayPalServer:
+    """Threaded PayPal stand-in on 127.0.0.1; use as a context manager or call start()/stop()"""
+
+    def __init__(self, client_id='stub-client', client_secret='stub-secret', expires_in=32400, port=0,
+                 webhook_id='stub-webhook'):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.webhook_id = webhook_id
+        self.expires_in = expires_in
+        self.orders = {}
+        self.tokens = set()
+        self.counts = {'connections': 0, 'token_requests': 0, 'order_requests': 0, 'webhook_verifications': 0}
+        self.faults = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def issue_token(self):
+        token = secrets.token_urlsafe(16)
+        with self._lock:
+            self.tokens.add(token)
+        return token
+
+    def revoke_tokens(self):
+        with self._lock:
+            self.tokens.clear()
+
+    def inject(self, status=None, delay=0, drop=False, times=1):
+        """Queue a fault for the next `times` requests: an error status, a delay and/or a dropped connection"""
+        with self._lock:
+            self.faults.extend([{'status': status, 'delay': delay, 'drop': drop}] * times)
+
+    def next_fault(self):
+        with self._lock:
+            return self.faults.pop(0) if self.faults else None
+
+    def add_order(self, order_id, amount, currency='USD', status='COMPLETED'):
+        self.orders[order_id] = {
+            'id': order_id,
+            'status': status,
+            'purchase_units': [{'amount': {'currency_code': currency, 'value': str(amount)}}],
+        }
+        return self.orders[order_id]
+
+    def signature(self, transmission_id, transmission_time, webhook_id, event):
+        # Stands in for PayPal's certificate signature over the same fields
+        message = f"{transmission_id}|{transmission_time}|{webhook_id}|{event.get('id')}"
+        return hmac.new(self.client_secret.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+    def webhook_headers(self, event, webhook_id=None):
+        """Delivery headers the stub will vouch for when asked to verify `event`"""
+        transmission_id = str(uuid.uuid4())
+        transmission_time = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return {
+            'Paypal-Auth-Algo': 'SHA256withRSA',
+            'Paypal-Cert-Url': f'{self.url}/certs/stub',
+            'Paypal-Transmission-Id': transmission_id,
+            'Paypal-Transmission-Time': transmission_time,
+            'Paypal-Transmission-Sig': self.signature(
+                transmission_id, transmission_time, webhook_id or self.webhook_id, event
+            ),
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def capture_event(paypal_order_id, amount, event_type='PAYMENT.CAPTURE.COMPLETED', event_id=None, currency='USD'):
+    """A webhook event shaped like PayPal's for a capture on `paypal_order_id`"""
+    return {
+        'id': event_id or f'WH-{uuid.uuid4().hex[:20].upper()}',
+        'event_version': '1.0',
+        'create_time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'resource_type': 'capture',
+        'event_type': event_type,
+        'resource': {
+            'id': f'CAP-{uuid.uuid4().hex[:16].upper()}',
+            'status': event_type.rsplit('.', 1)[-1],
+            'amount': {'currency_code': currency, 'value': str(amount)},
+            'supplementary_data': {'related_ids': {'order_id': paypal_order_id}},
+        },
+    }
@@ -0,0 +1,136 @@
+# PayPal webhook handling
+#
+# The checkout request only records a pending order; PayPal then tells us
+# what happened to the payment. Each delivery is verified with PayPal,
+# recorded once by event id (PayPal redelivers until it gets a 2xx), and
+# applied to the matching order. An event can arrive before the browser
+# has created the order; it then waits in the table and is applied as soon
+# as the pending order shows up.
+#
+# A pending order holds its stock, so one whose capture never arrives is
+# cancelled and restocked by expire_pending_orders() (run from cron) once
+# it is PAYPAL_PENDING_ORDER_TTL seconds old. Captures that don't fit their
+# order (wrong amount, or the order already expired) put it in 'review' for
+# staff instead of completing it.
+import logging
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .checkout import set_order_status
+from .inventory import SWEEP_BATCH_SIZE
+from .models import Order, PayPalWebhookEvent
+from .paypal import get_client
+
+CAPTURE_COMPLETED = 'PAYMENT.CAPTURE.COMPLETED'
+CAPTURE_DENIED = 'PAYMENT.CAPTURE.DENIED'
+CAPTURE_REVERSED = 'PAYMENT.CAPTURE.REVERSED'
+CAPTURE_REFUNDED = 'PAYMENT.CAPTURE.REFUNDED'
+HANDLED_EVENTS = {CAPTURE_COMPLETED, CAPTURE_DENIED, CAPTURE_REVERSED, CAPTURE_REFUNDED}
+
+logger = logging.getLogger(__name__)
+
+
+def verify_webhook(headers, event):
+    """Whether PayPal vouches for this delivery; raises PayPalError if PayPal can't be asked"""
+    if not settings.PAYPAL_WEBHOOK_ID:
+        return False
+    return get_client().verify_webhook_signature(headers, event, settings.PAYPAL_WEBHOOK_ID)
+
+
+def related_order_id(event):
+    resource = event.get('resource') or {}
+    related = (resource.get('supplementary_data') or {}).get('related_ids') or {}
+    return related.get('order_id') or ''
+
+
+def _captured_amount(event):
+    try:
+        return Decimal(str(event['resource']['amount']['value']))
+    except (KeyError, TypeError, InvalidOperation):
+        return None
+
+
+def apply_event(record):
+    """Apply a recorded event to its order; return False if the order doesn't exist yet"""
+    if record.event_type in HANDLED_EVENTS:
+        order = (
+            Order.objects.select_for_update()
+            .filter(payment_method='paypal', payment_id=record.paypal_order_id)
+            .first()
+        ) if record.paypal_order_id else None
+        if order is None:
+            return False
+
+        status = order.status
+        if record.event_type == CAPTURE_COMPLETED and order.status == 'pending':
+            amount = _captured_amount(record.payload)
+            if amount == order.total_amount:
+                status = 'completed'
+            else:
+                # Money was taken but not what we asked for: keep the stock and let staff decide
+                logger.error('PayPal captured %s for order #%s of %s', amount, order.id, order.total_amount)
+                status = 'review'
+        elif record.event_type == CAPTURE_COMPLETED and order.status == 'cancelled':
+            # Paid after expire_pending_orders gave its stock back
+            logger.error('PayPal capture arrived for cancelled order #%s', order.id)
+            status = 'review'
+        elif record.event_type == CAPTURE_DENIED and order.status == 'pending':
+            status = 'cancelled'
+        elif record.event_type in (CAPTURE_REVERSED, CAPTURE_REFUNDED):
+            status = 'cancelled'
+        if status != order.status:
+            set_order_status(order, status)
+
+    record.processed_at = timezone.now()
+    record.save(update_fields=['processed_at'])
+    return True
+
+
+def receive_event(event):
+    """Record and apply a verified event once; return 'duplicate', 'processed' or 'waiting'"""
+    with transaction.atomic():
+        record, created = PayPalWebhookEvent.objects.get_or_create(
+            event_id=event['id'],
+            defaults={
+                'event_type': event.get('event_type', ''),
+                'paypal_order_id': related_order_id(event),
+                'payload': event,
+            },
+        )
+        if not created:
+            return 'duplicate'
+        return 'processed' if apply_event(record) else 'waiting'
+
+
+def apply_waiting_events(paypal_order_id):
+    """Apply events that arrived before the browser created the pending order"""
+    with transaction.atomic():
+        waiting = PayPalWebhookEvent.objects.select_for_update().filter(
+            paypal_order_id=paypal_order_id, processed_at__isnull=True
+        ).order_by('received', 'id')
+        for record in waiting:
+            apply_event(record)
+
+
+def expire_pending_orders(max_age=None, batch_size=SWEEP_BATCH_SIZE, now=None):
+    """Cancel and restock PayPal orders still pending after `max_age` seconds; return how many"""
+    max_age = settings.PAYPAL_PENDING_ORDER_TTL if max_age is None else max_age
+    cutoff = (now or timezone.now()) - timedelta(seconds=max_age)
+    expired = 0
+    while True:
+        with transaction.atomic():
+            # skip_locked leaves orders a webhook is updating right now for the next sweep
+            orders = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(payment_method='paypal', status='pending', created__lte=cutoff)
+                .order_by('created')[:batch_size]
+            )
+            for order in orders:
+                set_order_status(order, 'cancelled')
+        expired += len(orders)
+        if len(orders) < batch_size:
+            return expired
@@ -0,0 +1,170 @@
+# Write-behind popularity counters for "trending" sorting
+#
+# product_detail and add_to_cart call record_view() / record_cart_add(),
+# which only bump a per-product tally in this process's memory. A
+# background thread flushes the tallies every POPULARITY_FLUSH_INTERVAL
+# seconds as one batched upsert into ProductPopularity, so a burst of
+# traffic on a hot product costs one row write per flush instead of an
+# UPDATE per request. Tallies still in memory when a process dies are
+# lost; these are ranking signals, not accounting.
+#
+# Scores halve every POPULARITY_HALF_LIFE seconds. Rather than rewriting
+# every row as time passes, an event at time t is stored with weight
+#
+#     w * 2 ** ((t - EPOCH) / half_life)
+#
+# ("forward decay"). Every product's sum is inflated by the same factor at
+# any moment, so rows order by it exactly as by their decayed scores and
+# only rows with new events are ever written. `trend` holds log2 of the sum
+# to stay in float range; score() turns it back into today's value.
+# Changing the half-life changes the units, so reset the table if you do.
+import math
+import os
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Product, ProductPopularity
+
+EPOCH = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+VIEW_WEIGHT = 1
+CART_ADD_WEIGHT = 5
+# Sort key for products without a counters row: below any that has one
+NO_TREND = -1e9
+# Distinct products buffered before the flusher is woken early
+MAX_PENDING = 10000
+
+
+def _half_lives(now):
+    return (now - EPOCH).total_seconds() / settings.POPULARITY_HALF_LIFE
+
+
+def _log2_add(a, b):
+    """log2(2**a + 2**b) without leaving float range"""
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def score(trend, now=None):
+    """Decayed event weight at `now` for a stored `trend`"""
+    if trend is None or trend <= NO_TREND:
+        return 0.0
+    return 2 ** (trend - _half_lives(now or timezone.now()))
+
+
+def write(pending, now=None):
+    """Add {product_id: (views, cart_adds)} to ProductPopularity in one batch; return rows written"""
+    now = now or timezone.now()
+    # Read outside the transaction: events for deleted (or never stored) products are dropped
+    product_ids = sorted(Product.objects.filter(pk__in=list(pending)).order_by().values_list('pk', flat=True))
+    if not product_ids:
+        return 0
+    offset = _half_lives(now)
+    with transaction.atomic():
+        ProductPopularity.objects.bulk_create(
+            [ProductPopularity(product_id=pk) for pk in product_ids], ignore_conflicts=True
+        )
+        rows = list(ProductPopularity.objects.select_for_update().filter(product_id__in=product_ids))
+        for row in rows:
+            views, cart_adds = pending[row.product_id]
+            trend = offset + math.log2(views * VIEW_WEIGHT + cart_adds * CART_ADD_WEIGHT)
+            fresh = not row.views and not row.cart_adds
+            row.trend = trend if fresh else _log2_add(row.trend, trend)
+            row.views += views
+            row.cart_adds += cart_adds
+            row.updated = now
+        ProductPopularity.objects.bulk_update(rows, ['views', 'cart_adds', 'trend', 'updated'])
+    return len(rows)
+
+
+class CounterBuffer:
+    """Per-process event tallies, flushed to the database by a daemon thread
+
+    `interval` defaults to settings.POPULARITY_FLUSH_INTERVAL; 0 writes every
+    event straight through.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # One flush at a time, so flush() returns only once earlier events are stored
+        self._flushing = threading.Lock()
+        self._pid = None
+
+    def get_interval(self):
+        return settings.POPULARITY_FLUSH_INTERVAL if self.interval is None else self.interval
+
+    def add(self, product_id, views=0, cart_adds=0):
+        with self._lock:
+            counts = self._pending.setdefault(product_id, [0, 0])
+            counts[0] += views
+            counts[1] += cart_adds
+            full = len(self._pending) >= MAX_PENDING
+        if self.get_interval() <= 0:
+            self.flush()
+            return
+        self._start()
+        if full:
+            self._wake.set()
+
+    def take(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def flush(self):
+        """Write everything buffered so far; return rows written"""
+        with self._flushing:
+            pending = self.take()
+            if not pending:
+                return 0
+            try:
+                return write(pending)
+            except Exception as e:
+                print(f"Error flushing popularity counters: {e}")
+                # Keep them for the next flush
+                with self._lock:
+                    for product_id, (views, cart_adds) in pending.items():
+                        counts = self._pending.setdefault(product_id, [0, 0])
+                        counts[0] += views
+                        counts[1] += cart_adds
+                return 0
+
+    def _start(self):
+        # Checked by pid: a worker forked from a preloaded parent has no flusher yet
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            threading.Thread(target=self._run, name='popularity-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.get_interval())
+            self._wake.clear()
+            self.flush()
+            connection.close()
+
+
+_buffer = CounterBuffer()
+
+
+def record_view(product_id):
+    _buffer.add(product_id, views=1)
+
+
+def record_cart_add(product_id):
+    _buffer.add(product_id, cart_adds=1)
+
+
+def flush():
+    """Write this process's buffered events now; return rows written"""
+    return _buffer.flush()
@@ -0,0 +1,121 @@
+# "Complete the fit": products bought together, precomputed offline
+#
+# `manage.py build_recommendations` reads which products appear in which
+# orders, counts co-occurrences and scores each pair by lift
+#
+#     lift(a, b) = orders(a and b) * orders / (orders(a) * orders(b))
+#
+# i.e. how much more often b is in a's orders than its popularity alone
+# predicts. The top pairs per product are written to ProductRecommendation,
+# so the product page does one indexed lookup and never scores anything.
+#
+# With NumPy and SciPy installed (both are in requirements.txt) the counts
+# are a sparse order x product matrix product and the scoring and top-K
+# selection are vectorized. Without them the same scores are computed in
+# pure Python, which is fine for a store with a modest order history.
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from .catalog import get_product_by_id
+from .models import OrderItem, ProductRecommendation
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover - optional speedup
+    np = sparse = None
+
+TOP_K = 4
+# Pairs bought together fewer times than this are noise, whatever their lift
+MIN_SUPPORT = 2
+
+
+def order_products():
+    """Distinct (order_id, product_id) pairs from orders that weren't cancelled"""
+    return (
+        OrderItem.objects.exclude(order__status='cancelled')
+        .values_list('order_id', 'product_id').distinct().order_by()
+        .iterator(chunk_size=10000)
+    )
+
+
+def score_numpy(pairs, top_k=TOP_K, min_support=MIN_SUPPORT):
+    """{product_id: [(recommended_id, lift, co_orders), ...]} best first, using sparse matrices"""
+    pairs = np.fromiter((value for pair in pairs for value in pair), dtype=np.int64).reshape(-1, 2)
+    if not len(pairs):
+        return {}
+    order_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    product_ids, cols = np.unique(pairs[:, 1], return_inverse=True)
+    baskets = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int32), (rows, cols)), shape=(len(order_ids), len(product_ids))
+    )
+
+    together = (baskets.T @ baskets).tocoo()
+    counts = np.asarray(baskets.sum(axis=0)).ravel().astype(np.float64)
+    keep = (together.row != together.col) & (together.data >= min_support)
+    a, b, co = together.row[keep], together.col[keep], together.data[keep]
+    # co is int32 like the matrix; multiplied as is, it wraps past 2**31
+    lift = co.astype(np.float64) * len(order_ids) / (counts[a] * counts[b])
+
+    # Best first within each product: lift, then support, then lowest id
+    order = np.lexsort((product_ids[b], -co, -lift, a))
+    a, b, co, lift = a[order], b[order], co[order], lift[order]
+    starts = np.searchsorted(a, a, side='left')
+    rank = np.arange(len(a)) - starts
+    top = rank < top_k
+
+    recommendations = defaultdict(list)
+    for i, j, score, support in zip(a[top], b[top], lift[top], co[top]):
+        recommendations[int(product_ids[i])].append((int(product_ids[j]), float(score), int(support)))
+    return dict(recommendations)
+
+
+def score_python(pairs, top_k=TOP_K, min_support=MIN_SUPPORT):
+    """Same result as score_numpy, without NumPy"""
+    baskets = defaultdict(set)
+    for order_id, product_id in pairs:
+        baskets[order_id].add(product_id)
+
+    counts = Counter()
+    together = Counter()
+    for products in baskets.values():
+        counts.update(products)
+        for a in products:
+            for b in products:
+                if a != b:
+                    together[a, b] += 1
+
+    scored = defaultdict(list)
+    for (a, b), co in together.items():
+        if co >= min_support:
+            scored[a].append((b, co * len(baskets) / (counts[a] * counts[b]), co))
+    return {
+        a: sorted(candidates, key=lambda c: (-c[1], -c[2], c[0]))[:top_k]
+        for a, candidates in scored.items()
+    }
+
+
+def build(top_k=TOP_K, min_support=MIN_SUPPORT, use_numpy=None):
+    """Recompute every product's recommendations and swap them in; return how many rows were written"""
+    use_numpy = np is not None if use_numpy is None else use_numpy
+    score = score_numpy if use_numpy else score_python
+    recommendations = score(order_products(), top_k=top_k, min_support=min_support)
+    rows = [
+        ProductRecommendation(product_id=product_id, recommended_id=recommended_id, rank=rank,
+                              score=lift, co_orders=co_orders)
+        for product_id, picks in recommendations.items()
+        for rank, (recommended_id, lift, co_orders) in enumerate(picks)
+    ]
+    with transaction.atomic():
+        ProductRecommendation.objects.all().delete()
+        ProductRecommendation.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def get_recommendations(product_id, limit=TOP_K):
+    """Catalog cards for a product's precomputed picks: one indexed query, nothing scored"""
+    ids = ProductRecommendation.objects.filter(product_id=product_id).order_by('rank').values_list(
+        'recommended_id', flat=True
+    )[:limit]
+    return [card for card in map(get_product_by_id, ids) if card]
@@ -0,0 +1,144 @@
+# Daily sales rollups for reporting
+#
+# DailySales (per day) and DailyProductSales (per day, product and size)
+# hold completed orders only. Each order moves in or out of them exactly
+# once: Order.sales_recorded says whether it is counted, and it is flipped
+# by a conditional UPDATE in the same transaction as the counters, so a
+# task that runs twice or races the backfill can't count an order twice.
+# Reports read these tables and never aggregate Order or OrderItem.
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CENTS, DailyProductSales, DailySales, Order, OrderItem
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def _apply(day_totals, product_totals, sign):
+    """Add (sign=1) or remove (sign=-1) aggregated sales from the rollups"""
+    for day, (orders, units, revenue) in day_totals.items():
+        DailySales.objects.get_or_create(day=day)
+        DailySales.objects.filter(day=day).update(
+            orders=F('orders') + sign * orders,
+            units=F('units') + sign * units,
+            revenue=F('revenue') + sign * revenue,
+        )
+    for (day, product_id, size), (orders, units, revenue) in product_totals.items():
+        DailyProductSales.objects.get_or_create(day=day, product_id=product_id, size=size)
+        DailyProductSales.objects.filter(day=day, product_id=product_id, size=size).update(
+            orders=F('orders') + sign * orders,
+            units=F('units') + sign * units,
+            revenue=F('revenue') + sign * revenue,
+        )
+
+
+def _totals(order_ids):
+    """Aggregate `order_ids`' lines into per-day and per-day/product/size totals, in SQL"""
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .annotate(day=TruncDate('order__created'))
+        .values('day', 'product_id', 'size')
+        .annotate(
+            orders=Count('order_id', distinct=True),
+            units=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        )
+    )
+    product_totals = {}
+    for row in rows:
+        product_totals[(row['day'], row['product_id'], row['size'])] = (
+            row['orders'], row['units'], row['revenue'].quantize(CENTS),
+        )
+
+    day_totals = defaultdict(lambda: [0, 0, Decimal('0.00')])
+    for day, count in (
+        Order.objects.filter(pk__in=order_ids).annotate(day=TruncDate('created'))
+        .values('day').annotate(count=Count('id')).values_list('day', 'count')
+    ):
+        day_totals[day][0] = count
+    for (day, _, _), (_, units, revenue) in product_totals.items():
+        day_totals[day][1] += units
+        day_totals[day][2] += revenue
+    return dict(day_totals), product_totals
+
+
+def sync_order(order_id):
+    """Count a completed order in the rollups, or take a no-longer-completed one out
+
+    Safe to call any number of times; returns +1, -1 or 0 for what changed.
+    """
+    with transaction.atomic():
+        if Order.objects.filter(pk=order_id, status='completed', sales_recorded=False).update(sales_recorded=True):
+            sign = 1
+        elif Order.objects.filter(pk=order_id, sales_recorded=True).exclude(status='completed').update(
+            sales_recorded=False
+        ):
+            sign = -1
+        else:
+            return 0
+        _apply(*_totals([order_id]), sign)
+    return sign
+
+
+def backfill(chunk_size=BACKFILL_CHUNK_SIZE, rebuild=False):
+    """Fold every completed, uncounted order into the rollups, one chunk per transaction
+
+    With `rebuild`, the rollups are emptied first and recomputed from scratch.
+    Returns how many orders were added.
+    """
+    if rebuild:
+        with transaction.atomic():
+            DailyProductSales.objects.all().delete()
+            DailySales.objects.all().delete()
+            Order.objects.filter(sales_recorded=True).update(sales_recorded=False)
+
+    added = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            order_ids = list(
+                Order.objects.select_for_update()
+                .filter(pk__gt=last_id, status='completed', sales_recorded=False)
+                .order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not order_ids:
+                return added
+            Order.objects.filter(pk__in=order_ids).update(sales_recorded=True)
+            _apply(*_totals(order_ids), 1)
+        added += len(order_ids)
+        last_id = order_ids[-1]
+
+
+def report(start, end, top=10):
+    """Daily totals and best sellers between two dates (inclusive), from the rollups only"""
+    days = list(
+        DailySales.objects.filter(day__range=(start, end)).order_by('day')
+        .values('day', 'orders', 'units', 'revenue')
+    )
+    products = DailyProductSales.objects.filter(day__range=(start, end))
+    top_products = list(
+        products.values('product_id', 'product__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+        .order_by('-revenue', 'product_id')[:top]
+    )
+    sizes = list(
+        products.values('size').annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-units', 'size')
+    )
+    totals = {
+        'orders': sum(day['orders'] for day in days),
+        'units': sum(day['units'] for day in days),
+        'revenue': sum((day['revenue'] for day in days), Decimal('0.00')),
+    }
+    totals['average_order'] = (totals['revenue'] / totals['orders']).quantize(CENTS) if totals['orders'] else None
+    return {'days': days, 'top_products': top_products, 'sizes': sizes, 'totals': totals}
+
+
+def default_range(days=30):
+    end = timezone.localdate()
+    return end - timedelta(days=days - 1), end
@@ -0,0 +1,214 @@
+# Full-text product search over name, description and category
+#
+# SQLite keeps an FTS5 table keyed by product id; PostgreSQL keeps a
+# weighted tsvector per product behind a GIN index. Other databases fall
+# back to icontains matching so search still works, just without an index.
+import re
+
+from django.db import connection as default_connection
+from django.db.models import Q
+
+SEARCH_LIMIT = 100
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a raw query into lowercase word tokens"""
+    return TOKEN_RE.findall(query.lower())
+
+
+class SearchBackend:
+    """Fallback backend that scans the product table with icontains"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        pass
+
+    def drop_index(self):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def index_products(self, product_ids):
+        pass
+
+    def index_category(self, category_id):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def search_ids(self, query, limit=SEARCH_LIMIT):
+        from .models import Product
+
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        condition = Q()
+        for token in tokens:
+            condition &= (
+                Q(name__icontains=token)
+                | Q(description__icontains=token)
+                | Q(category__name__icontains=token)
+            )
+        return list(Product.objects.filter(condition).order_by('-featured', 'name').values_list('id', flat=True)[:limit])
+
+
+class SqliteSearchBackend(SearchBackend):
+    """FTS5 inverted index ranked with bm25, weighting name over category over description"""
+
+    table = 'store_product_fts'
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                f"USING fts5(name, category, description, tokenize='porter unicode61')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def _insert_sql(self, where=''):
+        return (
+            f'INSERT INTO {self.table} (rowid, name, category, description) '
+            f'SELECT p.id, p.name, c.name, p.description '
+            f'FROM store_product p JOIN store_category c ON c.id = p.category_id {where}'
+        )
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(self._insert_sql())
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table}')
+            return cursor.fetchone()[0]
+
+    def _reindex(self, where, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN (SELECT p.id FROM store_product p {where})', params)
+            cursor.execute(self._insert_sql(where), params)
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids:
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            self._reindex(f'WHERE p.id IN ({placeholders})', product_ids)
+
+    def index_category(self, category_id):
+        self._reindex('WHERE p.category_id = %s', [category_id])
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product_id])
+
+    def search_ids(self, query, limit=SEARCH_LIMIT):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # Quote every token so user input cannot inject FTS syntax; the last one is a prefix
+        match = ' '.join(f'"{token}"' for token in tokens[:-1]) + f' "{tokens[-1]}"*'
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                f'ORDER BY bm25({self.table}, 10.0, 4.0, 1.0) LIMIT %s',
+                [match.strip(), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Weighted tsvector per product behind a GIN index, ranked with ts_rank_cd"""
+
+    table = 'store_product_search'
+    document = (
+        "setweight(to_tsvector('english', p.name), 'A') || "
+        "setweight(to_tsvector('english', c.name), 'B') || "
+        "setweight(to_tsvector('english', p.description), 'C')"
+    )
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                f'product_id bigint PRIMARY KEY REFERENCES store_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                f'document tsvector NOT NULL)'
+            )
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_document_idx ON {self.table} USING GIN (document)')
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def _upsert_sql(self, where=''):
+        return (
+            f'INSERT INTO {self.table} (product_id, document) '
+            f'SELECT p.id, {self.document} '
+            f'FROM store_product p JOIN store_category c ON c.id = p.category_id {where} '
+            f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document'
+        )
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+            cursor.execute(self._upsert_sql())
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table}')
+            return cursor.fetchone()[0]
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self._upsert_sql('WHERE p.id = ANY(%s)'), [product_ids])
+
+    def index_category(self, category_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(self._upsert_sql('WHERE p.category_id = %s'), [category_id])
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE product_id = %s', [product_id])
+
+    def search_ids(self, query, limit=SEARCH_LIMIT):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # Prefix-match the last token so partially typed words still hit
+        tsquery = ' & '.join(tokens[:-1] + [f'{tokens[-1]}:*'])
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT product_id FROM {self.table}, to_tsquery('english', %s) query "
+                f'WHERE document @@ query ORDER BY ts_rank_cd(document, query) DESC, product_id LIMIT %s',
+                [tsquery, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(connection=None):
+    connection = connection or default_connection
+    return BACKENDS.get(connection.vendor, SearchBackend)(connection)
+
+
+def search_product_ids(query, limit=SEARCH_LIMIT):
+    """Return product ids matching `query`, best match first"""
+    return get_backend().search_ids(query, limit)
+
+
+def search_products(query, limit=SEARCH_LIMIT):
+    """Return catalog card dicts for products matching `query`, best match first"""
+    from .catalog import product_to_card
+    from .models import Product
+
+    ids = search_product_ids(query, limit)
+    rows = Product.objects.filter(id__in=ids).select_related('category').defer('description').in_bulk()
+    return [product_to_card(rows[i]) for i in ids if i in rows]
@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from allauth.account.signals import user_logged_in
+
+from .cart import merge_cookie_cart
+
+from .catalog import invalidate_catalog
+from .facets import invalidate_facets
+from .models import Category, Product
+from .page_cache import invalidate_pages
+from .search import get_backend
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def catalog_changed(sender, **kwargs):
+    """Rebuild catalog indexes, facet counts and cached pages once the write is visible to other connections"""
+    transaction.on_commit(invalidate_catalog)
+    transaction.on_commit(invalidate_facets)
+    transaction.on_commit(invalidate_pages)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Keep the full-text index in step with the saved row"""
+    get_backend().index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_backend().remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_category(sender, instance, created, **kwargs):
+    # Category names are part of every product document in the category
+    if not created:
+        get_backend().index_category(instance.pk)
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Carry what the shopper picked while logged out into their saved cart"""
+    merge_cookie_cart(request, user)
@@ -0,0 +1,179 @@
+# Single-flight recomputation with stale-while-revalidate
+#
+# When a popular cached value expires, every request that notices would
+# otherwise rebuild it at once. Here exactly one caller recomputes behind
+# a short lock and everyone else either keeps serving the previous copy or,
+# when there is none, waits briefly for the winner's result.
+#
+# Each key family has a soft and a hard TTL (settings.CACHE_FAMILIES).
+# Before the soft TTL an entry is fresh. Between the two, or once its
+# version is outdated, it is stale: one caller refreshes it while the rest
+# get the stale copy. Past the hard TTL it is gone, and callers queue for
+# the one rebuild.
+#
+# get_or_set() works on the shared Django cache (pages); LocalValue is the
+# same policy for a value kept in this process (the catalog). A LocalValue
+# given a `version_key` also follows a version counter in the shared cache,
+# so invalidating it in one worker makes it stale in all of them within
+# VERSION_CHECK seconds.
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import get_random_string
+
+DEFAULTS = {'SOFT_TTL': 60, 'HARD_TTL': 600, 'LOCK_TIMEOUT': 10, 'WAIT': 2, 'VERSION_CHECK': 1}
+POLL_INTERVAL = 0.05
+
+
+def family_options(family):
+    return {**DEFAULTS, **settings.CACHE_FAMILIES.get(family, {})}
+
+
+def shared_version(key):
+    """Current value of the cache-wide version counter `key`"""
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted counter never reuses an old version
+        version = time.time_ns()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def bump_version(key):
+    """Move the counter on, making everything built under the old version stale"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def _acquire(lock_key, timeout):
+    """Return a token if we took the lock, else None"""
+    token = get_random_string(16)
+    return token if cache.add(lock_key, token, timeout) else None
+
+
+def _release(lock_key, token):
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def _compute_and_store(key, compute, version, options):
+    value = compute()
+    if value is not None:
+        entry = {'value': value, 'version': version, 'fresh_until': time.time() + options['SOFT_TTL']}
+        cache.set(key, entry, options['HARD_TTL'])
+    return value
+
+
+def get_or_set(family, key, compute, version=None):
+    """Cached value for `key`, recomputed by one caller at a time
+
+    `compute()` returning None means the result must not be cached; that
+    caller gets None back. Entries written under a different `version`
+    are served stale until the refresh lands.
+    """
+    options = family_options(family)
+    lock_key = f'{key}:lock'
+    entry = cache.get(key)
+    if entry is not None:
+        if entry['version'] == version and entry['fresh_until'] > time.time():
+            return entry['value']
+        token = _acquire(lock_key, options['LOCK_TIMEOUT'])
+        if token is None:
+            return entry['value']
+        try:
+            value = _compute_and_store(key, compute, version, options)
+        finally:
+            _release(lock_key, token)
+        return value
+
+    token = _acquire(lock_key, options['LOCK_TIMEOUT'])
+    if token is None:
+        deadline = time.monotonic() + options['WAIT']
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry['value']
+            if cache.get(lock_key) is None:
+                break
+        # The winner is slow, failed or produced nothing cacheable: do it ourselves
+        return _compute_and_store(key, compute, version, options)
+    try:
+        return _compute_and_store(key, compute, version, options)
+    finally:
+        _release(lock_key, token)
+
+
+class LocalValue:
+    """A value held in this process and rebuilt by one thread at a time
+
+    `compute(build)` gets a number that moves on only when the value was
+    invalidated; a rebuild just for age reuses it, so work keyed on it (the
+    autocomplete index) survives. invalidate() makes the current value
+    stale rather than dropping it, in every process sharing `version_key`.
+    """
+
+    def __init__(self, family, compute, version_key=None):
+        self.family = family
+        self.compute = compute
+        self.version_key = version_key
+        self._entry = None  # (value, generation, built_at)
+        self._generation = 0
+        self._shared = (None, float('-inf'))  # (version, checked_at)
+        self._builds = 0
+        self._lock = threading.Lock()
+        self._generation_lock = threading.Lock()
+
+    def invalidate(self):
+        with self._generation_lock:
+            self._generation += 1
+        if self.version_key:
+            bump_version(self.version_key)
+            self._shared = (None, float('-inf'))
+
+    def _current(self, options):
+        """Generation an up-to-date entry was built under"""
+        if not self.version_key:
+            return self._generation
+        version, checked_at = self._shared
+        now = time.monotonic()
+        if now - checked_at >= options['VERSION_CHECK']:
+            version = shared_version(self.version_key)
+            self._shared = (version, now)
+        return self._generation, version
+
+    def get(self):
+        options = family_options(self.family)
+        entry = self._entry
+        if entry is not None:
+            value, generation, built_at = entry
+            age = time.monotonic() - built_at
+            if generation == self._current(options) and age < options['SOFT_TTL']:
+                return value
+            if age < options['HARD_TTL']:
+                if not self._lock.acquire(blocking=False):
+                    return value
+                try:
+                    return self._rebuild(options)
+                finally:
+                    self._lock.release()
+        with self._lock:
+            entry = self._entry
+            if entry is not None and entry[1] == self._current(options) and (
+                time.monotonic() - entry[2] < options['SOFT_TTL']
+            ):
+                return entry[0]
+            return self._rebuild(options)
+
+    def _rebuild(self, options):
+        generation = self._current(options)
+        if self._entry is None or self._entry[1] != generation:
+            self._builds += 1
+        value = self.compute(self._builds)
+        self._entry = (value, generation, time.monotonic())
+        return value
@@ -0,0 +1,413 @@
+# Memory-mapped catalog snapshot shared by every worker on a host
+#
+# Layout (all integers little-endian):
+#   header      magic, format, version, counts and section offsets
+#   categories  u32 offset per category record
+#   products    u32 offset per product record, in catalog order
+#   slugs       u32 product position per product, sorted by slug
+#   ids         (u32 id, u32 position) per product, sorted by id
+#   groups      (u32 start, u32 count) per category into `members`
+#   members     u32 product positions grouped by category
+#   featured    u32 product positions of featured products
+#   records     packed category and product records
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from decimal import Decimal
+
+MAGIC = b'CLAWSCAT'
+FORMAT = 2
+
+HEADER = struct.Struct('<8sHQIII7I')
+U32 = struct.Struct('<I')
+PAIR = struct.Struct('<II')
+STR_LEN = struct.Struct('<I')
+CATEGORY = struct.Struct('<I')
+# id, category position, price in cents, stock, featured, created, popularity
+PRODUCT = struct.Struct('<IHqIBqd')
+
+SIZE_SEPARATOR = '\x1f'
+NO_TIMESTAMP = -1
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _pack_str(value):
+    data = (value or '').encode('utf-8')
+    return STR_LEN.pack(len(data)) + data
+
+
+def _unpack_strs(buf, offset, count):
+    values = []
+    for _ in range(count):
+        (length,) = STR_LEN.unpack_from(buf, offset)
+        offset += STR_LEN.size
+        values.append(str(buf[offset:offset + length], 'utf-8'))
+        offset += length
+    return values
+
+
+def _timestamp(value):
+    if value is None:
+        return NO_TIMESTAMP
+    return int(value.timestamp() * 1_000_000)
+
+
+def _pack_category(category):
+    return CATEGORY.pack(category['id']) + b''.join(
+        _pack_str(category[key]) for key in ('name', 'slug', 'image', 'description')
+    )
+
+
+def _pack_product(product, category_position):
+    head = PRODUCT.pack(
+        product['id'],
+        category_position,
+        int((Decimal(str(product['price'])) * 100).to_integral_value()),
+        product['stock'],
+        1 if product.get('featured') else 0,
+        _timestamp(product.get('created')),
+        float(product.get('popularity') or 0),
+    )
+    sizes = SIZE_SEPARATOR.join(product.get('available_sizes') or [])
+    return head + b''.join(_pack_str(value) for value in (
+        product['name'], product['slug'], product['description'], product['image'], sizes,
+    ))
+
+
+def encode_catalog(catalog, version):
+    """Serialize a catalog.Catalog into the snapshot byte layout"""
+    categories = list(catalog.categories)
+    products = list(catalog.products)
+    category_positions = {c['slug']: i for i, c in enumerate(categories)}
+    for product in products:
+        if product['category_slug'] not in category_positions:
+            raise SnapshotError(f"Unknown category {product['category_slug']!r} for {product['slug']!r}")
+
+    slugs = sorted(range(len(products)), key=lambda i: products[i]['slug'])
+    ids = sorted((p['id'], i) for i, p in enumerate(products))
+    members = {c['slug']: [] for c in categories}
+    for i, product in enumerate(products):
+        members[product['category_slug']].append(i)
+    featured = [i for i, p in enumerate(products) if p.get('featured')]
+
+    sections = []
+    groups = []
+    flat_members = []
+    for category in categories:
+        positions = members[category['slug']]
+        groups.append(PAIR.pack(len(flat_members), len(positions)))
+        flat_members.extend(positions)
+
+    # Offsets of the index sections are fixed by the counts alone
+    offset = HEADER.size
+    category_table = offset
+    offset += U32.size * len(categories)
+    product_table = offset
+    offset += U32.size * len(products)
+    slug_table = offset
+    offset += U32.size * len(products)
+    id_table = offset
+    offset += PAIR.size * len(products)
+    group_table = offset
+    offset += PAIR.size * len(categories)
+    member_table = offset
+    offset += U32.size * len(flat_members)
+    featured_table = offset
+    offset += U32.size * len(featured)
+
+    records = []
+    category_offsets = []
+    for category in categories:
+        category_offsets.append(offset)
+        record = _pack_category(category)
+        records.append(record)
+        offset += len(record)
+    product_offsets = []
+    for product in products:
+        product_offsets.append(offset)
+        record = _pack_product(product, category_positions[product['category_slug']])
+        records.append(record)
+        offset += len(record)
+
+    sections.append(HEADER.pack(
+        MAGIC, FORMAT, version, len(categories), len(products), len(featured),
+        category_table, product_table, slug_table, id_table,
+        group_table, member_table, featured_table,
+    ))
+    sections.extend(U32.pack(o) for o in category_offsets)
+    sections.extend(U32.pack(o) for o in product_offsets)
+    sections.extend(U32.pack(i) for i in slugs)
+    sections.extend(PAIR.pack(product_id, i) for product_id, i in ids)
+    sections.extend(groups)
+    sections.extend(U32.pack(i) for i in flat_members)
+    sections.extend(U32.pack(i) for i in featured)
+    sections.extend(records)
+    return b''.join(sections)
+
+
+def write_snapshot(catalog, path, version=None):
+    """Atomically replace the snapshot at `path` and return its version"""
+    if version is None:
+        version = time.time_ns()
+    data = encode_catalog(catalog, version)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.catalog-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return version
+
+
+class _Positions:
+    """Read-only sequence of products addressed by a u32 position table
+
+    A `table` of None addresses every product in catalog order.
+    """
+
+    def __init__(self, snapshot, table, count):
+        self._snapshot = snapshot
+        self._table = table
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        if self._table is None:
+            return self._snapshot.product_at(index)
+        (position,) = U32.unpack_from(self._snapshot.buf, self._table + U32.size * index)
+        return self._snapshot.product_at(position)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+
+class _SlugIndex:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def _slug_at(self, index):
+        snapshot = self._snapshot
+        (position,) = U32.unpack_from(snapshot.buf, snapshot.slug_table + U32.size * index)
+        return snapshot.slug_at(position), position
+
+    def get(self, slug, default=None):
+        snapshot = self._snapshot
+        keys = _KeyView(snapshot.product_count, lambda i: self._slug_at(i)[0])
+        index = bisect_left(keys, slug)
+        if index < snapshot.product_count:
+            found, position = self._slug_at(index)
+            if found == slug:
+                return snapshot.product_at(position)
+        return default
+
+
+class _IdIndex:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def _pair_at(self, index):
+        snapshot = self._snapshot
+        return PAIR.unpack_from(snapshot.buf, snapshot.id_table + PAIR.size * index)
+
+    def get(self, product_id, default=None):
+        snapshot = self._snapshot
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return default
+        keys = _KeyView(snapshot.product_count, lambda i: self._pair_at(i)[0])
+        index = bisect_left(keys, product_id)
+        if index < snapshot.product_count:
+            found, position = self._pair_at(index)
+            if found == product_id:
+                return snapshot.product_at(position)
+        return default
+
+
+class _CategoryIndex:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def get(self, slug, default=None):
+        snapshot = self._snapshot
+        position = snapshot.category_positions.get(slug)
+        if position is None:
+            return default
+        start, count = PAIR.unpack_from(snapshot.buf, snapshot.group_table + PAIR.size * position)
+        return _Positions(snapshot, snapshot.member_table + U32.size * start, count)
+
+
+class _KeyView:
+    """Lazy sequence of sort keys so bisect can search the mapped file"""
+
+    def __init__(self, length, key):
+        self._length = length
+        self._key = key
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        return self._key(index)
+
+
+class SnapshotCatalog:
+    """Catalog backed by a read-only memory map of a snapshot file
+
+    Exposes the same attributes as catalog.Catalog; product dicts are
+    decoded on access so the bulk of the catalog stays in the shared
+    page cache instead of each worker's heap.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(self._mmap)
+        if len(self.buf) < HEADER.size:
+            raise SnapshotError(f'{path} is too short to be a catalog snapshot')
+        (magic, fmt, self.version, category_count, self.product_count, featured_count,
+         category_table, self.product_table, self.slug_table, self.id_table,
+         self.group_table, self.member_table, featured_table) = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise SnapshotError(f'{path} is not a format {FORMAT} catalog snapshot')
+
+        self.categories = []
+        for i in range(category_count):
+            (offset,) = U32.unpack_from(self.buf, category_table + U32.size * i)
+            (category_id,) = CATEGORY.unpack_from(self.buf, offset)
+            name, slug, image, description = _unpack_strs(self.buf, offset + CATEGORY.size, 4)
+            self.categories.append({
+                'id': category_id,
+                'name': name,
+                'slug': slug,
+                'image': image or None,
+                'description': description,
+            })
+        self.category_positions = {c['slug']: i for i, c in enumerate(self.categories)}
+        self.category_by_slug = {c['slug']: c for c in self.categories}
+
+        self.products = _Positions(self, None, self.product_count)
+        self.featured = _Positions(self, featured_table, featured_count)
+        self.by_slug = _SlugIndex(self)
+        self.by_id = _IdIndex(self)
+        self.by_category = _CategoryIndex(self)
+
+    def _record_offset(self, position):
+        (offset,) = U32.unpack_from(self.buf, self.product_table + U32.size * position)
+        return offset
+
+    def slug_at(self, position):
+        offset = self._record_offset(position) + PRODUCT.size
+        return _unpack_strs(self.buf, offset, 2)[1]
+
+    def product_at(self, position):
+        offset = self._record_offset(position)
+        product_id, category_position, cents, stock, featured, created, popularity = PRODUCT.unpack_from(
+            self.buf, offset
+        )
+        name, slug, description, image, sizes = _unpack_strs(self.buf, offset + PRODUCT.size, 5)
+        category = self.categories[category_position]
+        return {
+            'id': product_id,
+            'name': name,
+            'slug': slug,
+            'category': category['name'],
+            'category_slug': category['slug'],
+            'price': Decimal(cents).scaleb(-2),
+            'description': description,
+            'image': image or None,
+            'available_sizes': sizes.split(SIZE_SEPARATOR) if sizes else [],
+            'stock': stock,
+            'featured': bool(featured),
+            'created': None if created == NO_TIMESTAMP else datetime.fromtimestamp(created / 1_000_000, tz=timezone.utc),
+            # Score as of the build; every product decays alike, so the trending order holds
+            'popularity': popularity,
+        }
+
+
+class SnapshotLoader:
+    """Keeps the newest snapshot mapped, re-checking the file at most once per interval"""
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._file_key = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if time.monotonic() >= self._next_check:
+            self._refresh()
+        return self._snapshot
+
+    def _refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._snapshot, self._file_key = None, None
+                return
+            file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if file_key == self._file_key:
+                return
+            try:
+                snapshot = SnapshotCatalog(self.path)
+            except (OSError, SnapshotError) as e:
+                # Keep serving the previous snapshot rather than failing requests
+                print(f"Catalog snapshot error: {e}")
+                self._file_key = file_key
+                return
+            # Readers holding the previous snapshot keep its mapping alive
+            if self._snapshot is None or snapshot.version != self._snapshot.version:
+                self._snapshot = snapshot
+            self._file_key = file_key
+
+
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def get_snapshot_catalog():
+    """Return the mapped snapshot when CATALOG_SNAPSHOT_PATH is configured"""
+    global _loader
+    from django.conf import settings
+
+    path = getattr(settings, 'CATALOG_SNAPSHOT_PATH', None)
+    if not path:
+        return None
+    loader = _loader
+    if loader is None or loader.path != path:
+        with _loader_lock:
+            if _loader is None or _loader.path != path:
+                _loader = SnapshotLoader(path, getattr(settings, 'CATALOG_SNAPSHOT_CHECK_INTERVAL', 1.0))
+            loader = _loader
+    return loader.get()
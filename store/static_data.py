@@ -147,33 +147,3 @@ STATIC_CATEGORIES = [
         'description': 'Complete your look with our signature accessories'
     }
 ]
-
-def get_featured_products():
-    """Return featured products"""
-    return [product for product in STATIC_PRODUCTS if product.get('featured', False)]
-
-def get_all_products():
-    """Return all products"""
-    return STATIC_PRODUCTS
-
-def get_products_by_category(category_slug):
-    """Return products filtered by category"""
-    return [product for product in STATIC_PRODUCTS if product['category'].lower().replace(' ', '-').replace('_', '-') == category_slug]
-
-def get_product_by_slug(slug):
-    """Return single product by slug"""
-    for product in STATIC_PRODUCTS:
-        if product['slug'] == slug:
-            return product
-    return None
-
-def get_all_categories():
-    """Return all categories"""
-    return STATIC_CATEGORIES
-
-def get_category_by_slug(slug):
-    """Return single category by slug"""
-    for category in STATIC_CATEGORIES:
-        if category['slug'] == slug:
-            return category
-    return None
\ No newline at end of file
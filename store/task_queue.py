@@ -0,0 +1,208 @@
+# Database-backed django.tasks backend
+#
+# enqueue() only inserts a QueuedTask row, so it costs one INSERT on the
+# request path and, called inside the order's transaction, the task exists
+# if and only if the order does. `manage.py run_task_worker` claims rows
+# and runs them. Failed attempts are retried with exponential backoff; a
+# task that fails MAX_ATTEMPTS times is marked FAILED and copied to the
+# DeadTask table. QUEUE_CONCURRENCY caps how many tasks of a queue run at
+# once across all workers, e.g. to stay under a mail provider's rate; a
+# worker locks the queue's TaskQueue row while it counts and claims, so two
+# workers can't both see a free slot.
+#
+#     TASKS = {'default': {
+#         'BACKEND': 'store.task_queue.DatabaseBackend',
+#         'QUEUES': ['default', 'email'],
+#         'OPTIONS': {'MAX_ATTEMPTS': 5, 'QUEUE_CONCURRENCY': {'email': 2}},
+#     }}
+import random
+from datetime import timedelta
+from traceback import format_exception
+
+from django.db import transaction
+from django.db.models import Q
+from django.tasks.backends.base import BaseTaskBackend
+from django.tasks.base import TaskContext, TaskError, TaskResult, TaskResultStatus
+from django.tasks.exceptions import TaskResultDoesNotExist
+from django.tasks.signals import task_enqueued, task_finished, task_started
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.json import normalize_json
+from django.utils.module_loading import import_string
+
+from .models import DeadTask, QueuedTask, TaskQueue
+
+MAX_ATTEMPTS = 5
+# Seconds before the first retry; doubles with every further attempt
+RETRY_DELAY = 10
+MAX_RETRY_DELAY = 60 * 60
+# Seconds a worker may hold a task before others treat it as abandoned
+LEASE = 5 * 60
+
+
+class DatabaseBackend(BaseTaskBackend):
+    supports_defer = True
+    supports_get_result = True
+    supports_priority = True
+
+    def __init__(self, alias, params):
+        super().__init__(alias, params)
+        self.max_attempts = self.options.get('MAX_ATTEMPTS', MAX_ATTEMPTS)
+        self.retry_delay = self.options.get('RETRY_DELAY', RETRY_DELAY)
+        self.max_retry_delay = self.options.get('MAX_RETRY_DELAY', MAX_RETRY_DELAY)
+        self.lease = self.options.get('LEASE', LEASE)
+        self.queue_concurrency = self.options.get('QUEUE_CONCURRENCY', {})
+
+    def enqueue(self, task, args, kwargs):
+        self.validate_task(task)
+        record = QueuedTask.objects.create(
+            id=get_random_string(32),
+            task_path=task.module_path,
+            queue_name=task.queue_name,
+            priority=task.priority,
+            args=normalize_json(args),
+            kwargs=normalize_json(kwargs),
+            run_after=task.run_after or timezone.now(),
+        )
+        result = self.to_result(record, task)
+        task_enqueued.send(type(self), task_result=result)
+        return result
+
+    def get_result(self, result_id):
+        record = QueuedTask.objects.filter(pk=result_id).first()
+        if record is None:
+            raise TaskResultDoesNotExist(result_id)
+        return self.to_result(record)
+
+    def to_result(self, record, task=None):
+        task = task or import_string(record.task_path)
+        if task.backend != self.alias or task.queue_name != record.queue_name or task.priority != record.priority:
+            task = task.using(backend=self.alias, queue_name=record.queue_name, priority=record.priority)
+        result = TaskResult(
+            task=task,
+            id=record.id,
+            status=TaskResultStatus(record.status),
+            enqueued_at=record.enqueued_at,
+            started_at=record.started_at,
+            finished_at=record.finished_at,
+            last_attempted_at=record.last_attempted_at,
+            args=record.args,
+            kwargs=record.kwargs,
+            backend=self.alias,
+            errors=[TaskError(**error) for error in record.errors],
+            worker_ids=list(record.worker_ids),
+        )
+        object.__setattr__(result, '_return_value', record.return_value)
+        return result
+
+    def retry_after(self, attempts):
+        """Delay before the next attempt: exponential, capped, with jitter so failures don't retry in lockstep"""
+        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (attempts - 1))
+        return timedelta(seconds=random.uniform(delay / 2, delay))
+
+    def claim(self, worker_id, queues=None):
+        """Mark the next runnable task RUNNING for `worker_id` and return it, or None"""
+        now = timezone.now()
+        runnable = Q(status='READY', run_after__lte=now) | Q(status='RUNNING', locked_until__lt=now)
+        queues = queues or self.queues
+        with transaction.atomic():
+            limited = sorted(queue for queue in self.queue_concurrency if queue in queues)
+            if limited:
+                self._lock_queues(limited)
+            queryset = QueuedTask.objects.filter(runnable, queue_name__in=queues)
+            full = [
+                queue for queue in limited
+                if QueuedTask.objects.filter(queue_name=queue, status='RUNNING', locked_until__gte=now).count()
+                >= self.queue_concurrency[queue]
+            ]
+            if full:
+                queryset = queryset.exclude(queue_name__in=full)
+            record = (
+                queryset.select_for_update(skip_locked=True)
+                .order_by('-priority', 'run_after', 'enqueued_at')
+                .first()
+            )
+            if record is None:
+                return None
+            record.status = 'RUNNING'
+            record.attempts += 1
+            record.worker_ids = record.worker_ids + [worker_id]
+            record.started_at = record.started_at or now
+            record.last_attempted_at = now
+            record.locked_until = now + timedelta(seconds=self.lease)
+            record.save(update_fields=[
+                'status', 'attempts', 'worker_ids', 'started_at', 'last_attempted_at', 'locked_until',
+            ])
+        return record
+
+    def _lock_queues(self, names):
+        # Held until the claim commits; other workers claiming from these queues wait here
+        if len(TaskQueue.objects.select_for_update().filter(name__in=names).order_by('name')) < len(names):
+            TaskQueue.objects.bulk_create([TaskQueue(name=name) for name in names], ignore_conflicts=True)
+            list(TaskQueue.objects.select_for_update().filter(name__in=names).order_by('name'))
+
+    def run(self, record):
+        """Run a claimed task and record the outcome; return the final status"""
+        try:
+            result = self.to_result(record)
+        except ImportError as e:
+            # The code is gone; retrying can't help
+            self._fail(record, e, retry=False)
+            return record.status
+
+        task_started.send(type(self), task_result=result)
+        try:
+            if result.task.takes_context:
+                value = result.task.call(TaskContext(task_result=result), *record.args, **record.kwargs)
+            else:
+                value = result.task.call(*record.args, **record.kwargs)
+            record.return_value = normalize_json(value)
+        except KeyboardInterrupt:
+            raise
+        except BaseException as e:
+            self._fail(record, e, retry=record.attempts < self.max_attempts)
+            # Sent inside the handler so django.tasks logs the traceback
+            task_finished.send(type(self), task_result=self.to_result(record, result.task))
+        else:
+            record.status = 'SUCCESSFUL'
+            record.finished_at = timezone.now()
+            record.locked_until = None
+            record.save(update_fields=['status', 'return_value', 'finished_at', 'locked_until'])
+            task_finished.send(type(self), task_result=self.to_result(record, result.task))
+        return record.status
+
+    def _fail(self, record, exc, retry):
+        exc_type = type(exc)
+        record.errors = record.errors + [{
+            'exception_class_path': f'{exc_type.__module__}.{exc_type.__qualname__}',
+            'traceback': ''.join(format_exception(exc)),
+        }]
+        record.locked_until = None
+        if retry:
+            record.status = 'READY'
+            record.run_after = timezone.now() + self.retry_after(record.attempts)
+            record.save(update_fields=['status', 'errors', 'run_after', 'locked_until'])
+            return
+        with transaction.atomic():
+            record.status = 'FAILED'
+            record.finished_at = timezone.now()
+            record.save(update_fields=['status', 'errors', 'finished_at', 'locked_until'])
+            DeadTask.objects.update_or_create(task=record, defaults={
+                'task_path': record.task_path,
+                'queue_name': record.queue_name,
+                'args': record.args,
+                'kwargs': record.kwargs,
+                'attempts': record.attempts,
+                'last_error': record.errors[-1]['traceback'],
+            })
+
+
+def requeue(dead_tasks):
+    """Give dead-lettered tasks a fresh set of attempts; return how many were requeued"""
+    task_ids = [dead.task_id for dead in dead_tasks]
+    with transaction.atomic():
+        count = QueuedTask.objects.filter(pk__in=task_ids, status='FAILED').update(
+            status='READY', attempts=0, run_after=timezone.now(), finished_at=None,
+        )
+        DeadTask.objects.filter(task_id__in=task_ids).delete()
+    return count
@@ -0,0 +1,43 @@
+# Work that follows an order but doesn't decide it
+#
+# These run on the task worker (manage.py run_task_worker), never in the
+# request. Enqueue them inside the transaction that changes the order so
+# they are only queued if the change commits. Tasks must be safe to run
+# more than once: a worker that dies mid-task leaves it to be retried.
+from django.conf import settings
+from django.core.mail import send_mail
+from django.tasks import task
+from django.template.loader import render_to_string
+
+from .models import Order
+from .sales import sync_order
+
+SUBJECTS = {
+    'pending': 'We received your order #{id}',
+    'completed': 'Your CLAWS order #{id} is confirmed',
+    'cancelled': 'Your CLAWS order #{id} was cancelled',
+}
+
+
+@task(queue_name='email')
+def send_order_email(order_id):
+    """Tell the customer where their order stands"""
+    order = Order.objects.select_related('user').prefetch_related('items__product').filter(pk=order_id).first()
+    if order is None or order.status not in SUBJECTS:
+        # Orders under review are sorted out by staff before the customer hears anything
+        return 0
+    recipient = order.email or order.user.email
+    if not recipient:
+        return 0
+    return send_mail(
+        SUBJECTS[order.status].format(id=order.id),
+        render_to_string('store/email/order_update.txt', {'order': order}),
+        settings.DEFAULT_FROM_EMAIL,
+        [recipient],
+    )
+
+
+@task
+def sync_order_sales(order_id):
+    """Bring the sales rollups in line with the order's current status"""
+    return sync_order(order_id)
@@ -0,0 +1,11 @@
+from django import template
+
+from ..fragments import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_cards(products, hide_badges=False):
+    """Pair each product with its cached card HTML: {% product_cards products as cards %}"""
+    return render_cards(list(products), hide_badges)
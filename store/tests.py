@@ -1,3 +1,1629 @@
-from django.test import TestCase
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F, Sum
+from django.tasks import task, task_backends
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import page_cache, popularity, recommendations
+from .autocomplete import DEFAULT_RESULTS, HEAVY_RANGE, MAX_RESULTS, PrefixIndex
+from .cart import apply_operations, merge_lines
+from .catalog import Catalog, get_all_categories, invalidate_catalog, load_database_catalog, product_to_card
+from .checkout import place_order
+from .facets import _database_facets, _static_facets, get_facets
+from .fragments import card_version, render_cards
+from .inventory import release_expired, reserve_cart
+from .listing import encode_cursor, get_product_page, parse_params
+from .models import (
+    Cart, CartItem, Category, DailyProductSales, DailySales, DeadTask, Order, OrderItem, PayPalWebhookEvent,
+    Product, ProductPopularity, ProductRecommendation, QueuedTask, StockReservation, TaskQueue,
+)
+from .orders import get_order_page
+from .paypal import CircuitBreaker, CircuitOpenError, PayPalClient, PayPalError, RetryBudget
+from .paypal_stub import StubPayPalServer, capture_event
+from .paypal_webhooks import expire_pending_orders
+from .recommendations import build as build_recommendations, get_recommendations, score_numpy, score_python
+from .sales import backfill, sync_order
+from .search import SearchBackend, search_products
+from .single_flight import LocalValue, get_or_set
+from .snapshot import SnapshotCatalog, SnapshotLoader, write_snapshot
+from .task_queue import requeue
+
+
+# Popularity counters are written straight through for the whole module: a
+# background flusher started by one test would go on writing during the next
+_write_through = override_settings(POPULARITY_FLUSH_INTERVAL=0)
+
+
+def setUpModule():
+    _write_through.enable()
+
+
+def tearDownModule():
+    _write_through.disable()
+
+
+def make_product(stock, slug='hot-drop'):
+    category, _ = Category.objects.get_or_create(name='Hoodies', slug='hoodies')
+    return Product.objects.create(
+        name=slug.replace('-', ' ').title(), slug=slug, category=category, price='50.00',
+        description='A product used by the tests', stock=stock,
+    )
+
+
+@task(takes_context=True)
+def flaky_task(context, failures):
+    if context.attempt <= failures:
+        raise RuntimeError(f'attempt {context.attempt} failed')
+    return context.attempt
+
+
+def make_cart(username, product, quantity=1):
+    cart = Cart.objects.create(user=User.objects.create_user(username))
+    CartItem.objects.create(cart=cart, product=product, size='M', quantity=quantity)
+    return cart
+
+
+class SnapshotTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'catalog.bin')
+        self.categories = [
+            {'id': 1, 'name': 'Hoodies', 'slug': 'hoodies', 'image': 'https://example.com/h.jpg', 'description': 'Warm'},
+            {'id': 2, 'name': 'Caps', 'slug': 'caps', 'image': None, 'description': ''},
+        ]
+        created = datetime(2026, 3, 1, 12, 30, tzinfo=dt_timezone.utc)
+        self.products = [
+            self.product(40, 'Night Hoodie', 'Hoodies', '89.99', featured=True, created=created),
+            self.product(7, 'Ridge Cap', 'Caps', '25.00', available_sizes=[], image=None),
+            self.product(12, 'Ash Hoodie', 'Hoodies', '0.01', stock=0, created=None),
+        ]
+
+    def product(self, product_id, name, category, price, **extra):
+        return dict({
+            'id': product_id, 'name': name, 'slug': name.lower().replace(' ', '-'), 'category': category,
+            'category_slug': category.lower(), 'price': Decimal(price), 'description': f'All about the {name}',
+            'image': f'https://example.com/{product_id}.jpg', 'available_sizes': ['S', 'M', 'XL'],
+            'stock': 5, 'featured': False, 'created': datetime(2026, 1, 2, tzinfo=dt_timezone.utc),
+        }, **extra)
+
+    def write(self, version, products=None):
+        return write_snapshot(Catalog(products or self.products, self.categories), self.path, version)
+
+    def test_products_and_categories_round_trip(self):
+        self.assertEqual(self.write(3), 3)
+        snapshot = SnapshotCatalog(self.path)
+        self.assertEqual(snapshot.version, 3)
+        self.assertEqual(snapshot.categories, self.categories)
+        self.assertEqual(len(snapshot.products), 3)
+        for product, decoded in zip(self.products, snapshot.products):
+            self.assertEqual({key: decoded[key] for key in product}, product)
+
+    def test_lookups_match_the_in_memory_catalog(self):
+        self.write(1)
+        snapshot = SnapshotCatalog(self.path)
+        for product in self.products:
+            self.assertEqual(snapshot.by_slug.get(product['slug'])['id'], product['id'])
+            self.assertEqual(snapshot.by_id.get(product['id'])['slug'], product['slug'])
+        self.assertIsNone(snapshot.by_slug.get('no-such-slug'))
+        self.assertIsNone(snapshot.by_id.get(999))
+        self.assertEqual([p['slug'] for p in snapshot.by_category.get('hoodies')], ['night-hoodie', 'ash-hoodie'])
+        self.assertEqual([p['slug'] for p in snapshot.by_category.get('caps')], ['ridge-cap'])
+        self.assertEqual(snapshot.by_category.get('no-such-category', []), [])
+        self.assertEqual([p['slug'] for p in snapshot.featured], ['night-hoodie'])
+        self.assertEqual(snapshot.category_by_slug['caps']['name'], 'Caps')
+
+    def test_loader_swaps_to_a_replaced_file_by_version(self):
+        loader = SnapshotLoader(self.path, check_interval=0)
+        self.assertIsNone(loader.get())
+        self.write(1)
+        first = loader.get()
+        self.assertEqual(first.version, 1)
+
+        self.write(2, self.products[:1])
+        second = loader.get()
+        self.assertEqual((second.version, len(second.products)), (2, 1))
+        # A rewrite under the same version keeps the mapping readers already hold
+        self.write(2)
+        self.assertIs(loader.get(), second)
+        self.assertEqual(len(first.products), 3)
+
+        with open(self.path, 'wb') as f:
+            f.write(b'not a snapshot')
+        with mock.patch('builtins.print'):
+            self.assertIs(loader.get(), second)
+
+
+class ProductListingTests(TestCase):
+    def setUp(self):
+        prices = ['30.00', '10.00', '20.00', '20.00', '40.00']
+        self.products = [make_product(5, slug=f'tee-{i}') for i in range(len(prices))]
+        for product, price in zip(self.products, prices):
+            product.price = price
+            product.save()
+
+    def walk(self, sort, limit=2):
+        seen, cursor = [], None
+        while True:
+            products, cursor, total = get_product_page(dict(parse_params({'sort': sort, 'limit': str(limit)}), cursor=cursor))
+            seen += [p['slug'] for p in products]
+            if not cursor:
+                return seen, total
+
+    def test_cursor_walks_every_product_once_in_order(self):
+        seen, total = self.walk('price-low')
+        # The two 20.00 tees are told apart by id
+        self.assertEqual(seen, ['tee-1', 'tee-2', 'tee-3', 'tee-0', 'tee-4'])
+        self.assertEqual(total, 5)
+        seen, _ = self.walk('price-high')
+        self.assertEqual(seen, ['tee-4', 'tee-0', 'tee-3', 'tee-2', 'tee-1'])
+
+    def test_new_product_does_not_shift_later_pages(self):
+        products, cursor, _ = get_product_page(parse_params({'sort': 'price-low', 'limit': '2'}))
+        cheap = make_product(5, slug='cheap')
+        cheap.price = '1.00'
+        cheap.save()
+        products, _, _ = get_product_page(dict(parse_params({'sort': 'price-low', 'limit': '2'}), cursor=cursor))
+        self.assertEqual([p['slug'] for p in products], ['tee-3', 'tee-0'])
+
+    def test_tampered_cursor_starts_from_the_first_page(self):
+        first, _, _ = get_product_page(parse_params({'sort': 'price-low', 'limit': '2'}))
+        for cursor in ['not-a-cursor', encode_cursor(['k']), encode_cursor({'k': ['cheap', 1]}),
+                       encode_cursor({'k': ['10.00']}), encode_cursor({'k': [None, None]})]:
+            products, _, _ = get_product_page(dict(parse_params({'sort': 'price-low', 'limit': '2'}), cursor=cursor))
+            self.assertEqual(products, first, cursor)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Outerwear', slug='outerwear')
+        self.jacket = Product.objects.create(
+            name='Wolf Jacket', slug='wolf-jacket', category=category, price='90.00',
+            description='Waxed cotton shell',
+        )
+        self.tee = Product.objects.create(
+            name='Forest Tee', slug='forest-tee', category=category, price='30.00',
+            description='Printed with a howling wolf on the back',
+        )
+        self.scarf = Product.objects.create(
+            name='Wool Scarf', slug='wool-scarf', category=category, price='25.00', description='Soft and warm',
+        )
+
+    def slugs(self, query):
+        return [p['slug'] for p in search_products(query)]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.slugs('wolf'), ['wolf-jacket', 'forest-tee'])
+
+    def test_every_word_must_match_and_the_last_is_a_prefix(self):
+        self.assertEqual(self.slugs('howling wol'), ['forest-tee'])
+        self.assertEqual(set(self.slugs('wo')), {'wolf-jacket', 'wool-scarf', 'forest-tee'})
+        self.assertEqual(self.slugs('wolf scarf'), [])
+
+    def test_index_follows_product_edits(self):
+        self.scarf.name = 'Wolf Scarf'
+        self.scarf.save()
+        self.assertIn('wool-scarf', self.slugs('wolf'))
+        self.jacket.delete()
+        self.assertNotIn('wolf-jacket', self.slugs('wolf'))
+
+    def test_query_syntax_is_treated_as_words(self):
+        self.assertEqual(self.slugs('"wolf" OR NEAR('), [])
+        self.assertEqual(self.slugs('wolf*'), ['wolf-jacket', 'forest-tee'])
+        self.assertEqual(self.slugs('  '), [])
+
+    def test_fallback_backend_matches_any_field(self):
+        fallback = SearchBackend(connection)
+        self.assertEqual(set(fallback.search_ids('wolf')), {self.jacket.id, self.tee.id})
+        self.assertEqual(fallback.search_ids('outerwear wool'), [self.scarf.id])
+
+
+class AutocompleteTests(SimpleTestCase):
+    def product(self, i, name, category='Tees', **extra):
+        return dict({'id': i, 'name': name, 'slug': name.lower().replace(' ', '-'), 'category': category,
+                     'price': '20.00', 'stock': 5}, **extra)
+
+    def names(self, index, query, limit=DEFAULT_RESULTS):
+        return [result['name'] for result in index.lookup(query, limit)]
+
+    def test_prefix_matches_name_later_words_and_category(self):
+        index = PrefixIndex([
+            self.product(1, 'Night Rider Tee'),
+            self.product(2, 'Nightfall Hoodie', category='Hoodies'),
+            self.product(3, 'Ridge Cap', category='Hats'),
+        ])
+        self.assertEqual(set(self.names(index, 'night')), {'Night Rider Tee', 'Nightfall Hoodie'})
+        self.assertEqual(set(self.names(index, 'rid')), {'Night Rider Tee', 'Ridge Cap'})
+        self.assertEqual(self.names(index, '  HOOD'), ['Nightfall Hoodie'])
+        self.assertEqual(self.names(index, 'hats'), ['Ridge Cap'])
+        self.assertEqual(self.names(index, 'cap ridge'), [])
+        self.assertEqual(self.names(index, ''), [])
+        self.assertEqual(index.lookup('ridge')[0]['url'], '/product/ridge-cap/')
+
+    def test_featured_then_popular_then_in_stock(self):
+        index = PrefixIndex([
+            self.product(1, 'Tee Sold Out', stock=0, popularity=9),
+            self.product(2, 'Tee Plain'),
+            self.product(3, 'Tee Popular', popularity=5),
+            self.product(4, 'Tee Featured', featured=True),
+            self.product(5, 'Tee Popular Sold Out', stock=0, popularity=5),
+        ])
+        self.assertEqual(self.names(index, 'tee'), [
+            'Tee Featured', 'Tee Sold Out', 'Tee Popular', 'Tee Popular Sold Out', 'Tee Plain',
+        ])
+        self.assertEqual(self.names(index, 'tee', limit=2), ['Tee Featured', 'Tee Sold Out'])
+
+    def test_precomputed_heavy_prefixes_match_a_full_scan(self):
+        products = [self.product(i, f'Shirt {i:04d}', popularity=i % 7) for i in range(2 * HEAVY_RANGE)]
+        index = PrefixIndex(products)
+        self.assertIn('shirt', index.heavy)
+        for query in ['s', 'shirt', 'shirt 01']:
+            lo, hi = bisect_left(index.keys, query), bisect_left(index.keys, query + chr(0x10FFFF))
+            expected = [index.results[p]['name'] for p in index._top(lo, hi, MAX_RESULTS)]
+            self.assertEqual(self.names(index, query, MAX_RESULTS), expected, query)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        hoodies = Category.objects.create(name='Hoodies', slug='hoodies')
+        hats = Category.objects.create(name='Hats', slug='hats')
+        for slug, category, price, sizes, stock, featured in [
+            ('zip-hoodie', hoodies, '120.00', ['M', 'L'], 3, True),
+            ('pullover', hoodies, '80.00', ['S', 'M', 'XXL'], 0, False),
+            ('beanie', hats, '25.00', ['One Size'], 7, False),
+            ('snapback', hats, '45.00', ['One Size'], 2, True),
+        ]:
+            Product.objects.create(
+                name=slug.title(), slug=slug, category=category, price=price, available_sizes=sizes,
+                stock=stock, featured=featured, description='Facet test product',
+            )
+        # The categories come from the catalog, and facets are cached; on_commit never fires here
+        self.addCleanup(invalidate_catalog)
+        self.addCleanup(cache.clear)
+
+    def facets(self, **query):
+        return get_facets(parse_params(query))
+
+    def counts(self, facets, group, key):
+        return {entry[key]: entry['count'] for entry in facets[group] if entry['count']}
+
+    def test_each_facet_ignores_only_its_own_filter(self):
+        facets = self.facets(category='hats', size='M')
+        self.assertEqual(facets['total'], 0)
+        # Picking a category keeps the size filter, and the other way round
+        self.assertEqual(self.counts(facets, 'categories', 'slug'), {'hoodies': 2})
+        self.assertEqual(self.counts(facets, 'sizes', 'code'), {'One Size': 2})
+
+        facets = self.facets(category='hoodies', max_price='100')
+        self.assertEqual((facets['total'], facets['in_stock'], facets['featured']), (1, 0, 0))
+        self.assertEqual(self.counts(facets, 'prices', 'label'), {'$50 - $100': 1, '$100 - $200': 1})
+        self.assertEqual(self.counts(facets, 'sizes', 'code'), {'S': 1, 'M': 1, 'XXL': 1})
+
+    def test_size_filter_does_not_match_longer_sizes(self):
+        facets = self.facets(size='XL')
+        self.assertEqual(facets['total'], 0)
+        self.assertEqual(self.counts(facets, 'sizes', 'code')['XXL'], 1)
+
+    def test_database_counts_match_the_catalog_counts(self):
+        categories = list(get_all_categories())
+        for query in [{}, {'category': 'hats'}, {'size': 'M', 'featured': '1'}, {'min_price': '40', 'max_price': '100'}]:
+            params = parse_params(query)
+            self.assertEqual(_database_facets(params, categories), _static_facets(params, categories), query)
+
+    def test_saving_a_product_retires_cached_counts(self):
+        self.assertEqual(self.facets(featured='1')['total'], 2)
+        beanie = Product.objects.get(slug='beanie')
+        beanie.featured = True
+        beanie.save()
+        self.assertEqual(self.facets(featured='1')['total'], 2)  # cached until the save commits
+        with self.captureOnCommitCallbacks(execute=True):
+            beanie.save()
+        self.assertEqual(self.facets(featured='1')['total'], 3)
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        self.products = [make_product(50, slug=f'tee-{i}') for i in range(8)]
+        for i, product in enumerate(self.products):
+            product.price = Decimal('9.99') + i
+            product.save()
+
+    def fill(self, username, lines):
+        cart = Cart.objects.create(user=User.objects.create_user(username))
+        for i, product in enumerate(self.products[:lines]):
+            CartItem.objects.create(cart=cart, product=product, size='M', quantity=i + 1)
+        return cart
+
+    def render(self, url, cart):
+        self.client.force_login(cart.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_totals_come_from_the_database(self):
+        cart = self.fill('shopper', 8)
+        response, _ = self.render('/cart/', cart)
+        summary = response.context['summary']
+        totals = cart.items.aggregate(
+            subtotal=Sum(F('quantity') * F('product__price')), item_count=Sum('quantity'),
+        )
+        self.assertEqual(summary['subtotal'], totals['subtotal'].quantize(Decimal('0.01')))
+        self.assertEqual(summary['item_count'], totals['item_count'])
+        self.assertEqual(summary['line_count'], 8)
+        for item in summary['items']:
+            self.assertEqual(item.line_total, item.quantity * item.product.price)
+        self.assertContains(response, f"${summary['subtotal']}")
+
+    def test_cart_and_checkout_queries_do_not_grow_with_lines(self):
+        # Checkout also holds the stock: one conditional UPDATE per product, nothing else per line
+        for url, per_product in [('/cart/', 0), ('/checkout/', 1)]:
+            _, one = self.render(url, self.fill(f'one{url}', 1))
+            _, many = self.render(url, self.fill(f'many{url}', 8))
+            self.assertEqual(many - one, 7 * per_product, url)
+
+
+class CartOperationTests(TestCase):
+    def setUp(self):
+        self.hoodie = make_product(5, slug='hoodie')
+        self.cap = make_product(2, slug='cap')
+        self.cart = make_cart('shopper', self.hoodie, 1)
+
+    def lines(self):
+        return {(item.product_id, item.size): item.quantity for item in self.cart.items.all()}
+
+    def test_batch_applies_in_order(self):
+        item_id = self.cart.items.get().id
+        apply_operations(self.cart, [
+            {'op': 'add', 'product_id': self.hoodie.id, 'size': 'M', 'quantity': 2},
+            {'op': 'add', 'product_id': self.cap.id, 'size': 'L'},
+            {'op': 'set', 'item_id': item_id, 'quantity': 4},
+            {'op': 'add', 'product_id': self.hoodie.id, 'size': 'S'},
+        ])
+        self.assertEqual(self.lines(), {(self.hoodie.id, 'M'): 4, (self.cap.id, 'L'): 1, (self.hoodie.id, 'S'): 1})
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).item_count, 6)
+
+        apply_operations(self.cart, [
+            {'op': 'remove', 'product_id': self.hoodie.id, 'size': 'S'},
+            {'op': 'set', 'product_id': self.cap.id, 'size': 'L', 'quantity': 0},
+        ])
+        self.assertEqual(self.lines(), {(self.hoodie.id, 'M'): 4})
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).item_count, 4)
+
+    def test_one_bad_operation_rolls_back_the_whole_batch(self):
+        before, count = self.lines(), Cart.objects.get(pk=self.cart.pk).item_count
+        for bad in [
+            {'op': 'add', 'product_id': self.cap.id, 'size': 'M', 'quantity': 3},  # only 2 in stock
+            {'op': 'set', 'product_id': self.hoodie.id, 'size': 'S', 'quantity': 6},
+            {'op': 'set', 'item_id': 999999, 'quantity': 1},
+            {'op': 'add', 'product_id': 999999, 'size': 'M'},
+            {'op': 'add', 'product_id': self.cap.id, 'size': 'XXXL'},
+            {'op': 'explode'},
+        ]:
+            with self.assertRaises(ValidationError):
+                apply_operations(self.cart, [
+                    {'op': 'add', 'product_id': self.cap.id, 'size': 'L'},
+                    {'op': 'remove', 'product_id': self.hoodie.id, 'size': 'M'},
+                    bad,
+                ])
+            self.assertEqual(self.lines(), before, bad)
+            self.assertEqual(Cart.objects.get(pk=self.cart.pk).item_count, count)
+
+    def test_update_view_reports_the_error_and_keeps_the_cart(self):
+        self.client.force_login(self.cart.user)
+        response = self.client.post('/cart/update/', json.dumps({'operations': [
+            {'op': 'add', 'product_id': self.cap.id, 'size': 'L'},
+            {'op': 'add', 'product_id': self.cap.id, 'size': 'L', 'quantity': 2},
+        ]}), content_type='application/json')
+        self.assertEqual(response.json(), {'success': False, 'error': 'Not enough stock available'})
+        self.assertEqual(self.lines(), {(self.hoodie.id, 'M'): 1})
+
+        response = self.client.post('/cart/update/', json.dumps({'operations': [
+            {'op': 'add', 'product_id': self.cap.id, 'size': 'L', 'quantity': 2},
+        ]}), content_type='application/json')
+        self.assertEqual(response.json()['cart']['item_count'], 3)
+
+
+class CookieCartTests(TestCase):
+    def setUp(self):
+        self.hoodie = make_product(5, slug='hoodie')
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'correct-horse-battery')
+
+    def add(self, quantity=1, size='M'):
+        return self.client.post('/add-to-cart/', {'product_id': self.hoodie.id, 'size': size, 'quantity': quantity})
+
+    def count(self):
+        return self.client.get('/cart/count/').json()['count']
+
+    def log_in(self):
+        return self.client.post('/accounts/login/', {'login': 'shopper@example.com', 'password': 'correct-horse-battery'})
+
+    def test_anonymous_cart_lives_in_a_signed_cookie(self):
+        self.add(2)
+        self.add(1, size='L')
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(self.count(), 3)
+
+    def test_tampered_or_forged_cookie_is_ignored(self):
+        self.add(2)
+        signed = self.client.cookies['cart'].value
+        self.assertIn('"M",2]', signed)
+        self.client.cookies['cart'] = signed.replace('"M",2]', '"M",9]')
+        self.assertEqual(self.count(), 0)
+        self.client.cookies['cart'] = json.dumps([[self.hoodie.id, 'M', 3]])
+        self.assertEqual(self.count(), 0)
+
+    def test_login_merges_the_cookie_cart_and_drops_it(self):
+        cart = Cart.objects.create(user=self.user)
+        apply_operations(cart, [{'op': 'add', 'product_id': self.hoodie.id, 'size': 'M'}])
+        self.add(2)
+        self.add(1, size='S')
+        self.assertEqual(self.log_in().status_code, 302)
+        self.assertEqual(self.client.cookies['cart'].value, '')
+        lines = {item.size: item.quantity for item in cart.items.all()}
+        self.assertEqual(lines, {'M': 3, 'S': 1})
+        self.assertEqual(self.count(), 4)
+
+    def test_merge_clamps_to_stock(self):
+        cart = Cart.objects.create(user=self.user)
+        apply_operations(cart, [{'op': 'add', 'product_id': self.hoodie.id, 'size': 'M', 'quantity': 3}])
+        self.add(4)
+        self.log_in()
+        self.assertEqual(cart.items.get().quantity, 5)
+
+
+class CartCountTests(TestCase):
+    def setUp(self):
+        self.hoodie = make_product(10, slug='hoodie')
+        self.user = User.objects.create_user('shopper')
+        self.cart = Cart.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def stored_count(self):
+        cart = Cart.objects.get(pk=self.cart.pk)
+        self.assertEqual(cart.item_count, sum(cart.items.values_list('quantity', flat=True)))
+        return cart.item_count
+
+    def badge(self):
+        return re.search(r'id="cartCount"[^>]*>(\d+)<', self.client.get('/cart/').content.decode()).group(1)
+
+    def test_counter_follows_every_write_path(self):
+        self.client.post('/add-to-cart/', {'product_id': self.hoodie.id, 'size': 'M', 'quantity': 2})
+        self.assertEqual(self.stored_count(), 2)
+        self.client.post('/cart/update/', json.dumps({'operations': [
+            {'op': 'add', 'product_id': self.hoodie.id, 'size': 'L', 'quantity': 3},
+            {'op': 'set', 'product_id': self.hoodie.id, 'size': 'M', 'quantity': 1},
+        ]}), content_type='application/json')
+        self.assertEqual(self.stored_count(), 4)
+        self.assertEqual(self.badge(), '4')
+
+        merge_lines(self.cart, {(self.hoodie.id, 'S'): 2})
+        self.assertEqual(self.stored_count(), 6)
+        place_order(self.user, 'card', None, {})
+        self.assertEqual(self.stored_count(), 0)
+
+    def test_count_endpoint_reads_only_the_counter(self):
+        apply_operations(self.cart, [{'op': 'add', 'product_id': self.hoodie.id, 'size': 'M', 'quantity': 3}])
+        with self.assertNumQueries(3):  # session, user, counter
+            self.assertEqual(self.client.get('/cart/count/').json()['count'], 3)
+
+        anonymous = Client()
+        with self.assertNumQueries(0):
+            self.assertEqual(anonymous.get('/cart/count/').json()['count'], 0)
+
+    def test_admin_edits_resync_the_counter(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(admin_user)
+        item = CartItem.objects.create(cart=self.cart, product=self.hoodie, size='M', quantity=1)
+        self.client.post(f'/admin/store/cartitem/{item.pk}/change/', {
+            'cart': self.cart.pk, 'product': self.hoodie.pk, 'size': 'M', 'quantity': 7,
+        })
+        self.assertEqual(self.stored_count(), 7)
+        self.client.post(f'/admin/store/cartitem/{item.pk}/delete/', {'post': 'yes'})
+        self.assertEqual(self.stored_count(), 0)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.hoodie = make_product(5, slug='hoodie')
+        self.cap = make_product(1, slug='cap')
+        self.cart = make_cart('shopper', self.hoodie, 2)
+        CartItem.objects.create(cart=self.cart, product=self.cap, size='M', quantity=1)
+
+    def assert_nothing_changed(self):
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(QueuedTask.objects.exists())
+        self.assertEqual(self.cart.items.count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.hoodie.pk).stock, 5)
+        self.assertEqual(Product.objects.get(pk=self.cap.pk).stock, 0)
+
+    def test_stock_conflict_rolls_back_the_whole_order(self):
+        # Someone else bought the last cap after this cart was filled
+        Product.objects.filter(pk=self.cap.pk).update(stock=0)
+        with self.assertRaisesMessage(ValidationError, 'out of stock'):
+            place_order(self.cart.user, 'card', None, {})
+        self.assert_nothing_changed()
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_changed_total_rolls_back_the_whole_order(self):
+        Product.objects.filter(pk=self.cap.pk).update(stock=0)
+        StockReservation.objects.create(
+            cart=self.cart, product=self.cap, quantity=1, expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        with self.assertRaisesMessage(ValidationError, 'Cart changed during payment'):
+            place_order(self.cart.user, 'card', None, {}, expected_total=Decimal('100.00'))
+        self.assert_nothing_changed()
+        self.assertEqual(StockReservation.objects.get().quantity, 1)
+
+    def test_card_payment_reports_the_conflict(self):
+        Product.objects.filter(pk=self.cap.pk).update(stock=0)
+        self.client.force_login(self.cart.user)
+        response = self.client.post('/process-card-payment/', json.dumps({'shipping_data': {}}),
+                                    content_type='application/json')
+        self.assertEqual(response.json(), {'success': False, 'error': 'Cap is out of stock'})
+        self.assert_nothing_changed()
+
+    def test_only_stock_updates_grow_with_the_cart(self):
+        def queries_for(lines):
+            cart = make_cart(f'buyer{lines}', make_product(10, slug=f'first-{lines}'))
+            for i in range(1, lines):
+                CartItem.objects.create(cart=cart, product=make_product(10, slug=f'extra-{lines}-{i}'), size='M')
+            with CaptureQueriesContext(connection) as queries:
+                order = place_order(cart.user, 'card', None, {})
+            self.assertEqual(order.items.count(), lines)
+            return len(queries)
+
+        # One conditional stock UPDATE per product; everything else is batched
+        self.assertEqual(queries_for(6) - queries_for(1), 5)
+
+
+class StockReservationTests(TestCase):
+    def test_reserve_takes_only_the_difference(self):
+        product = make_product(10)
+        cart = make_cart('a', product, 3)
+        reserve_cart(cart)
+        reserve_cart(cart)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 7)
+
+        cart.items.update(quantity=1)
+        reserve_cart(cart)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 9)
+
+    def test_cart_can_still_change_what_it_holds(self):
+        product = make_product(10)
+        cart = make_cart('a', product, 5)
+        reserve_cart(cart)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 5)
+
+        item = cart.items.get()
+        apply_operations(cart, [{'op': 'set', 'item_id': item.id, 'quantity': 6}])
+        self.assertEqual(cart.items.get().quantity, 6)
+        item.refresh_from_db()
+        item.quantity = 10
+        item.clean()
+        with self.assertRaises(ValidationError):
+            apply_operations(cart, [{'op': 'set', 'item_id': item.id, 'quantity': 11}])
+        item.quantity = 11
+        with self.assertRaises(ValidationError):
+            item.clean()
+
+        # Another cart only sees what is left on the shelf
+        other = make_cart('b', product, 5)
+        with self.assertRaises(ValidationError):
+            apply_operations(other, [{'op': 'set', 'item_id': other.items.get().id, 'quantity': 6}])
+
+    def test_sold_out_leaves_stock_untouched(self):
+        product = make_product(2)
+        other = make_product(5, slug='other-drop')
+        cart = make_cart('a', product, 3)
+        CartItem.objects.create(cart=cart, product=other, size='M', quantity=1)
+        with self.assertRaises(ValidationError):
+            reserve_cart(cart)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 2)
+        self.assertEqual(Product.objects.get(pk=other.pk).stock, 5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expired_reservations_are_swept_in_batches(self):
+        product = make_product(10)
+        carts = [make_cart(f'user{i}', product) for i in range(5)]
+        for cart in carts:
+            reserve_cart(cart, ttl=0)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 5)
+
+        released = release_expired(batch_size=2, now=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(released, 5)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 10)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expiry_that_brings_a_product_back_refreshes_the_catalog(self):
+        product = make_product(15)
+        cart = make_cart('a', product, 15)
+        reserve_cart(cart, ttl=0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            release_expired(now=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 15)
+        self.assertIn(invalidate_catalog, callbacks)
+
+    def test_change_well_above_low_stock_leaves_the_catalog_cached(self):
+        cart = make_cart('a', make_product(100), 2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            reserve_cart(cart)
+        self.assertEqual(callbacks, [])
+
+    def test_placing_an_order_consumes_the_reservation(self):
+        product = make_product(10)
+        cart = make_cart('a', product, 2)
+        reserve_cart(cart)
+        place_order(cart.user, 'card', None, {})
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 8)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(release_expired(now=timezone.now() + timedelta(days=1)), 0)
+
+
+class StockContentionTests(TransactionTestCase):
+    def test_concurrent_checkouts_never_oversell(self):
+        stock, buyers, workers = 25, 60, 8
+        product = make_product(stock)
+        carts = [make_cart(f'buyer{i}', product) for i in range(buyers)]
+        outcomes = []
+        lock = threading.Lock()
+
+        def buy(batch):
+            try:
+                for cart in batch:
+                    try:
+                        reserve_cart(cart)
+                        outcome = 'reserved'
+                    except ValidationError:
+                        outcome = 'sold_out'
+                    with lock:
+                        outcomes.append(outcome)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(carts[i::workers],)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(outcomes), buyers)
+        self.assertEqual(outcomes.count('reserved'), stock)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 0)
+        self.assertEqual(sum(StockReservation.objects.values_list('quantity', flat=True)), stock)
+
+
+class PayPalClientTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubPayPalServer().start()
+        self.addCleanup(self.stub.stop)
+        self.stub.add_order('ORDER-1', '49.99')
+        self.client = PayPalClient(self.stub.client_id, self.stub.client_secret, self.stub.url)
+        self.addCleanup(self.client.session.close)
+
+    def test_token_is_fetched_once_and_connection_reused(self):
+        for _ in range(10):
+            self.assertTrue(self.client.verify_order_amount('ORDER-1', '49.99'))
+        self.assertFalse(self.client.verify_order_amount('ORDER-1', '10.00'))
+        self.assertFalse(self.client.verify_order_amount('MISSING', '49.99'))
+        self.assertEqual(self.stub.counts['token_requests'], 1)
+        self.assertEqual(self.stub.counts['connections'], 1)
+
+    def test_token_is_refreshed_after_expires_in(self):
+        self.stub.expires_in = 1
+        self.client.access_token()
+        self.client.access_token()
+        time.sleep(1)
+        self.client.access_token()
+        self.assertEqual(self.stub.counts['token_requests'], 2)
+
+    def test_concurrent_refresh_is_single_flight(self):
+        barrier = threading.Barrier(8)
+
+        def verify():
+            barrier.wait()
+            self.client.verify_order_amount('ORDER-1', '49.99')
+
+        threads = [threading.Thread(target=verify) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.stub.counts['token_requests'], 1)
+        self.assertEqual(self.stub.counts['order_requests'], 8)
+
+    def test_revoked_token_is_replaced(self):
+        self.client.access_token()
+        self.stub.revoke_tokens()
+        self.assertTrue(self.client.verify_order_amount('ORDER-1', '49.99'))
+        self.assertEqual(self.stub.counts['token_requests'], 2)
+
+
+class PayPalResilienceTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubPayPalServer().start()
+        self.addCleanup(self.stub.stop)
+        self.stub.add_order('ORDER-1', '49.99')
+        self.now = 0.0
+
+    def make_client(self, **kwargs):
+        client = PayPalClient(self.stub.client_id, self.stub.client_secret, self.stub.url, **kwargs)
+        client.backoff = lambda attempt: 0
+        self.addCleanup(client.session.close)
+        return client
+
+    def test_gets_are_retried_through_server_errors(self):
+        client = self.make_client()
+        client.access_token()
+        self.stub.inject(status=503, times=2)
+        self.assertTrue(client.verify_order_amount('ORDER-1', '49.99'))
+        self.assertEqual(client.metrics.counters['retries'], 2)
+        self.assertEqual(self.stub.counts['order_requests'], 3)
+
+    def test_token_post_is_not_retried(self):
+        client = self.make_client()
+        self.stub.inject(status=503)
+        with self.assertRaises(PayPalError):
+            client.access_token()
+        self.assertEqual(self.stub.counts['token_requests'], 1)
+
+    def test_slow_upstream_times_out(self):
+        client = self.make_client(timeout=(1, 0.2), max_attempts=1)
+        client.access_token()
+        self.stub.inject(delay=0.5)
+        started = time.monotonic()
+        with self.assertRaises(PayPalError):
+            client.get_order('ORDER-1')
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(client.metrics.counters['timeouts'], 1)
+        self.assertEqual(client.metrics.snapshot()['latency']['count'], 2)
+
+    def test_retry_budget_caps_retries(self):
+        client = self.make_client(retry_budget=RetryBudget(ratio=0, reserve=1))
+        client.access_token()
+        self.stub.inject(status=503, times=3)
+        response = client.request('GET', '/v2/checkout/orders/ORDER-1')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(client.metrics.counters['retries'], 1)
+        self.assertEqual(client.metrics.counters['retry_budget_exhausted'], 1)
+
+    def test_breaker_fails_fast_then_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=lambda: self.now)
+        client = self.make_client(breaker=breaker, max_attempts=1)
+        breaker.metrics = client.metrics
+        client.access_token()
+
+        self.stub.inject(drop=True, times=3)
+        for _ in range(3):
+            with self.assertRaises(PayPalError):
+                client.get_order('ORDER-1')
+        self.assertEqual(breaker.state, 'open')
+
+        requests_seen = self.stub.counts['order_requests']
+        with self.assertRaises(CircuitOpenError):
+            client.get_order('ORDER-1')
+        self.assertEqual(self.stub.counts['order_requests'], requests_seen)
+
+        self.now += 30
+        self.assertTrue(client.verify_order_amount('ORDER-1', '49.99'))
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(client.metrics.transitions, {
+            'closed->open': 1, 'open->half_open': 1, 'half_open->closed': 1,
+        })
+        self.assertEqual(client.metrics.counters['short_circuited'], 1)
+
+
+class PayPalWebhookTests(TestCase):
+    def setUp(self):
+        self.stub = StubPayPalServer().start()
+        self.addCleanup(self.stub.stop)
+        settings = override_settings(
+            PAYPAL_API_BASE=self.stub.url,
+            PAYPAL_CLIENT_ID=self.stub.client_id,
+            PAYPAL_CLIENT_SECRET=self.stub.client_secret,
+            PAYPAL_WEBHOOK_ID=self.stub.webhook_id,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.product = make_product(10)
+        self.cart = make_cart('buyer', self.product, 2)
+        self.client.force_login(self.cart.user)
+        self.stub.add_order('PAYPAL-1', '100.00', status='APPROVED')
+
+    def checkout(self, paypal_order_id='PAYPAL-1'):
+        response = self.client.post(
+            '/process-paypal-payment/', json.dumps({'orderID': paypal_order_id, 'shipping_data': {}}),
+            content_type='application/json',
+        )
+        return response.json()
+
+    def deliver(self, event, webhook_id=None):
+        return self.client.post(
+            '/paypal/webhook/', json.dumps(event), content_type='application/json',
+            headers=self.stub.webhook_headers(event, webhook_id=webhook_id),
+        )
+
+    def test_checkout_is_pending_until_capture_completes(self):
+        result = self.checkout()
+        self.assertEqual(result['status'], 'pending')
+        self.assertEqual(self.stub.counts['order_requests'], 1)
+
+        response = self.deliver(capture_event('PAYPAL-1', '100.00'))
+        self.assertEqual(response.json()['outcome'], 'processed')
+        self.assertEqual(Order.objects.get(pk=result['order_id']).status, 'completed')
+
+    def test_redelivered_event_is_applied_once(self):
+        self.checkout()
+        event = capture_event('PAYPAL-1', '100.00')
+        self.assertEqual(self.deliver(event).json()['outcome'], 'processed')
+        self.assertEqual(self.deliver(event).json()['outcome'], 'duplicate')
+        self.assertEqual(PayPalWebhookEvent.objects.count(), 1)
+
+    def test_bad_signature_is_rejected(self):
+        result = self.checkout()
+        response = self.deliver(capture_event('PAYPAL-1', '100.00'), webhook_id='forged')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(pk=result['order_id']).status, 'pending')
+        self.assertFalse(PayPalWebhookEvent.objects.exists())
+
+    def test_event_before_checkout_is_applied_when_order_arrives(self):
+        self.assertEqual(self.deliver(capture_event('PAYPAL-1', '100.00')).json()['outcome'], 'waiting')
+        result = self.checkout()
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(self.checkout(), result)
+
+    def test_amount_mismatch_goes_to_review(self):
+        result = self.checkout()
+        with self.assertLogs('store.paypal_webhooks', 'ERROR'):
+            self.deliver(capture_event('PAYPAL-1', '1.00'))
+        self.assertEqual(Order.objects.get(pk=result['order_id']).status, 'review')
+        self.assertEqual(expire_pending_orders(now=timezone.now() + timedelta(days=1)), 0)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 8)
+
+    def test_staff_cancelling_a_review_order_restocks_it(self):
+        result = self.checkout()
+        with self.assertLogs('store.paypal_webhooks', 'ERROR'):
+            self.deliver(capture_event('PAYPAL-1', '1.00'))
+        order = Order.objects.get(pk=result['order_id'])
+        self.client.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'pw'))
+        data = {
+            'user': order.user_id, 'total_amount': order.total_amount, 'payment_method': 'paypal',
+            'status': 'cancelled', 'shipping_address': 'x', 'email': 'buyer@example.com',
+            'item_count': order.item_count, 'line_count': order.line_count, 'line_summary': '[]',
+        }
+        for _ in range(2):
+            response = self.client.post(f'/admin/store/order/{order.pk}/change/', data)
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+
+    def test_capture_after_expiry_goes_to_review(self):
+        result = self.checkout()
+        expire_pending_orders(now=timezone.now() + timedelta(days=1))
+        with self.assertLogs('store.paypal_webhooks', 'ERROR'):
+            self.deliver(capture_event('PAYPAL-1', '100.00'))
+        self.assertEqual(Order.objects.get(pk=result['order_id']).status, 'review')
+
+    def test_paypal_payment_leaves_card_fields_in_the_browser(self):
+        page = self.client.get('/checkout/').content.decode()
+        # Both payment paths post the shipping fields through the helper that drops card details
+        self.assertEqual(page.count('shipping_data: shippingData()'), 2)
+        self.assertIn("'card_number', 'expiry', 'cvv'", page)
+        self.assertNotIn('new FormData(form)', page)
+
+    def test_unknown_paypal_order_takes_no_stock(self):
+        result = self.checkout('MADE-UP')
+        self.assertFalse(result['success'])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+
+    def test_paypal_order_for_another_amount_is_refused(self):
+        self.stub.add_order('PAYPAL-2', '1.00', status='APPROVED')
+        result = self.checkout('PAYPAL-2')
+        self.assertEqual(result['error'], 'Cart changed during payment')
+        self.assertFalse(Order.objects.exists())
+
+    def test_paypal_order_id_places_one_order_across_users(self):
+        self.checkout()
+        other = make_cart('other', self.product, 2)
+        self.client.force_login(other.user)
+        response = self.client.post(
+            '/process-paypal-payment/', json.dumps({'orderID': 'PAYPAL-1', 'shipping_data': {}}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 8)
+
+        # A request that got past the lookup still can't create a second order
+        with self.assertRaises(IntegrityError):
+            place_order(other.user, 'paypal', 'PAYPAL-1', {}, status='pending')
+
+    def test_stale_pending_order_is_cancelled_and_restocked(self):
+        result = self.checkout()
+        later = timezone.now() + timedelta(seconds=settings.PAYPAL_PENDING_ORDER_TTL - 60)
+        self.assertEqual(expire_pending_orders(now=later), 0)
+        later += timedelta(seconds=120)
+        self.assertEqual(expire_pending_orders(now=later), 1)
+        self.assertEqual(Order.objects.get(pk=result['order_id']).status, 'cancelled')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+
+    def test_denied_capture_cancels_and_restocks(self):
+        result = self.checkout()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 8)
+        self.deliver(capture_event('PAYPAL-1', '100.00', event_type='PAYMENT.CAPTURE.DENIED'))
+        self.assertEqual(Order.objects.get(pk=result['order_id']).status, 'cancelled')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+
+    def test_refund_cancels_and_restocks_once(self):
+        result = self.checkout()
+        self.deliver(capture_event('PAYPAL-1', '100.00'))
+        self.deliver(capture_event('PAYPAL-1', '100.00', event_type='PAYMENT.CAPTURE.REFUNDED'))
+        self.assertEqual(Order.objects.get(pk=result['order_id']).status, 'cancelled')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+
+        self.deliver(capture_event('PAYPAL-1', '100.00', event_type='PAYMENT.CAPTURE.REVERSED'))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        self.backend = task_backends['default']
+
+    def run_due(self, queues=None):
+        statuses = []
+        while (record := self.backend.claim('test-worker', queues)) is not None:
+            statuses.append(self.backend.run(record))
+        return statuses
+
+    def make_due(self):
+        QueuedTask.objects.filter(status='READY').update(run_after=timezone.now())
+
+    def test_task_is_only_queued_if_the_transaction_commits(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            flaky_task.enqueue(0)
+            raise RuntimeError('order failed')
+        self.assertFalse(QueuedTask.objects.exists())
+
+    def test_order_email_is_sent_by_the_worker_not_the_request(self):
+        cart = make_cart('a', make_product(10))
+        cart.user.email = 'a@example.com'
+        cart.user.save()
+        order = place_order(cart.user, 'card', None, {})
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(self.run_due(), ['SUCCESSFUL', 'SUCCESSFUL'])  # email, sales rollup
+        self.assertEqual(mail.outbox[0].to, ['a@example.com'])
+        self.assertIn(f'#{order.id}', mail.outbox[0].subject)
+
+    def test_failures_are_retried_then_dead_lettered(self):
+        result = flaky_task.enqueue(failures=99)
+        for attempt in range(1, self.backend.max_attempts):
+            self.assertEqual(self.run_due(), ['READY'])
+            self.assertEqual(self.run_due(), [])  # backing off
+            self.make_due()
+        self.assertEqual(self.run_due(), ['FAILED'])
+
+        result.refresh()
+        self.assertEqual(result.status, 'FAILED')
+        self.assertEqual(len(result.errors), self.backend.max_attempts)
+        dead = DeadTask.objects.get()
+        self.assertIn('RuntimeError', dead.last_error)
+
+        self.assertEqual(requeue(DeadTask.objects.all()), 1)
+        self.assertFalse(DeadTask.objects.exists())
+        self.assertEqual(QueuedTask.objects.get().status, 'READY')
+
+    def test_retry_succeeds(self):
+        result = flaky_task.enqueue(failures=1)
+        self.run_due()
+        self.make_due()
+        self.assertEqual(self.run_due(), ['SUCCESSFUL'])
+        result.refresh()
+        self.assertEqual(result.return_value, 2)
+
+    def test_queue_concurrency_limit(self):
+        for _ in range(3):
+            flaky_task.using(queue_name='email').enqueue(0)
+        limit = self.backend.queue_concurrency['email']
+        claimed = [self.backend.claim(f'worker{i}') for i in range(limit + 1)]
+        self.assertEqual(sum(record is not None for record in claimed), limit)
+
+        self.backend.run(claimed[0])
+        self.assertIsNotNone(self.backend.claim('worker'))
+        # Claims from a limited queue are serialized on its TaskQueue row
+        self.assertTrue(TaskQueue.objects.filter(name='email').exists())
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.cart = make_cart('buyer', make_product(10), 2)
+        self.client.force_login(self.cart.user)
+
+    def pay(self, key, shipping=None):
+        return self.client.post(
+            '/process-card-payment/', json.dumps({'shipping_data': shipping or {'city': 'Austin'}}),
+            content_type='application/json', headers={'Idempotency-Key': key},
+        )
+
+    def test_retry_replays_the_first_response(self):
+        first = self.pay('key-1')
+        second = self.pay('key-1')
+        self.assertTrue(first.json()['success'])
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_for_a_different_request_is_refused(self):
+        self.pay('key-1')
+        self.assertEqual(self.pay('key-1', shipping={'city': 'Boston'}).status_code, 422)
+
+    def test_checkout_page_sends_a_key_with_the_card_payment(self):
+        page = self.client.get('/checkout/').content.decode()
+        self.assertIn("fetch('/process-card-payment/'", page)
+        self.assertIn("'Idempotency-Key': cardPaymentKey", page)
+
+    def test_unexpected_error_is_not_replayed(self):
+        calls = []
+
+        def flaky_place_order(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise DatabaseError('database is locked')
+            return place_order(*args, **kwargs)
+
+        with mock.patch('store.views.place_order', flaky_place_order):
+            first = self.pay('key-1')
+            second = self.pay('key-1')
+        self.assertEqual(first.status_code, 500)
+        self.assertTrue(second.json()['success'])
+        self.assertNotIn('Idempotent-Replayed', second)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_new_key_is_a_new_request(self):
+        self.pay('key-1')
+        # Really runs again, and finds the cart already emptied by the first order
+        self.assertEqual(self.pay('key-2').json()['error'], 'Your cart is empty')
+
+
+class IdempotencyConcurrencyTests(TransactionTestCase):
+    def test_concurrent_duplicates_wait_for_the_first(self):
+        cart = make_cart('buyer', make_product(10), 2)
+        responses = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(4)
+
+        def pay():
+            try:
+                client = Client()
+                client.force_login(cart.user)
+                barrier.wait()
+                response = client.post(
+                    '/process-card-payment/', json.dumps({'shipping_data': {}}),
+                    content_type='application/json', headers={'Idempotency-Key': 'double-click'},
+                )
+                with lock:
+                    responses.append(response.json())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=pay) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(len(responses), 4)
+        self.assertTrue(all(response == responses[0] for response in responses))
+        self.assertTrue(responses[0]['success'])
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.product = make_product(1000)
+        self.user = User.objects.create_user('regular')
+
+    def order(self, lines=1):
+        cart = Cart.objects.create()
+        for size in ['XS', 'S', 'M', 'L', 'XL', 'XXL', 'One'][:lines]:
+            CartItem.objects.create(cart=cart, product=self.product, size=size, quantity=2)
+        items = list(cart.items.select_related('product'))
+        order = Order.objects.create(
+            user=self.user, total_amount='100.00', payment_method='card', shipping_address='x',
+            **Order.summarize(items),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=self.product, quantity=2, size=item.size, price=self.product.price)
+            for item in items
+        ])
+        return order
+
+    def test_checkout_stores_the_summary(self):
+        cart = make_cart('a', self.product, 3)
+        order = place_order(cart.user, 'card', None, {})
+        self.assertEqual((order.item_count, order.line_count), (3, 1))
+        self.assertEqual(order.line_summary, [{'name': 'Hot Drop', 'size': 'M', 'quantity': 3, 'total': '150.00'}])
+
+    def test_pages_cover_every_order_once(self):
+        created = [self.order().id for _ in range(23)]
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                orders, cursor = get_order_page(self.user, cursor)
+            seen += [order.id for order in orders]
+            if not cursor:
+                break
+        self.assertEqual(seen, sorted(created, reverse=True))
+
+    def test_only_long_orders_load_items(self):
+        self.order(lines=7)
+        self.order(lines=2)
+        with self.assertNumQueries(2):
+            orders, _ = get_order_page(self.user)
+            self.assertEqual(len(orders[1].items.all()), 7)
+
+    def test_history_page_queries_do_not_grow_with_orders(self):
+        for _ in range(10):
+            self.order(lines=3)
+        self.client.force_login(self.user)
+        with self.assertNumQueries(4):  # session, user, cart badge, orders
+            response = self.client.get('/order-history/')
+        self.assertContains(response, 'OLDER ORDERS', count=0)
+        self.order()
+        self.assertContains(self.client.get('/order-history/'), 'OLDER ORDERS')
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.product = make_product(1000)
+        self.staff = User.objects.create_user('finance', is_staff=True)
+        for status in ['completed', 'completed', 'cancelled']:
+            order = Order.objects.create(
+                user=self.staff, total_amount='100.00', payment_method='card', shipping_address='x', status=status,
+            )
+            OrderItem.objects.create(order=order, product=self.product, quantity=2, size='M', price='50.00')
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, size='L', price='50.00')
+
+    def export(self, **params):
+        self.client.force_login(self.staff)
+        response = self.client.get('/orders/export/', params)
+        return response, b''.join(response.streaming_content).decode() if response.streaming else None
+
+    def test_csv_has_a_row_per_line(self):
+        response, body = self.export(status='completed')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = body.splitlines()
+        self.assertEqual(rows[0].split(',')[:2], ['order_id', 'created'])
+        self.assertEqual(len(rows), 1 + 4)
+        self.assertTrue(rows[1].endswith(',2,50.00,100.00'))
+
+    def test_jsonl_has_an_object_per_order(self):
+        _, body = self.export(format='jsonl', start=timezone.localdate().isoformat())
+        orders = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([order['status'] for order in orders], ['completed', 'completed', 'cancelled'])
+        self.assertEqual(len(orders[0]['items']), 2)
+
+    def test_date_range_and_bad_filters(self):
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        _, body = self.export(start=tomorrow.isoformat())
+        self.assertEqual(len(body.splitlines()), 1)
+        self.assertEqual(self.export(start='yesterday')[0].status_code, 400)
+        self.assertEqual(self.export(status='lost')[0].status_code, 400)
+
+    def test_queries_are_per_chunk_not_per_order(self):
+        from .exports import csv_lines, export_orders, parse_filters
+        with self.assertNumQueries(3):  # one streamed order query, items for each of two chunks
+            rows = list(csv_lines(export_orders(parse_filters(), chunk_size=2)))
+        self.assertEqual(len(rows), 1 + 6)
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create_user('shopper'))
+        self.assertEqual(self.client.get('/orders/export/').status_code, 302)
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.product = make_product(1000)
+        self.user = User.objects.create_user('buyer', is_staff=True, is_superuser=True)
+
+    def order(self, status='completed', quantity=2):
+        order = Order.objects.create(
+            user=self.user, total_amount=50 * quantity, payment_method='card', shipping_address='x', status=status,
+        )
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity, size='M', price='50.00')
+        return order
+
+    def today(self):
+        return DailySales.objects.get(day=timezone.localdate())
+
+    def test_completed_order_is_counted_once(self):
+        order = self.order()
+        self.assertEqual(sync_order(order.id), 1)
+        self.assertEqual(sync_order(order.id), 0)
+        day = self.today()
+        self.assertEqual((day.orders, day.units, day.revenue), (1, 2, Decimal('100.00')))
+        line = DailyProductSales.objects.get(product=self.product, size='M')
+        self.assertEqual((line.orders, line.units, line.revenue), (1, 2, Decimal('100.00')))
+
+    def test_cancelled_order_is_taken_out(self):
+        order = self.order()
+        sync_order(order.id)
+        Order.objects.filter(pk=order.pk).update(status='cancelled')
+        self.assertEqual(sync_order(order.id), -1)
+        self.assertEqual(self.today().orders, 0)
+        self.assertEqual(self.today().revenue, 0)
+
+    def test_backfill_matches_incremental_updates(self):
+        for quantity in range(1, 8):
+            self.order(quantity=quantity)
+        self.order(status='pending')
+        sync_order(Order.objects.filter(status='completed').earliest('id').id)
+        self.assertEqual(backfill(chunk_size=3), 6)
+        self.assertEqual(backfill(chunk_size=3), 0)
+        day = self.today()
+        self.assertEqual((day.orders, day.units, day.revenue), (7, 28, Decimal('1400.00')))
+
+        self.assertEqual(backfill(chunk_size=3, rebuild=True), 7)
+        self.assertEqual(self.today().units, 28)
+
+    def test_checkout_queues_the_rollup(self):
+        cart = make_cart('a', self.product, 3)
+        order = place_order(cart.user, 'card', None, {})
+        self.assertTrue(QueuedTask.objects.filter(task_path='store.tasks.sync_order_sales', args=[order.id]).exists())
+
+    def test_admin_status_changes_move_the_rollups(self):
+        order = self.order(status='review')
+        self.client.force_login(self.user)
+        backend = task_backends['default']
+
+        def set_status(status):
+            response = self.client.post(f'/admin/store/order/{order.pk}/change/', {
+                'user': self.user.pk, 'total_amount': order.total_amount, 'payment_method': 'card',
+                'status': status, 'shipping_address': 'x', 'email': 'buyer@example.com',
+                'item_count': 2, 'line_count': 1, 'line_summary': '[]',
+            })
+            self.assertEqual(response.status_code, 302)
+            while (record := backend.claim('test-worker')) is not None:
+                backend.run(record)
+
+        set_status('completed')
+        self.assertEqual(self.today().orders, 1)
+        set_status('cancelled')
+        self.assertEqual(self.today().orders, 0)
+        self.assertFalse(Order.objects.get(pk=order.pk).sales_recorded)
+
+    def test_dashboard_reads_rollups(self):
+        sync_order(self.order().id)
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/store/dailysales/')
+        self.assertContains(response, 'Hot Drop')
+        self.assertContains(response, '$100.00')
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.hoodie, self.cap, self.tee, self.socks = (
+            make_product(100, slug=slug) for slug in ['hoodie', 'cap', 'tee', 'socks']
+        )
+
+    def order(self, *products, status='completed'):
+        order = Order.objects.create(
+            user=self.user, total_amount='1.00', payment_method='card', shipping_address='x', status=status,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, size='M', price='1.00') for product in products
+        ])
+
+    def test_lift_ranks_products_bought_together(self):
+        for _ in range(3):
+            self.order(self.hoodie, self.cap)
+        for _ in range(2):
+            self.order(self.hoodie, self.tee)
+        for _ in range(5):
+            self.order(self.tee)
+        self.order(self.hoodie, self.socks)  # below the support threshold
+        self.order(self.hoodie, self.socks, status='cancelled')
+
+        for use_numpy in [False, True] if recommendations.np is not None else [False]:
+            with self.subTest(use_numpy=use_numpy):
+                build_recommendations(use_numpy=use_numpy)
+                picks = list(
+                    ProductRecommendation.objects.filter(product=self.hoodie).values_list('recommended', 'co_orders')
+                )
+                self.assertEqual(picks, [(self.cap.id, 3), (self.tee.id, 2)])
+                # 11 orders count (not the cancelled one); 6 have the hoodie, 3 the cap, 3 both
+                score = ProductRecommendation.objects.get(product=self.cap).score
+                self.assertAlmostEqual(score, 3 * 11 / (6 * 3))
+
+    def test_product_page_reads_precomputed_picks(self):
+        for _ in range(2):
+            self.order(self.hoodie, self.cap)
+        build_recommendations(use_numpy=False)
+        get_recommendations(self.hoodie.id)  # warm the catalog
+        with self.assertNumQueries(1):
+            self.assertEqual([card['slug'] for card in get_recommendations(self.hoodie.id)], ['cap'])
+        self.assertContains(self.client.get('/product/hoodie/'), 'COMPLETE THE FIT')
+        self.assertNotContains(self.client.get('/product/socks/'), 'COMPLETE THE FIT')
+
+    @skipUnless(recommendations.np is not None, 'NumPy and SciPy are not installed')
+    def test_numpy_matches_pure_python(self):
+        import random
+        rng = random.Random(7)
+        pairs = sorted({(order, rng.randrange(30)) for order in range(500) for _ in range(rng.randrange(1, 5))})
+        self.assertEqual(score_numpy(pairs), score_python(pairs))
+
+
+    @skipUnless(recommendations.np is not None, 'NumPy and SciPy are not installed')
+    def test_lift_holds_up_at_large_order_counts(self):
+        # co-orders * orders is past 2**31, where an int32 product wraps negative
+        orders = 50_000
+        pairs = [(order, product) for order in range(orders) for product in (1, 2)]
+        pairs += [(orders + order, 3) for order in range(orders)]
+        self.assertEqual(score_numpy(pairs), {1: [(2, 2.0, orders)], 2: [(1, 2.0, orders)]})
+
+
+class PopularityTests(TestCase):
+    def setUp(self):
+        self.hoodie, self.cap, self.tee = (make_product(100, slug=slug) for slug in ['hoodie', 'cap', 'tee'])
+        self.now = timezone.now()
+        # The product page builds the catalog and caches the page; on_commit never fires here to drop them
+        self.addCleanup(invalidate_catalog)
+        self.addCleanup(cache.clear)
+
+    def trending(self, cursor=None):
+        return get_product_page(dict(parse_params({'sort': 'trending', 'limit': '1'}), cursor=cursor))
+
+    def test_batches_add_up(self):
+        popularity.write({self.hoodie.id: (2, 0)}, now=self.now)
+        popularity.write({self.hoodie.id: (1, 1), self.cap.id: (1, 0)}, now=self.now)
+        row = ProductPopularity.objects.get(product=self.hoodie)
+        self.assertEqual((row.views, row.cart_adds), (3, 1))
+        self.assertAlmostEqual(popularity.score(row.trend, self.now), 3 + popularity.CART_ADD_WEIGHT)
+
+    def test_scores_decay_by_half_life(self):
+        popularity.write({self.hoodie.id: (8, 0)}, now=self.now)
+        trend = ProductPopularity.objects.get(product=self.hoodie).trend
+        later = self.now + timedelta(seconds=2 * settings.POPULARITY_HALF_LIFE)
+        self.assertAlmostEqual(popularity.score(trend, later), 2)
+
+    def test_trending_sort_prefers_recent_activity(self):
+        old = self.now - timedelta(seconds=3 * settings.POPULARITY_HALF_LIFE)
+        popularity.write({self.hoodie.id: (40, 0)}, now=old)  # worth 5 today
+        popularity.write({self.cap.id: (6, 0)}, now=self.now)
+        seen, cursor = [], None
+        while True:
+            products, cursor, total = self.trending(cursor)
+            seen += [p['slug'] for p in products]
+            if not cursor:
+                break
+        self.assertEqual(seen, ['cap', 'hoodie', 'tee'])
+
+    def test_snapshot_keeps_popularity(self):
+        popularity.write({self.hoodie.id: (1, 0), self.cap.id: (6, 0)}, now=self.now)
+        catalog = load_database_catalog()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.bin')
+            write_snapshot(catalog, path)
+            snapshot = SnapshotCatalog(path)
+            for slug in ['hoodie', 'cap', 'tee']:
+                self.assertAlmostEqual(snapshot.by_slug.get(slug)['popularity'], catalog.by_slug[slug]['popularity'])
+
+    def test_buffer_writes_only_on_flush(self):
+        buffer = popularity.CounterBuffer(interval=3600)
+        for _ in range(5):
+            buffer.add(self.hoodie.id, views=1)
+        buffer.add(self.cap.id, cart_adds=1)
+        buffer.add(999999, views=1)  # deleted product: dropped
+        self.assertFalse(ProductPopularity.objects.exists())
+        # Products, insert missing rows, lock, one UPDATE; plus the savepoint pair
+        with self.assertNumQueries(6):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(ProductPopularity.objects.get(product=self.hoodie).views, 5)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_views_record_events(self):
+        self.tee.available_sizes = ['M']
+        self.tee.save()
+        self.client.get('/product/tee/')
+        self.client.post('/add-to-cart/', {'product_id': self.tee.id, 'size': 'M'})
+        row = ProductPopularity.objects.get(product=self.tee)
+        self.assertEqual((row.views, row.cart_adds), (1, 1))
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hoodie = make_product(100, slug='hoodie')
+        self.addCleanup(invalidate_catalog)
+        self.addCleanup(cache.clear)
+
+    def test_anonymous_pages_are_cached_and_revalidated(self):
+        first = self.client.get('/products/', {'sort': 'price-low', 'size': 'M'})
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        self.assertIn('no-cache', first['Cache-Control'])
+        with self.assertNumQueries(0):
+            again = self.client.get('/products/', {'size': 'M', 'sort': 'price-low'})
+        self.assertEqual(again['X-Page-Cache'], 'hit')
+        self.assertEqual(again['ETag'], first['ETag'])
+
+        self.assertEqual(self.client.get('/products/', {'sort': 'price-low', 'size': 'M'},
+                                         HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/products/', {'sort': 'price-low', 'size': 'M'},
+                                         HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get('/products/', {'sort': 'name'})['X-Page-Cache'], 'miss')
+
+    def test_each_visitor_gets_their_own_csrf_token(self):
+        first = self.client.get('/product/hoodie/')
+        other = Client()
+        second = other.get('/product/hoodie/')
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', second.content.decode()).group(1)
+        self.assertNotIn(page_cache.CSRF_PLACEHOLDER.decode(), second.content.decode())
+        self.assertNotIn(token, first.content.decode())
+        self.assertIn('csrftoken', second.cookies)
+
+    def test_logged_in_users_and_pending_messages_bypass(self):
+        self.client.get('/product/hoodie/')
+        visitor = Client()
+        visitor.get('/product/missing/')  # queues "Product not found"
+        self.assertNotIn('X-Page-Cache', visitor.get('/product/hoodie/'))
+
+        self.client.force_login(User.objects.create_user('shopper'))
+        self.assertNotIn('X-Page-Cache', self.client.get('/product/hoodie/'))
+
+    def test_catalog_changes_retire_cached_pages(self):
+        self.client.get('/product/hoodie/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hoodie.name = 'Renamed Hoodie'
+            self.hoodie.save()
+        response = self.client.get('/product/hoodie/')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Renamed Hoodie')
+
+    def test_cache_hits_still_count_product_views(self):
+        self.client.get('/product/hoodie/')
+        self.client.get('/product/hoodie/')
+        self.assertEqual(ProductPopularity.objects.get(product=self.hoodie).views, 2)
+
+
+class ProductCardFragmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.products = [make_product(10, slug=f'card-{i}') for i in range(3)]
+
+    def cards(self):
+        return [product_to_card(p) for p in Product.objects.select_related('category').order_by('id')]
+
+    def test_warm_grid_is_one_get_many(self):
+        render_cards(self.cards())
+        backend = caches['default']
+        with mock.patch.object(backend, 'get_many', wraps=backend.get_many) as get_many, \
+                mock.patch.object(backend, 'set_many', wraps=backend.set_many) as set_many:
+            cards = render_cards(self.cards())
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(set_many.call_count, 0)
+        self.assertIn('Card 1', cards[1][1])
+
+    def test_saving_a_product_changes_only_its_card(self):
+        before = [card_version(card) for card in self.cards()]
+        self.products[0].name = 'Renamed'
+        self.products[0].save()
+        after = [card_version(card) for card in self.cards()]
+        self.assertNotEqual(before[0], after[0])
+        self.assertEqual(before[1:], after[1:])
+        self.assertIn('Renamed', render_cards(self.cards())[0][1])
+
+    def test_badges_are_a_separate_variant(self):
+        self.products[0].featured = True
+        self.products[0].save()
+        self.assertIn('featured-badge', render_cards(self.cards())[0][1])
+        self.assertNotIn('featured-badge', render_cards(self.cards(), hide_badges=True)[0][1])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.calls = 0
+
+    def slow(self, value, delay=0.2):
+        def compute(*args):
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+
+    def test_concurrent_misses_compute_once(self):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_set('pages', 'k', self.slow('page'))))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['page'] * 8)
+        self.assertEqual(self.calls, 1)
+
+    @override_settings(CACHE_FAMILIES={'pages': {'SOFT_TTL': 0, 'HARD_TTL': 60}})
+    def test_stale_copy_is_served_while_one_caller_refreshes(self):
+        get_or_set('pages', 'k', lambda: 'old')
+        cache.add('k:lock', 'someone else')
+        self.assertEqual(get_or_set('pages', 'k', self.slow('new')), 'old')
+        self.assertEqual(self.calls, 0)
+        cache.delete('k:lock')
+        self.assertEqual(get_or_set('pages', 'k', self.slow('new', 0)), 'new')
+
+    def test_new_version_makes_entry_stale(self):
+        self.assertEqual(get_or_set('pages', 'k', lambda: 'v1', version=1), 'v1')
+        self.assertEqual(get_or_set('pages', 'k', lambda: 'v1 again', version=1), 'v1')
+        self.assertEqual(get_or_set('pages', 'k', lambda: 'v2', version=2), 'v2')
+
+    def test_uncacheable_results_are_not_stored(self):
+        self.assertIsNone(get_or_set('pages', 'k', lambda: None))
+        self.assertIsNone(cache.get('k'))
+
+    def test_local_value_serves_stale_during_rebuild(self):
+        started, release = threading.Event(), threading.Event()
+
+        def compute(build):
+            if build > 1:
+                started.set()
+                release.wait(5)
+            return build
+
+        value = LocalValue('catalog', compute)
+        self.assertEqual(value.get(), 1)
+        value.invalidate()
+        rebuilder = threading.Thread(target=value.get)
+        rebuilder.start()
+        started.wait(5)
+        self.assertEqual(value.get(), 1)  # not blocked behind the rebuild
+        release.set()
+        rebuilder.join()
+        self.assertEqual(value.get(), 2)
+
+    @override_settings(CACHE_FAMILIES={'catalog': {'VERSION_CHECK': 0}})
+    def test_local_value_invalidated_in_another_process(self):
+        # Two workers' copies of the same value, sharing a version key
+        worker_a = LocalValue('catalog', lambda build: ('a', build), version_key='test:version')
+        worker_b = LocalValue('catalog', lambda build: ('b', build), version_key='test:version')
+        self.assertEqual(worker_b.get(), ('b', 1))
+        worker_a.invalidate()
+        self.assertEqual(worker_b.get(), ('b', 2))
+        self.assertEqual(worker_b.get(), ('b', 2))
+
+    @override_settings(CACHE_FAMILIES={'catalog': {'SOFT_TTL': 0, 'VERSION_CHECK': 0}})
+    def test_local_value_keeps_its_build_number_until_invalidated(self):
+        builds = []
+        value = LocalValue('catalog', lambda build: builds.append(build) or build, version_key='test:version')
+        self.assertEqual(value.get(), 1)
+        # Past SOFT_TTL it is rebuilt, but nothing changed, so keyed work stays valid
+        self.assertEqual(value.get(), 1)
+        self.assertEqual(builds, [1, 1])
+        LocalValue('catalog', lambda build: build, version_key='test:version').invalidate()
+        self.assertEqual(value.get(), 2)
@@ -6,13 +6,21 @@ app_name = 'store'
 urlpatterns = [
     path('', views.home, name='home'),
     path('products/', views.product_list, name='product_list'),
+    path('products/page/', views.product_page, name='product_page'),
     path('category/<slug:category_slug>/', views.product_list, name='product_list_by_category'),
     path('product/<slug:slug>/', views.product_detail, name='product_detail'),
+    path('search/', views.search, name='search'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
     path('add-to-cart/', views.add_to_cart, name='add_to_cart'),
     path('cart/', views.cart_view, name='cart'),
+    path('cart/update/', views.update_cart, name='update_cart'),
+    path('cart/count/', views.cart_count, name='cart_count'),
     path('checkout/', views.checkout, name='checkout'),
     path('process-paypal-payment/', views.process_paypal_payment, name='process_paypal_payment'),
     path('process-card-payment/', views.process_card_payment, name='process_card_payment'),
+    path('orders/export/', views.export_orders, name='export_orders'),
+    path('paypal/webhook/', views.paypal_webhook, name='paypal_webhook'),
+    path('paypal/metrics/', views.paypal_metrics, name='paypal_metrics'),
     path('order-success/', views.order_success, name='order_success'),
     path('profile/', views.profile, name='profile'),
     path('order-history/', views.order_history, name='order_history'),
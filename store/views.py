@@ -1,20 +1,38 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.conf import settings
 import json
-import requests
 from .models import Product, Category, Cart, CartItem, Order, OrderItem
-from .static_data import get_featured_products, get_all_products, get_products_by_category, get_product_by_slug, get_all_categories, get_category_by_slug
+from .catalog import get_featured_products, get_product_by_slug, get_all_categories, get_category_by_slug
+from .listing import parse_params, get_product_page
+from .facets import get_facets
+from .search import search_products
+from .autocomplete import suggest, DEFAULT_RESULTS
+from .cart import get_cart, get_cart_count, apply_operations, summary_to_dict
+from . import exports
+from .checkout import place_order
+from .idempotency import idempotent
+from .inventory import reserve_cart
+from .orders import get_order_page
+from .page_cache import cached_page
+from .popularity import record_cart_add, record_view
+from .recommendations import get_recommendations
+from .paypal import PAYABLE_ORDER_STATUSES, PayPalError, get_client, metrics_snapshot, order_amount
+from .paypal_webhooks import apply_waiting_events, receive_event, verify_webhook
 
+@cached_page()
 def home(request):
     try:
         featured_products = get_featured_products()[:9]
-        categories = get_all_categories()
+        counts = {c['slug']: c['count'] for c in get_facets(parse_params({}))['categories']}
+        categories = [dict(c, count=counts.get(c['slug'], 0)) for c in get_all_categories()]
         return render(request, 'store/home.html', {
             'featured_products': featured_products,
             'categories': categories
@@ -23,6 +41,7 @@ def home(request):
         messages.error(request, 'Error loading homepage')
         return render(request, 'store/home.html', {'featured_products': [], 'categories': []})
 
+@cached_page()
 def product_list(request, category_slug=None):
     try:
         category = None
@@ -33,209 +52,250 @@ def product_list(request, category_slug=None):
             if not category:
                 messages.error(request, 'Category not found')
                 return redirect('store:product_list')
-            products = get_products_by_category(category_slug)
-        else:
-            products = get_all_products()
+        
+        params = parse_params(request.GET, category_slug)
+        products, next_cursor, total = get_product_page(params)
         
         return render(request, 'store/product_list.html', {
             'products': products,
             'category': category,
-            'categories': categories
+            'categories': categories,
+            'filters': params,
+            'facets': get_facets(params),
+            'next_cursor': next_cursor,
+            'total': total
         })
     except Exception as e:
         messages.error(request, 'Error loading products')
         return render(request, 'store/product_list.html', {'products': [], 'categories': []})
 
+def product_page(request):
+    """Return one page of product cards as HTML for the catalog's "load more" and filters"""
+    try:
+        params = parse_params(request.GET)
+        products, next_cursor, total = get_product_page(params)
+        html = render_to_string('store/product_cards.html', {'products': products}, request=request)
+        return JsonResponse({
+            'success': True,
+            'html': html,
+            'next_cursor': next_cursor,
+            'total': total,
+            'facets': get_facets(params)
+        })
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': 'Error loading products'})
+
+def search(request):
+    query = request.GET.get('q', '').strip()[:100]
+    try:
+        products = search_products(query) if query else []
+    except Exception as e:
+        messages.error(request, 'Error searching products')
+        products = []
+    return render(request, 'store/search.html', {'query': query, 'products': products})
+
+def autocomplete(request):
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_RESULTS))
+    except ValueError:
+        limit = DEFAULT_RESULTS
+    try:
+        return JsonResponse({'success': True, 'results': suggest(query, limit)})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': 'Error loading suggestions'})
+
+def _count_view(request, slug):
+    product = get_product_by_slug(slug)
+    if product:
+        record_view(product['id'])
+
+@cached_page(on_hit=_count_view)
 def product_detail(request, slug):
     try:
         product = get_product_by_slug(slug)
         if not product:
             messages.error(request, 'Product not found')
             return redirect('store:product_list')
-        return render(request, 'store/product_detail.html', {'product': product})
+        record_view(product['id'])
+        return render(request, 'store/product_detail.html', {
+            'product': product,
+            'recommendations': get_recommendations(product['id'])
+        })
     except Exception as e:
         messages.error(request, 'Product not found')
         return redirect('store:product_list')
 
-@login_required
 def add_to_cart(request):
     if request.method == 'POST':
         try:
             product_id = request.POST.get('product_id')
             size = request.POST.get('size')
-            quantity = int(request.POST.get('quantity', 1))
             
             # Validation
             if not product_id or not size:
                 return JsonResponse({'success': False, 'error': 'Missing required fields'})
             
-            if quantity <= 0 or quantity > 99:
-                return JsonResponse({'success': False, 'error': 'Invalid quantity'})
-            
-            product = get_object_or_404(Product, id=product_id)
+            cart = get_cart(request, create=True)
+            apply_operations(cart, [{
+                'op': 'add',
+                'product_id': product_id,
+                'size': size,
+                'quantity': request.POST.get('quantity', 1)
+            }])
+            record_cart_add(int(product_id))
             
-            if quantity > product.stock:
-                return JsonResponse({'success': False, 'error': 'Not enough stock available'})
-            
-            # Get or create cart
-            if request.user.is_authenticated:
-                cart, created = Cart.objects.get_or_create(user=request.user)
-            else:
-                session_key = request.session.session_key
-                if not session_key:
-                    request.session.create()
-                    session_key = request.session.session_key
-                cart, created = Cart.objects.get_or_create(session_key=session_key)
-            
-            # Add or update cart item
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart, product=product, size=size,
-                defaults={'quantity': quantity}
-            )
-            
-            if not created:
-                new_quantity = cart_item.quantity + quantity
-                if new_quantity > product.stock:
-                    return JsonResponse({'success': False, 'error': 'Not enough stock available'})
-                cart_item.quantity = new_quantity
-                cart_item.save()
-            
-            messages.success(request, f'{product.name} added to cart')
+            messages.success(request, 'Item added to cart')
             return JsonResponse({'success': True})
             
-        except ValueError:
-            return JsonResponse({'success': False, 'error': 'Invalid quantity'})
         except ValidationError as e:
-            return JsonResponse({'success': False, 'error': str(e)})
+            return JsonResponse({'success': False, 'error': e.messages[0]})
         except Exception as e:
             return JsonResponse({'success': False, 'error': 'Error adding to cart'})
     
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
-@login_required
+@require_http_methods(["POST"])
+def update_cart(request):
+    """Apply a batch of add/set/remove operations atomically and return the new summary"""
+    try:
+        data = json.loads(request.body)
+        cart = get_cart(request, create=True)
+        apply_operations(cart, data.get('operations'))
+        return JsonResponse({'success': True, 'cart': summary_to_dict(cart.get_summary())})
+    except (ValueError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Invalid request body'})
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': 'Error updating cart'})
+
+def cart_count(request):
+    try:
+        return JsonResponse({'success': True, 'count': get_cart_count(request)})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': 'Error loading cart'})
+
 def cart_view(request):
     try:
-        cart = None
-        if request.user.is_authenticated:
-            cart = Cart.objects.filter(user=request.user).first()
-        else:
-            session_key = request.session.session_key
-            if session_key:
-                cart = Cart.objects.filter(session_key=session_key).first()
-        
-        return render(request, 'store/cart.html', {'cart': cart})
+        cart = get_cart(request)
+        summary = cart.get_summary() if cart else None
+        return render(request, 'store/cart.html', {'cart': cart, 'summary': summary})
     except Exception as e:
         messages.error(request, 'Error loading cart')
-        return render(request, 'store/cart.html', {'cart': None})
+        return render(request, 'store/cart.html', {'cart': None, 'summary': None})
 
 @login_required
 def checkout(request):
     try:
-        cart = None
-        if request.user.is_authenticated:
-            cart = Cart.objects.filter(user=request.user).first()
-        else:
-            session_key = request.session.session_key
-            if session_key:
-                cart = Cart.objects.filter(session_key=session_key).first()
-        
-        if not cart or not cart.items.exists():
+        cart = get_cart(request)
+        summary = cart.get_summary() if cart else None
+        if not summary or not summary['items']:
             messages.error(request, 'Your cart is empty')
             return redirect('store:cart')
         
-        return render(request, 'store/checkout.html', {'cart': cart})
+        # Hold the stock while the shopper pays
+        reserved_until = reserve_cart(cart)
+        
+        return render(request, 'store/checkout.html', {'cart': cart, 'summary': summary, 'reserved_until': reserved_until})
+    except ValidationError as e:
+        messages.error(request, e.messages[0])
+        return redirect('store:cart')
     except Exception as e:
         messages.error(request, 'Error loading checkout')
         return redirect('store:cart')
 
 @login_required
 @require_http_methods(["POST"])
+@idempotent
 def process_paypal_payment(request):
     try:
         data = json.loads(request.body)
         order_id = data.get('orderID')
-        payment_id = data.get('paymentID')
-        amount = data.get('amount')
-        shipping_data = data.get('shipping_data', {})
+        if not order_id:
+            return JsonResponse({'success': False, 'error': 'Missing PayPal order'})
         
-        # Verify payment with PayPal
-        if verify_paypal_payment(order_id, amount):
-            # Create order in database
-            cart = Cart.objects.filter(user=request.user).first()
-            if not cart:
-                return JsonResponse({'success': False, 'error': 'Cart not found'})
-            
-            order = Order.objects.create(
-                user=request.user,
-                total_amount=amount,
-                payment_method='paypal',
-                payment_id=payment_id,
-                status='completed',
-                shipping_address=f"{shipping_data.get('address', '')}, {shipping_data.get('city', '')}, {shipping_data.get('state', '')} {shipping_data.get('zip_code', '')}",
-                email=shipping_data.get('email', ''),
-                phone=shipping_data.get('phone', '')
-            )
-            
-            # Create order items
-            for item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.product,
-                    quantity=item.quantity,
-                    size=item.size,
-                    price=item.product.price
-                )
-            
-            # Clear cart
-            cart.items.all().delete()
-            
-            return JsonResponse({'success': True, 'order_id': order.id})
-        else:
-            return JsonResponse({'success': False, 'error': 'Payment verification failed'})
-            
-    except Exception as e:
-        return JsonResponse({'success': False, 'error': str(e)})
-
-def verify_paypal_payment(order_id, expected_amount):
-    """Verify PayPal payment with PayPal API"""
-    try:
-        # Get PayPal access token
-        client_id = settings.PAYPAL_CLIENT_ID
-        client_secret = settings.PAYPAL_CLIENT_SECRET
+        # The browser may retry; the first request's order stands
+        existing = Order.objects.filter(payment_method='paypal', payment_id=order_id).first()
+        if existing and existing.user_id != request.user.id:
+            return JsonResponse({'success': False, 'error': 'This PayPal payment belongs to another order'}, status=409)
+        if existing:
+            return JsonResponse({'success': True, 'order_id': existing.id, 'status': existing.status})
         
-        # Use sandbox or live API based on settings
-        base_url = 'https://api.sandbox.paypal.com' if settings.PAYPAL_MODE == 'sandbox' else 'https://api.paypal.com'
+        # A pending order keeps its stock, so only take one PayPal knows the
+        # buyer approved, and for exactly what the cart costs
+        paypal_order = get_client().get_order(order_id)
+        if not paypal_order or paypal_order.get('status') not in PAYABLE_ORDER_STATUSES:
+            return JsonResponse({'success': False, 'error': 'PayPal has not approved this payment'})
         
-        auth_response = requests.post(
-            f'{base_url}/v1/oauth2/token',
-            headers={'Accept': 'application/json', 'Accept-Language': 'en_US'},
-            data={'grant_type': 'client_credentials'},
-            auth=(client_id, client_secret)
+        # Don't wait for the capture here: the order stays pending until its
+        # webhook arrives (or has already arrived and is applied now)
+        order = place_order(
+            request.user, 'paypal', order_id, data.get('shipping_data'),
+            expected_total=order_amount(paypal_order), status='pending'
         )
-        
-        if auth_response.status_code != 200:
-            return False
-            
-        access_token = auth_response.json()['access_token']
-        
-        # Verify order details
-        order_response = requests.get(
-            f'{base_url}/v2/checkout/orders/{order_id}',
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}'
-            }
-        )
-        
-        if order_response.status_code == 200:
-            order_data = order_response.json()
-            payment_amount = float(order_data['purchase_units'][0]['amount']['value'])
-            return abs(payment_amount - float(expected_amount)) < 0.01
-            
-        return False
+        apply_waiting_events(order_id)
+        order.refresh_from_db(fields=['status'])
+        return JsonResponse({'success': True, 'order_id': order.id, 'status': order.status})
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]})
+    except IntegrityError:
+        # Another request placed an order for this PayPal payment first
+        return JsonResponse({'success': False, 'error': 'This PayPal payment belongs to another order'}, status=409)
+    except PayPalError as e:
+        print(f"PayPal order lookup error: {e}")
+        return JsonResponse({'success': False, 'error': 'PayPal is unavailable, please try again'}, status=503)
+    except Exception as e:
+        print(f"Payment error: {e}")
+        # 5xx so an Idempotency-Key retry runs the payment again instead of replaying this
+        return JsonResponse({'success': False, 'error': 'Error processing payment'}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def paypal_webhook(request):
+    """PayPal's notifications about captures; anything but a 2xx makes PayPal redeliver"""
+    try:
+        event = json.loads(request.body)
+        if not isinstance(event, dict) or not event.get('id'):
+            return JsonResponse({'success': False, 'error': 'Invalid event'}, status=400)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid event'}, status=400)
+    
+    try:
+        if not verify_webhook(request.headers, event):
+            return JsonResponse({'success': False, 'error': 'Invalid signature'}, status=400)
+    except PayPalError as e:
+        print(f"PayPal webhook verification error: {e}")
+        return JsonResponse({'success': False, 'error': 'Verification unavailable'}, status=503)
+    
+    try:
+        outcome = receive_event(event)
+        return JsonResponse({'success': True, 'outcome': outcome})
     except Exception as e:
-        print(f"PayPal verification error: {e}")
-        return False
+        print(f"PayPal webhook processing error: {e}")
+        return JsonResponse({'success': False, 'error': 'Error processing event'}, status=500)
+
+@staff_member_required
+@require_http_methods(["GET"])
+def export_orders(request):
+    """Stream orders as CSV or JSONL: ?format=csv|jsonl&start=YYYY-MM-DD&end=YYYY-MM-DD&status=..."""
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return JsonResponse({'success': False, 'error': 'format must be csv or jsonl'}, status=400)
+    try:
+        filters = exports.parse_filters(request.GET.get('start'), request.GET.get('end'), request.GET.getlist('status'))
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]}, status=400)
+    
+    lines, content_type = exports.FORMATS[fmt]
+    response = StreamingHttpResponse(lines(exports.export_orders(filters)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{exports.export_filename(fmt, filters)}"'
+    return response
+
+@staff_member_required
+def paypal_metrics(request):
+    """PayPal call counters, circuit breaker state and latencies for this worker"""
+    return JsonResponse(metrics_snapshot())
 
 @login_required
 def order_success(request):
@@ -244,50 +304,30 @@ def order_success(request):
     return render(request, 'store/order_success.html', {'order': order})
 @login_required
 @require_http_methods(["POST"])
+@idempotent
 def process_card_payment(request):
     try:
         data = json.loads(request.body)
-        amount = data.get('amount')
-        shipping_data = data.get('shipping_data', {})
-        
-        # Create order in database (simulate successful card payment)
-        cart = Cart.objects.filter(user=request.user).first()
-        if not cart:
-            return JsonResponse({'success': False, 'error': 'Cart not found'})
-        
-        order = Order.objects.create(
-            user=request.user,
-            total_amount=amount,
-            payment_method='card',
-            payment_id='card_' + str(cart.id),
-            status='completed',
-            shipping_address=f"{shipping_data.get('address', '')}, {shipping_data.get('city', '')}, {shipping_data.get('state', '')} {shipping_data.get('zip_code', '')}",
-            email=shipping_data.get('email', ''),
-            phone=shipping_data.get('phone', '')
-        )
-        
-        # Create order items
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                size=item.size,
-                price=item.product.price
-            )
-        
-        # Clear cart
-        cart.items.all().delete()
-        
+        # Simulated card payment: charge whatever the cart totals in the database
+        order = place_order(request.user, 'card', None, data.get('shipping_data'))
         return JsonResponse({'success': True, 'order_id': order.id})
-        
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]})
     except Exception as e:
-        return JsonResponse({'success': False, 'error': str(e)})
+        print(f"Payment error: {e}")
+        # 5xx so an Idempotency-Key retry runs the payment again instead of replaying this
+        return JsonResponse({'success': False, 'error': 'Error processing payment'}, status=500)
+
 @login_required
 def profile(request):
     return render(request, 'store/profile.html', {'user': request.user})
 
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created')
-    return render(request, 'store/order_history.html', {'orders': orders})
\ No newline at end of file
+    cursor = request.GET.get('cursor')
+    orders, next_cursor = get_order_page(request.user, cursor)
+    return render(request, 'store/order_history.html', {
+        'orders': orders,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
+    })
\ No newline at end of file